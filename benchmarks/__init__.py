@@ -0,0 +1,7 @@
+"""Performance benchmarks (not part of the regular test run).
+
+    python manage.py test benchmarks --pattern="bench_*.py"
+
+Dataset sizes can be raised with environment variables, e.g.
+``BENCH_LOGS=500000``; see ``benchmarks/fleet.py``.
+"""
@@ -0,0 +1,91 @@
+"""Archiving old logs, and reading history and exports across the archive.
+
+Logs are spread over the last year; everything before the month 90 days
+ago is archived. Budgets are scaled by ``BENCH_BUDGET_SCALE``.
+"""
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from qlthietbi import archive
+from qlthietbi.exporter import export_rows
+from qlthietbi.models import OperationLog
+from qlthietbi.pagination import encode_cursor
+from qlthietbi.views import _log_list_queryset
+
+from .fleet import seed_fleet
+
+BUDGET_SCALE = float(os.environ.get('BENCH_BUDGET_SCALE', '1'))
+
+
+class LogArchiveBenchmark(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.archive_dir = tempfile.mkdtemp()
+        cls.settings_override = override_settings(QLTHIETBI_ARCHIVE_DIR=cls.archive_dir)
+        cls.settings_override.enable()
+        cls.fleet = seed_fleet()
+        before = OperationLog.objects.count()
+        started = time.perf_counter()
+        call_command('archive_logs', '--days', '90', stdout=StringIO())
+        elapsed = time.perf_counter() - started
+        moved = before - OperationLog.objects.count()
+        size = sum(path.stat().st_size for path in archive.archive_dir().glob('*.jsonl.gz'))
+        sys.stderr.write(
+            f"\nArchived {moved} of {before} logs in {elapsed:.1f}s "
+            f"({size / 1024:.0f} KiB, {size / max(moved, 1):.0f} bytes per log)\n"
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.settings_override.disable()
+        shutil.rmtree(cls.archive_dir, ignore_errors=True)
+
+    def assertFast(self, label, func, budget_ms, repeat=5):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        median = statistics.median(timings)
+        sys.stderr.write(f"{label}: median {median:.1f} ms (budget {budget_ms * BUDGET_SCALE:.0f} ms)\n")
+        self.assertLess(median, budget_ms * BUDGET_SCALE, f"{label} took {median:.1f} ms")
+
+    def test_history_pages(self):
+        """Recent pages never open the archive; archived pages read a block or two"""
+        with mock.patch.object(archive, '_open_partition', wraps=archive._open_partition) as opened:
+            logs, _ = archive.history_page(_log_list_queryset())
+        self.assertEqual(len(logs), 50)
+        self.assertEqual(opened.call_count, 0)
+        self.assertFast('history first page', lambda: archive.history_page(_log_list_queryset()), 50)
+
+        oldest = OperationLog.objects.order_by('start_time', 'id').first()
+        cursor = encode_cursor(oldest.start_time, oldest.pk)
+        logs, next_cursor = archive.history_page(_log_list_queryset(), cursor)
+        self.assertEqual(len(logs), 50)
+        self.assertIsNotNone(next_cursor)
+        self.assertFast('history first archived page', lambda: archive.history_page(_log_list_queryset(), cursor), 300)
+
+        deep = encode_cursor(timezone.now() - timedelta(days=300), 0)
+        self.assertFast('history archived page 300 days back', lambda: archive.history_page(_log_list_queryset(), deep), 300)
+
+    def test_export_of_an_archived_month(self):
+        """Exporting one archived month reads that month's file only"""
+        day = (timezone.localtime() - timedelta(days=200)).date().replace(day=1)
+        last = (archive.next_month(archive.month_start(timezone.now() - timedelta(days=200))) - timedelta(days=1)).date()
+        rows = sum(1 for _ in export_rows(day, last)) - 1
+        sys.stderr.write(f"Exported {rows} archived logs of {day:%Y-%m}\n")
+        self.assertGreater(rows, 0)
+        self.assertFast(f'export of {day:%Y-%m}', lambda: sum(1 for _ in export_rows(day, last)), 2000, repeat=3)
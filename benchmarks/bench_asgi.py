@@ -0,0 +1,180 @@
+"""Concurrent scan throughput of the async views under ASGI vs the sync views under WSGI.
+
+Models a shift change: ``BENCH_CREW`` operators scan ``BENCH_SCANS`` units
+each at the same moment, then open the dashboard and the history. The
+WSGI run serves them from a pool of ``BENCH_WSGI_THREADS`` worker threads,
+as a threaded WSGI server would. The ASGI run serves every request
+concurrently on one event loop.
+
+Both runs call the real handlers (``core.wsgi.application`` and
+``core.asgi.application``), so every middleware is included. Reported per
+run: requests per second, the p50/p95 time until a crew member is done
+(queueing included) and the peak number of live threads. Only
+correctness is asserted: timings depend on the machine, and with SQLite
+the database work is serialized either way. Writes are left out for the
+same reason, since SQLite has a single writer.
+
+The async ORM still runs each query on a thread (asgiref gives every
+request in flight its own), so in-process with SQLite the ASGI run is not
+expected to be faster. The gain in production comes from requests that
+wait on slow tablet connections: under ASGI they do not hold a worker.
+"""
+import asyncio
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from wsgiref.util import setup_testing_defaults
+
+from django.core.cache import cache
+from django.test import TransactionTestCase, override_settings
+from django.urls import path
+
+from core.asgi import application as asgi_application
+from core.wsgi import application as wsgi_application
+
+from qlthietbi import async_views
+from qlthietbi.models import DeviceUnit
+from qlthietbi.urls import urlpatterns as app_urlpatterns
+
+from .fleet import env_int, seed_fleet
+
+HOT_VIEWS = ('dashboard', 'device_detail', 'history', 'api_log_entry')
+
+# The app's URLconf with the hot paths routed to the async views
+urlpatterns = [
+    path(str(pattern.pattern), getattr(async_views, pattern.name), name=pattern.name)
+    if pattern.name in HOT_VIEWS else pattern
+    for pattern in app_urlpatterns
+]
+
+
+class ThreadSampler:
+    """Record the peak number of live threads while a run is in progress"""
+
+    def __init__(self):
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(0.002):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        # The sampler itself does not count
+        self.peak -= 1
+
+
+class AsgiVsWsgiBenchmark(TransactionTestCase):
+
+    def setUp(self):
+        seed_fleet(
+            departments=5,
+            devices_per_department=40,
+            units_per_device=4,
+            logs=env_int('BENCH_ASGI_LOGS', 20_000),
+        )
+        self.crew = env_int('BENCH_CREW', 60)
+        self.scans = env_int('BENCH_SCANS', 5)
+        self.wsgi_threads = env_int('BENCH_WSGI_THREADS', 8)
+        rng = random.Random(0)
+        codes = list(DeviceUnit.objects.values_list('qr_code', flat=True))
+        self.routes = [
+            [f'/thiet-bi/{code}/' for code in rng.sample(codes, self.scans)] + ['/', '/lich-su/']
+            for _ in range(self.crew)
+        ]
+
+    def _report(self, label, elapsed, done_times, peak_threads):
+        requests = sum(len(route) for route in self.routes)
+        done_times = sorted(done_times)
+        p95 = done_times[max(0, int(len(done_times) * 0.95) - 1)]
+        sys.stderr.write(
+            f"\n{label}: {requests} requests in {elapsed:.2f}s ({requests / elapsed:.0f} req/s), "
+            f"crew done p50 {statistics.median(done_times) * 1000:.0f} ms / p95 {p95 * 1000:.0f} ms, "
+            f"peak threads {peak_threads}\n"
+        )
+
+    @staticmethod
+    def _wsgi_get(url):
+        environ = {'PATH_INFO': url, 'HTTP_HOST': 'testserver'}
+        setup_testing_defaults(environ)
+        status = []
+        body = b''.join(wsgi_application(environ, lambda code, headers: status.append(code)))
+        return int(status[0].split()[0]), body
+
+    @staticmethod
+    async def _asgi_get(url):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': 'GET', 'scheme': 'http', 'path': url, 'raw_path': url.encode(),
+            'root_path': '', 'query_string': b'', 'headers': [(b'host', b'testserver')],
+            'server': ('testserver', 80), 'client': ('127.0.0.1', 50000),
+        }
+        sent = []
+        request_sent = False
+        disconnected = asyncio.Event()
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        await asgi_application(scope, receive, send)
+        disconnected.set()
+        body = b''.join(message.get('body', b'') for message in sent if message['type'] == 'http.response.body')
+        return sent[0]['status'], body
+
+    def _wsgi_run(self):
+        started = time.perf_counter()
+
+        def member(route):
+            for url in route:
+                status, _ = self._wsgi_get(url)
+                self.assertEqual(status, 200, url)
+            return time.perf_counter() - started
+
+        with ThreadSampler() as sampler, ThreadPoolExecutor(max_workers=self.wsgi_threads) as pool:
+            done_times = list(pool.map(member, self.routes))
+        return time.perf_counter() - started, done_times, sampler.peak
+
+    def _asgi_run(self):
+        async def storm():
+            started = time.perf_counter()
+
+            async def member(route):
+                for url in route:
+                    status, _ = await self._asgi_get(url)
+                    self.assertEqual(status, 200, url)
+                return time.perf_counter() - started
+
+            done_times = await asyncio.gather(*(member(route) for route in self.routes))
+            return time.perf_counter() - started, done_times
+
+        with ThreadSampler() as sampler:
+            elapsed, done_times = asyncio.run(storm())
+        return elapsed, done_times, sampler.peak
+
+    def test_shift_change_scans(self):
+        """A crew scanning at once: WSGI thread pool vs one ASGI event loop"""
+        cache.clear()
+        self._report(f'WSGI, {self.wsgi_threads} threads, sync views', *self._wsgi_run())
+
+        cache.clear()
+        with override_settings(ROOT_URLCONF=__name__):
+            self._report('ASGI, async views', *self._asgi_run())
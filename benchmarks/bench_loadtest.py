@@ -0,0 +1,89 @@
+"""Short run of the load-test harness against a live local server.
+
+``loadtest.py`` is meant for a real server and a long run. This suite
+starts Django's threaded live server on a seeded fleet and runs a few
+flows per simulated operator, to check that the harness works end to end
+and that every endpoint in the flow answers without errors. The report is
+written to stderr, or to ``BENCH_LOADTEST_OUTPUT`` when set.
+
+The test database is in-memory SQLite, which the live server shares as one
+connection between its threads. The server here therefore runs one request
+at a time; clients still connect concurrently, so the latencies include
+queueing. Use ``loadtest.py`` against ``runserver`` for real numbers.
+"""
+import json
+import os
+import sys
+import threading
+
+from django.core.servers.basehttp import ThreadedWSGIServer
+from django.test import LiveServerTestCase
+from django.test.testcases import LiveServerThread
+
+from qlthietbi.models import OperationLog
+
+from .fleet import env_int, seed_fleet
+from .loadtest import ENDPOINTS, LoadTest
+
+
+class SerializedWSGIServer(ThreadedWSGIServer):
+    """Threaded server that runs the application for one request at a time"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.app_lock = threading.Lock()
+
+    def get_app(self):
+        application = super().get_app()
+
+        def serialized(environ, start_response):
+            with self.app_lock:
+                result = application(environ, start_response)
+                try:
+                    return list(result)
+                finally:
+                    if hasattr(result, 'close'):
+                        result.close()
+
+        return serialized
+
+
+class SerializedLiveServerThread(LiveServerThread):
+    server_class = SerializedWSGIServer
+
+
+class LoadTestHarnessBenchmark(LiveServerTestCase):
+    server_thread_class = SerializedLiveServerThread
+
+    def setUp(self):
+        seed_fleet(
+            departments=2,
+            devices_per_department=10,
+            units_per_device=2,
+            logs=env_int('BENCH_LOADTEST_LOGS', 2_000),
+        )
+
+    def test_crew_flows(self):
+        """Concurrent operators scan, open a unit and log, with no errors"""
+        clients = env_int('BENCH_LOADTEST_CLIENTS', 4)
+        iterations = env_int('BENCH_LOADTEST_ITERATIONS', 5)
+        logs_before = OperationLog.objects.count()
+
+        report = LoadTest(self.live_server_url, clients=clients, iterations=iterations).run()
+
+        output = os.environ.get('BENCH_LOADTEST_OUTPUT')
+        if output:
+            with open(output, 'w', encoding='utf-8') as fileobj:
+                json.dump(report, fileobj, ensure_ascii=False, indent=2)
+        else:
+            sys.stderr.write('\n' + json.dumps(report, ensure_ascii=False, indent=2) + '\n')
+
+        self.assertEqual(report['errors'], 0, report['endpoints'])
+        self.assertEqual(report['endpoints']['scan']['requests'], clients * iterations)
+        self.assertEqual(report['endpoints']['device_detail']['requests'], clients * iterations)
+        self.assertTrue(set(report['endpoints']) <= set(ENDPOINTS))
+        for stats in report['endpoints'].values():
+            self.assertLessEqual(stats['latency_ms']['p50'], stats['latency_ms']['p95'])
+            self.assertLessEqual(stats['latency_ms']['p95'], stats['latency_ms']['p99'])
+        # Every flow stored exactly one log
+        self.assertEqual(OperationLog.objects.count() - logs_before, clients * iterations)
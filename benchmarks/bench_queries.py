@@ -0,0 +1,140 @@
+"""Query plans and timings of the views' main queries on a large dataset.
+
+Each check asserts that the query is answered from the index added for it
+(no full table scan, no temporary B-tree for sorting) and that the view
+stays within a time budget. Budgets are scaled by ``BENCH_BUDGET_SCALE``
+for slower machines.
+"""
+import os
+import statistics
+import sys
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import Count
+from django.test import TestCase
+from django.urls import reverse
+
+from qlthietbi.forecast import forecast
+from qlthietbi.models import Device, DeviceUnit, OperationLog
+from qlthietbi.pagination import keyset_page
+from qlthietbi.views import _log_list_queryset
+
+from .fleet import env_int, seed_fleet
+
+BUDGET_SCALE = float(os.environ.get('BENCH_BUDGET_SCALE', '1'))
+
+
+class QueryPlanBenchmark(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        started = time.perf_counter()
+        cls.fleet = seed_fleet()
+        sys.stderr.write(f"\nSeeded {cls.fleet} in {time.perf_counter() - started:.1f}s\n")
+        cls.device = Device.objects.order_by('pk').first()
+
+    def assertPlanUses(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(index, plan, plan)
+        self.assertNotIn('USE TEMP B-TREE', plan, plan)
+
+    def assertFast(self, label, func, budget_ms, repeat=5):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        median = statistics.median(timings)
+        sys.stderr.write(f"{label}: median {median:.1f} ms (budget {budget_ms * BUDGET_SCALE:.0f} ms)\n")
+        self.assertLess(median, budget_ms * BUDGET_SCALE, f"{label} took {median:.1f} ms")
+
+    def test_history_keyset_pages(self):
+        """History pages read the (-start_time, -id) index, however deep the page"""
+        self.assertPlanUses(_log_list_queryset().order_by('-start_time', '-id')[:51], 'oplog_start_time_id_idx')
+
+        # A cursor from deep in the table must cost the same as the first page
+        _, cursor = keyset_page(OperationLog.objects.all())
+        for _ in range(200):
+            _, cursor = keyset_page(OperationLog.objects.only('id', 'start_time'), cursor)
+        self.assertFast('history first page', lambda: self.client.get(reverse('history')), 150)
+        self.assertFast('history page 200', lambda: self.client.get(reverse('history'), {'cursor': cursor}), 150)
+
+    def test_dashboard_status_breakdown(self):
+        """Status counts come from the status index; a cold dashboard stays cheap"""
+        self.assertPlanUses(
+            DeviceUnit.objects.values_list('status').annotate(count=Count('id')).order_by(),
+            'unit_status_idx',
+        )
+        self.assertPlanUses(_log_list_queryset().order_by('-start_time')[:10], 'oplog_start_time_id_idx')
+
+        def cold_dashboard():
+            cache.clear()
+            self.client.get(reverse('dashboard'))
+        self.assertFast('dashboard (cold cache)', cold_dashboard, 100)
+
+    def test_device_logs_by_time(self):
+        """Per-device logs ordered by time use the (device, start_time, end_time) index"""
+        self.assertPlanUses(
+            OperationLog.objects.filter(device=self.device).order_by('-start_time')[:100],
+            'oplog_device_interval_idx',
+        )
+
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'matkhau123')
+        self.client.force_login(admin_user)
+        url = reverse('admin:qlthietbi_operationlog_changelist')
+        self.assertFast(
+            'admin changelist filtered by device',
+            lambda: self.client.get(url, {'device__id__exact': self.device.pk}),
+            500,
+        )
+
+    def test_admin_changelist_deep_pages(self):
+        """Admin log pages are located through the covering (start_time, id) index"""
+        total = OperationLog.objects.count()
+        deep_offset = total // 2
+        self.assertPlanUses(
+            OperationLog.objects.order_by('-start_time', '-pk').values_list('start_time', 'id')[deep_offset:deep_offset + 1],
+            'COVERING INDEX oplog_start_time_id_idx',
+        )
+
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'matkhau123')
+        self.client.force_login(admin_user)
+        url = reverse('admin:qlthietbi_operationlog_changelist')
+        self.assertFast('admin changelist first page', lambda: self.client.get(url), 300)
+        # Page numbers start at 1; the admin shows 100 rows per page
+        deep_page = deep_offset // 100 + 1
+        response = self.client.get(url, {'p': deep_page})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['cl'].result_list), 100)
+        self.assertFast(f'admin changelist page {deep_page}', lambda: self.client.get(url, {'p': deep_page}), 500)
+
+    def test_overlap_check(self):
+        """Both overlap candidates are single index seeks"""
+        last = OperationLog.objects.filter(device=self.device).order_by('-start_time').first()
+        start, end = last.start_time, last.end_time
+        self.assertPlanUses(
+            OperationLog.objects.filter(device=self.device, start_time__gte=start, start_time__lt=end)
+            .order_by('start_time')[:1],
+            'oplog_device_interval_idx',
+        )
+        self.assertPlanUses(
+            OperationLog.objects.filter(device=self.device, start_time__lt=start).order_by('-start_time')[:1],
+            'oplog_device_interval_idx',
+        )
+        self.assertFast('overlap check', lambda: OperationLog.find_overlap(self.device.pk, start, end), 5)
+
+    def test_maintenance_forecast_fleet(self):
+        """The forecast over tens of thousands of units fits in a dashboard refresh"""
+        target = env_int('BENCH_FORECAST_UNITS', 20_000)
+        devices = list(Device.objects.order_by('pk'))
+        extra = target - DeviceUnit.objects.count()
+        DeviceUnit.objects.bulk_create([
+            DeviceUnit(device=devices[i % len(devices)], name=f"Khối phụ {i}", qr_code=f"BENCH-X-{i}",
+                       current_hours=i % 600)
+            for i in range(max(extra, 0))
+        ], batch_size=2000)
+
+        self.assertGreater(len(forecast(horizon_days=None)), 0)
+        self.assertFast(f'forecast over {target} units (top 5)', lambda: forecast(limit=5), 500)
@@ -0,0 +1,88 @@
+"""Synthetic fleet for benchmarks and load tests"""
+import os
+import random
+from datetime import timedelta
+
+from django.db import connection
+from django.utils import timezone
+
+from qlthietbi.models import Department, Device, DeviceUnit, Location, OperationLog
+
+STATUSES = ['NORMAL', 'NORMAL', 'NORMAL', 'MAINTENANCE', 'ERROR']
+
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def seed_fleet(departments=None, devices_per_department=None, units_per_device=None, logs=None, seed=0):
+    """Bulk-create a fleet and its operation logs; returns the created counts.
+
+    Logs are spread over the last 365 days. Sizes default to the BENCH_*
+    environment variables. Units get codes ``BENCH-<device>-<n>``.
+    """
+    departments = departments or env_int('BENCH_DEPARTMENTS', 5)
+    devices_per_department = devices_per_department or env_int('BENCH_DEVICES_PER_DEPARTMENT', 40)
+    units_per_device = units_per_device or env_int('BENCH_UNITS_PER_DEVICE', 4)
+    logs = logs if logs is not None else env_int('BENCH_LOGS', 100_000)
+    rng = random.Random(seed)
+
+    depts = Department.objects.bulk_create(
+        [Department(name=f"Ngành {i}") for i in range(departments)]
+    )
+    locations = Location.objects.bulk_create(
+        [Location(name=f"Khoang {i}") for i in range(20)]
+    )
+    devices = Device.objects.bulk_create([
+        Device(department=dept, name=f"Thiết bị {dept.pk}-{i}")
+        for dept in depts
+        for i in range(devices_per_department)
+    ])
+    units = DeviceUnit.objects.bulk_create([
+        DeviceUnit(
+            device=device,
+            location=rng.choice(locations),
+            name=f"Khối {i}",
+            qr_code=f"BENCH-{device.pk}-{i}",
+            status=rng.choice(STATUSES),
+            current_hours=rng.uniform(0, 600),
+        )
+        for device in devices
+        for i in range(units_per_device)
+    ], batch_size=2000)
+
+    units_by_device = {}
+    for unit in units:
+        units_by_device.setdefault(unit.device_id, []).append(unit)
+
+    now = timezone.now()
+    batch = []
+    for _ in range(logs):
+        device = rng.choice(devices)
+        start_time = now - timedelta(minutes=rng.randrange(365 * 24 * 60))
+        duration = rng.randrange(10, 8 * 60)
+        batch.append(OperationLog(
+            device=device,
+            device_unit=rng.choice(units_by_device[device.pk]),
+            operator_name=f"Thủy thủ {rng.randrange(100)}",
+            start_time=start_time,
+            end_time=start_time + timedelta(minutes=duration),
+            duration=round(duration / 60, 2),
+            device_status=rng.choice(STATUSES),
+        ))
+        if len(batch) >= 5000:
+            OperationLog.objects.bulk_create(batch)
+            batch = []
+    OperationLog.objects.bulk_create(batch)
+
+    # Give the SQLite planner real statistics, as on a long-running database
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    return {
+        'departments': len(depts),
+        'devices': len(devices),
+        'units': len(units),
+        'logs': logs,
+    }
@@ -0,0 +1,360 @@
+"""Load test a running instance with a simulated crew scanning and logging.
+
+Each simulated operator repeats one flow against the server:
+
+    scan page -> device_detail of a random unit -> a log entry, either
+    through the form (GET then POST) or through api_log_entry (JSON)
+
+Every request is timed per endpoint. The JSON report holds latency
+percentiles (p50/p95/p99), throughput and error rates, with the run's
+settings and git revision, so runs can be compared between releases:
+
+    python manage.py runserver --noreload            # in another shell
+    python -m benchmarks.loadtest seed --logs 50000  # once, into the server's database
+    python -m benchmarks.loadtest run --clients 50 --duration 60 --output release-1.json
+    python -m benchmarks.loadtest compare release-1.json release-2.json
+
+Only the standard library is used for the client side. ``seed`` writes to
+the database of ``DJANGO_SETTINGS_MODULE``, so point it at a scratch copy.
+Each log gets its own time slot, so overlap rejections never count as
+errors. Form entries send minute-precision times in UTC, as the settings
+here do (``TIME_ZONE = 'UTC'``).
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.cookies import SimpleCookie
+from urllib.parse import quote, urlencode, urlsplit
+
+ENDPOINTS = ('scan', 'device_detail', 'log_form', 'log_form_post', 'api_log_entry')
+
+
+class Session:
+    """One operator's keep-alive connection with its cookies"""
+
+    def __init__(self, base_url, timeout):
+        parts = urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(parts.hostname, parts.port, timeout=timeout)
+        self.origin = f"{parts.scheme}://{parts.netloc}"
+        self.cookies = SimpleCookie()
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f"{key}={morsel.value}" for key, morsel in self.cookies.items())
+        # CSRF checks the referer on HTTPS and the origin everywhere
+        headers.setdefault('Referer', self.origin + path)
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException):
+            # Reconnect on the next request
+            self.connection.close()
+            raise
+        for header in response.headers.get_all('Set-Cookie') or []:
+            self.cookies.load(header)
+        return response.status, response.headers, payload
+
+    def csrf_token(self):
+        morsel = self.cookies.get('csrftoken')
+        return morsel.value if morsel else ''
+
+    def close(self):
+        self.connection.close()
+
+
+class Recorder:
+    """Thread-safe per-endpoint latencies and errors"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {name: [] for name in ENDPOINTS}
+        self.errors = {name: {} for name in ENDPOINTS}
+
+    def add(self, endpoint, seconds, error=None):
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            if error is not None:
+                self.errors[endpoint][error] = self.errors[endpoint].get(error, 0) + 1
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, round(fraction * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(recorder, elapsed):
+    endpoints = {}
+    for name in ENDPOINTS:
+        values = sorted(recorder.latencies[name])
+        if not values:
+            continue
+        failed = sum(recorder.errors[name].values())
+        endpoints[name] = {
+            'requests': len(values),
+            'errors': failed,
+            'error_rate': round(failed / len(values), 4),
+            'error_kinds': recorder.errors[name],
+            'throughput_rps': round(len(values) / elapsed, 2),
+            'latency_ms': {
+                'p50': round(percentile(values, 0.50) * 1000, 1),
+                'p95': round(percentile(values, 0.95) * 1000, 1),
+                'p99': round(percentile(values, 0.99) * 1000, 1),
+                'mean': round(statistics.fmean(values) * 1000, 1),
+                'max': round(values[-1] * 1000, 1),
+            },
+        }
+    total = sum(item['requests'] for item in endpoints.values())
+    failed = sum(item['errors'] for item in endpoints.values())
+    return {
+        'elapsed_s': round(elapsed, 2),
+        'requests': total,
+        'errors': failed,
+        'error_rate': round(failed / total, 4) if total else 0.0,
+        'throughput_rps': round(total / elapsed, 2) if elapsed else 0.0,
+        'endpoints': endpoints,
+    }
+
+
+class LoadTest:
+    """Drive ``clients`` concurrent operators until ``iterations`` flows each or ``duration`` seconds"""
+
+    def __init__(self, base_url, clients=20, iterations=None, duration=30.0, api_ratio=0.5,
+                 timeout=30.0, seed=0):
+        self.base_url = base_url.rstrip('/')
+        self.clients = clients
+        self.iterations = iterations
+        self.duration = duration
+        self.api_ratio = api_ratio
+        self.timeout = timeout
+        self.seed = seed
+        self.recorder = Recorder()
+        # Every log gets its own 2-minute slot, so no two ever overlap
+        self.slots = itertools.count()
+        self.slot_lock = threading.Lock()
+        self.base_time = datetime.now(timezone.utc).replace(microsecond=0) + timedelta(days=1)
+        self.qr_codes = []
+
+    def load_units(self):
+        """QR codes of every unit, from the offline snapshot API"""
+        session = Session(self.base_url, self.timeout)
+        try:
+            status, _, body = session.request('GET', '/api/dong-bo/du-lieu/')
+        finally:
+            session.close()
+        if status != 200:
+            raise RuntimeError(f"Snapshot API returned {status}")
+        payload = json.loads(body)
+        column = payload['fields']['units'].index('qr_code')
+        self.qr_codes = [row[column] for row in payload['units']]
+        if not self.qr_codes:
+            raise RuntimeError("The server has no units; run the seed command first")
+
+    def _slot(self):
+        with self.slot_lock:
+            index = next(self.slots)
+        start = self.base_time + timedelta(minutes=2 * index)
+        return start, start + timedelta(minutes=1)
+
+    def _timed(self, endpoint, session, method, path, expected, redirect_to=None, **kwargs):
+        started = time.perf_counter()
+        error = None
+        try:
+            status, headers, _ = session.request(method, path, **kwargs)
+            if status not in expected:
+                error = f"HTTP {status}"
+            elif redirect_to and not urlsplit(headers.get('Location', '')).path.startswith(redirect_to):
+                # The form view redirects back to itself when it rejects an entry
+                error = "rejected"
+        except (OSError, http.client.HTTPException) as exc:
+            error = type(exc).__name__
+        self.recorder.add(endpoint, time.perf_counter() - started, error)
+
+    def _flow(self, session, rng):
+        qr_code = rng.choice(self.qr_codes)
+        quoted = quote(qr_code, safe='')
+        self._timed('scan', session, 'GET', '/quet-ma/', {200})
+        self._timed('device_detail', session, 'GET', f'/thiet-bi/{quoted}/', {200})
+
+        start, end = self._slot()
+        entry = {
+            'operator_name': f'Thủy thủ {rng.randrange(100)}',
+            'device_status': rng.choice(['NORMAL', 'NORMAL', 'NORMAL', 'MAINTENANCE', 'ERROR']),
+            'notes': '',
+            'client_id': str(uuid.uuid4()),
+        }
+        if not session.csrf_token():
+            # The first page a client loads sets the CSRF cookie
+            self._timed('log_form', session, 'GET', f'/ghi-nhat-ky/{quoted}/', {200})
+        if rng.random() < self.api_ratio:
+            entry.update(start_time=start.isoformat(), end_time=end.isoformat())
+            self._timed(
+                'api_log_entry', session, 'POST', f'/api/ghi-nhat-ky/{quoted}/', {200},
+                body=json.dumps(entry).encode(),
+                headers={'Content-Type': 'application/json', 'X-CSRFToken': session.csrf_token()},
+            )
+        else:
+            self._timed('log_form', session, 'GET', f'/ghi-nhat-ky/{quoted}/', {200})
+            # The form posts local times without an offset; the server reads them in its time zone
+            entry.update(start_time=start.strftime('%Y-%m-%dT%H:%M'), end_time=end.strftime('%Y-%m-%dT%H:%M'))
+            entry['csrfmiddlewaretoken'] = session.csrf_token()
+            self._timed(
+                'log_form_post', session, 'POST', f'/ghi-nhat-ky/{quoted}/', {302},
+                redirect_to=f'/thiet-bi/{quoted}/',
+                body=urlencode(entry).encode(),
+                headers={'Content-Type': 'application/x-www-form-urlencoded'},
+            )
+
+    def _client(self, index, deadline):
+        rng = random.Random(self.seed * 100_003 + index)
+        session = Session(self.base_url, self.timeout)
+        try:
+            for count in itertools.count():
+                if self.iterations is not None and count >= self.iterations:
+                    break
+                if deadline is not None and time.perf_counter() >= deadline:
+                    break
+                self._flow(session, rng)
+        finally:
+            session.close()
+
+    def run(self):
+        """Run the load and return the report dict"""
+        if not self.qr_codes:
+            self.load_units()
+        started = time.perf_counter()
+        deadline = started + self.duration if self.iterations is None else None
+        threads = [
+            threading.Thread(target=self._client, args=(index, deadline), daemon=True)
+            for index in range(self.clients)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        report = summarize(self.recorder, time.perf_counter() - started)
+        report['config'] = {
+            'base_url': self.base_url,
+            'clients': self.clients,
+            'iterations': self.iterations,
+            'duration_s': self.duration if self.iterations is None else None,
+            'api_ratio': self.api_ratio,
+            'units': len(self.qr_codes),
+            'seed': self.seed,
+        }
+        report['started_at'] = datetime.now(timezone.utc).isoformat()
+        report['revision'] = git_revision()
+        return report
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new):
+    """Per-endpoint changes in p95 latency, throughput and error rate between two reports"""
+    rows = {}
+    for name in ENDPOINTS:
+        before, after = old['endpoints'].get(name), new['endpoints'].get(name)
+        if not before or not after:
+            continue
+        rows[name] = {
+            'p95_ms': [before['latency_ms']['p95'], after['latency_ms']['p95']],
+            'throughput_rps': [before['throughput_rps'], after['throughput_rps']],
+            'error_rate': [before['error_rate'], after['error_rate']],
+        }
+    return {'from': old.get('revision'), 'to': new.get('revision'), 'endpoints': rows}
+
+
+def _seed(args):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+    import django
+
+    django.setup()
+    from qlthietbi.models import DeviceUnit
+
+    from .fleet import seed_fleet
+
+    if DeviceUnit.objects.exists() and not args.force:
+        sys.exit("The database already has units; use --force to add a synthetic fleet anyway")
+    counts = seed_fleet(
+        departments=args.departments, devices_per_department=args.devices_per_department,
+        units_per_device=args.units_per_device, logs=args.logs, seed=args.seed,
+    )
+    print(json.dumps(counts))
+
+
+def _write(report, output):
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, 'w', encoding='utf-8') as fileobj:
+            fileobj.write(text + '\n')
+    else:
+        print(text)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed = commands.add_parser('seed', help="Seed a synthetic fleet into the configured database")
+    seed.add_argument('--departments', type=int, default=5)
+    seed.add_argument('--devices-per-department', type=int, default=40)
+    seed.add_argument('--units-per-device', type=int, default=4)
+    seed.add_argument('--logs', type=int, default=20_000)
+    seed.add_argument('--seed', type=int, default=0)
+    seed.add_argument('--force', action='store_true')
+
+    run = commands.add_parser('run', help="Run the load test and print the JSON report")
+    run.add_argument('--url', default='http://127.0.0.1:8000')
+    run.add_argument('--clients', type=int, default=20, help="Concurrent simulated operators")
+    run.add_argument('--duration', type=float, default=30.0, help="Seconds to run (ignored with --iterations)")
+    run.add_argument('--iterations', type=int, help="Flows per operator instead of a fixed duration")
+    run.add_argument('--api-ratio', type=float, default=0.5, help="Share of logs sent to the JSON API")
+    run.add_argument('--timeout', type=float, default=30.0)
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--output', help="Write the report to this file")
+
+    diff = commands.add_parser('compare', help="Compare two JSON reports")
+    diff.add_argument('old')
+    diff.add_argument('new')
+
+    args = parser.parse_args(argv)
+    if args.command == 'seed':
+        _seed(args)
+    elif args.command == 'run':
+        report = LoadTest(
+            args.url, clients=args.clients, iterations=args.iterations, duration=args.duration,
+            api_ratio=args.api_ratio, timeout=args.timeout, seed=args.seed,
+        ).run()
+        _write(report, args.output)
+        if report['errors']:
+            sys.exit(1)
+    else:
+        with open(args.old, encoding='utf-8') as old, open(args.new, encoding='utf-8') as new:
+            _write(compare(json.load(old), json.load(new)), None)
+
+
+if __name__ == '__main__':
+    main()
@@ -45,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so the time and queries of every other middleware are counted
+    'qlthietbi.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,6 +54,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # After authentication: only staff requests can be profiled
+    'qlthietbi.middleware.ProfilerMiddleware',
 ]
 
 ROOT_URLCONF = 'core.urls'
@@ -85,6 +89,20 @@ DATABASES = {
 }
 
 
+# Cache
+# The dashboard summary is cached and invalidated on every write. Use a shared
+# backend (Redis/Memcached) when running several worker processes, otherwise
+# each process only sees its own invalidations.
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'qlthietbi',
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -124,3 +142,33 @@ STATIC_URL = 'static/'
 # Media files (User uploads)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# QR images
+# Pages, the admin and label sheets render QR codes on demand at
+# /ma-qr/<code>.png|.svg, so no image files are kept. Set to True to also
+# store a PNG per unit in MEDIA_ROOT on save (for copying to other tools);
+# `python manage.py generate_qr_codes` fills in or refreshes those files.
+
+QLTHIETBI_STORE_QR_IMAGES = False
+
+# Request metrics
+# Served at /metrics to these addresses (the Prometheus scraper) and to staff users.
+# Matched against REMOTE_ADDR: behind a reverse proxy on this host every request
+# comes from 127.0.0.1, so only list addresses that reach Django directly.
+
+QLTHIETBI_METRICS_IPS = []
+
+# Request profiles
+# A staff user's request with ?profile=1 (or an X-Profile header) is run under
+# cProfile; the newest QLTHIETBI_PROFILE_KEEP profiles are kept here.
+
+QLTHIETBI_PROFILE_DIR = BASE_DIR / 'profiles'
+QLTHIETBI_PROFILE_KEEP = 50
+
+# Log archive
+# `python manage.py archive_logs` moves logs older than QLTHIETBI_ARCHIVE_AFTER_DAYS
+# (rounded down to a month start) into monthly compressed files here; history
+# and exports still read them.
+
+QLTHIETBI_ARCHIVE_DIR = BASE_DIR / 'archive'
+QLTHIETBI_ARCHIVE_AFTER_DAYS = 365
@@ -1,6 +1,104 @@
+import io
+import json
+from pathlib import Path
+
+from django import forms
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.exceptions import PermissionDenied
+from django.http import FileResponse, Http404, HttpResponse
+from django.shortcuts import render
+from django.urls import path, reverse
 from django.utils.html import format_html
-from .models import Department, Location, Device, DeviceUnit, OperationLog
+from . import profiling
+from .importer import FORMATS as IMPORT_FORMATS, ImportFileError, import_units
+from .labels import LABELS_PER_PAGE, render_pages, unit_labels, write_pdf
+from .models import DailyUsage, Department, Location, Device, DeviceUnit, OperationLog
+from .pagination import LogChangelistPaginator
+
+# How each admin's selected rows map to the units whose labels are printed
+LABEL_UNIT_FILTERS = {
+    Department: 'device__department__in',
+    Device: 'device__in',
+    Location: 'location__in',
+    DeviceUnit: 'pk__in',
+}
+# The action renders within the admin request; larger selections go to the
+# print_qr_labels command
+LABEL_ACTION_MAX_UNITS = 20 * LABELS_PER_PAGE
+
+@admin.action(description="In nhãn mã QR (PDF)")
+def print_qr_labels(modeladmin, request, queryset):
+    """Admin action: printable PDF label sheets for the units of the selected rows"""
+    units = DeviceUnit.objects.filter(**{LABEL_UNIT_FILTERS[queryset.model]: queryset})
+    units = units.order_by('device__name', 'name', 'pk').only('name', 'qr_code')
+    max_units = getattr(settings, 'QLTHIETBI_LABEL_ACTION_MAX_UNITS', LABEL_ACTION_MAX_UNITS)
+    labels = unit_labels(units[:max_units + 1])
+    if not labels:
+        modeladmin.message_user(request, "Không có khối chi tiết nào để in nhãn", level='warning')
+        return None
+    if len(labels) > max_units:
+        modeladmin.message_user(
+            request,
+            f"Chọn quá {max_units} khối để in trong trang quản trị: hãy dùng lệnh print_qr_labels",
+            level='warning',
+        )
+        return None
+
+    # Rendered serially: no process pool forked from a web worker
+    buffer = io.BytesIO()
+    write_pdf(render_pages(labels), buffer)
+    response = HttpResponse(buffer.getvalue(), content_type='application/pdf')
+    response['Content-Disposition'] = 'attachment; filename="nhan-ma-qr.pdf"'
+    return response
+
+class UnitImportForm(forms.Form):
+    file = forms.FileField(label="File CSV/XLSX")
+    dry_run = forms.BooleanField(label="Chạy thử (không ghi vào CSDL)", required=False, initial=True)
+
+    def clean_file(self):
+        upload = self.cleaned_data['file']
+        if Path(upload.name).suffix.lower().lstrip('.') not in IMPORT_FORMATS:
+            raise forms.ValidationError("Chỉ nhận file .csv hoặc .xlsx")
+        return upload
+
+class AutocompleteFilter(admin.RelatedFieldListFilter):
+    """Filter on a related object picked with the admin's autocomplete search.
+
+    The stock filter lists every device or location in the sidebar. This one
+    only loads the selected object; the related admin's search_fields find
+    the others as the user types.
+    """
+    template = 'admin/qlthietbi/autocomplete_filter.html'
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.admin_site = model_admin.admin_site
+        super().__init__(field, request, params, model, model_admin, field_path)
+
+    def field_choices(self, field, request, model_admin):
+        return []
+
+    def has_output(self):
+        return True
+
+    def autocomplete_widget(self):
+        widget = AutocompleteSelect(self.field, self.admin_site, attrs={'style': 'width: 100%'})
+        form_field = self.field.formfield(widget=widget, required=False)
+        return form_field.widget.render(self.lookup_kwarg, self.lookup_val[-1] if self.lookup_val else None)
+
+
+class AutocompleteFilterMedia:
+    """Scripts and styles for the AutocompleteFilter of a changelist"""
+
+    @property
+    def media(self):
+        return (
+            super().media
+            + AutocompleteSelect(None, self.admin_site).media
+            + forms.Media(js=['admin/js/jquery.init.js', 'autocomplete-filter.js'])
+        )
+
 
 # Register your models here.
 class DeviceUnitInline(admin.TabularInline):
@@ -13,47 +111,100 @@ class DeviceAdmin(admin.ModelAdmin):
     list_display = ('name', 'department', 'total_system_hours')
     list_filter = ('department',)
     search_fields = ('name',)
+    # Also orders the autocomplete results of the device filters
+    ordering = ('name',)
     inlines = [DeviceUnitInline]
+    actions = [print_qr_labels]
 
 class DepartmentAdmin(admin.ModelAdmin):
     list_display = ('name',)
     search_fields = ('name',)
+    actions = [print_qr_labels]
 
 class LocationAdmin(admin.ModelAdmin):
     list_display = ('name',)
     search_fields = ('name',)
+    ordering = ('name',)
+    actions = [print_qr_labels]
 
-class DeviceUnitAdmin(admin.ModelAdmin):
-    list_display = ('name', 'device', 'location', 'qr_code', 'status', 'current_hours', 'qr_image_preview')
-    list_filter = ('status', 'device', 'location')
+class DeviceUnitAdmin(AutocompleteFilterMedia, admin.ModelAdmin):
+    # No QR preview per row: each would be one more request to render an image
+    list_display = ('name', 'device', 'location', 'qr_code', 'status', 'current_hours')
+    list_filter = ('status', ('device', AutocompleteFilter), ('location', AutocompleteFilter))
+    list_select_related = ('device', 'location')
     search_fields = ('name', 'qr_code')
+    # As for the logs: no unfiltered COUNT(*), no per-status facet counts
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
     readonly_fields = ('current_hours', 'qr_image_preview')
+    actions = [print_qr_labels]
     fieldsets = (
         ('Thông tin cơ bản', {
             'fields': ('device', 'location', 'name', 'qr_code')
         }),
         ('Mã QR', {
-            'fields': ('qr_image_preview', 'qr_image'),
-            'description': 'Mã QR sẽ được tự động tạo khi lưu'
+            'fields': ('qr_image_preview',),
+            'description': 'Ảnh mã QR được tạo theo mã QR mỗi khi hiển thị'
         }),
         ('Tham số hoạt động', {
             'fields': ('current_hours', 'maintenance_threshold', 'status')
         }),
     )
     
+    change_list_template = 'admin/qlthietbi/deviceunit/change_list.html'
+
+    def get_urls(self):
+        return [
+            path('import/', self.admin_site.admin_view(self.import_view), name='qlthietbi_deviceunit_import'),
+        ] + super().get_urls()
+
+    def import_view(self, request):
+        """Upload a spreadsheet and import it in chunks, showing a per-row error report"""
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+
+        result = None
+        file_error = None
+        form = UnitImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            upload = form.cleaned_data['file']
+            fmt = Path(upload.name).suffix.lower().lstrip('.')
+            try:
+                result = import_units(upload, fmt, dry_run=form.cleaned_data['dry_run'])
+            except ImportFileError as e:
+                file_error = str(e)
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': "Nhập khối chi tiết từ file",
+            'form': form,
+            'result': result,
+            'errors': result.errors[:500] if result else [],
+            'file_error': file_error,
+        }
+        return render(request, 'admin/qlthietbi/deviceunit/import.html', context)
+
     def qr_image_preview(self, obj):
-        if obj.qr_image:
+        if obj.pk and obj.qr_code:
             return format_html(
                 '<img src="{}" width="200" height="200" />',
-                obj.qr_image.url
+                reverse('unit_qr_svg', args=[obj.qr_code])
             )
         return "Mã QR sẽ được tạo sau khi lưu lần đầu"
     qr_image_preview.short_description = "Xem trước mã QR"
 
-class OperationLogAdmin(admin.ModelAdmin):
+class OperationLogAdmin(AutocompleteFilterMedia, admin.ModelAdmin):
     list_display = ('device', 'operator_name', 'start_time', 'end_time', 'duration')
-    list_filter = ('device', 'start_time')
+    list_filter = (('device', AutocompleteFilter), 'start_time')
+    list_select_related = ('device',)
     search_fields = ('operator_name', 'device__name')
+    date_hierarchy = 'start_time'
+    # Sized for millions of rows: no full COUNT(*), no per-choice facet counts,
+    # pages found through the (start_time, id) index
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+    paginator = LogChangelistPaginator
     readonly_fields = ('duration',)
     fieldsets = (
         ('Thiết bị', {
@@ -67,8 +218,73 @@ class OperationLogAdmin(admin.ModelAdmin):
         }),
     )
 
+    change_list_template = 'admin/qlthietbi/operationlog/change_list.html'
+
+    def get_urls(self):
+        return [
+            path('profiles/', self.admin_site.admin_view(self.profiles_view), name='qlthietbi_profiles'),
+            path(
+                'profiles/<str:profile_id>/', self.admin_site.admin_view(self.profile_view),
+                name='qlthietbi_profile',
+            ),
+            path(
+                'profiles/<str:profile_id>/download/<str:suffix>/',
+                self.admin_site.admin_view(self.profile_download_view), name='qlthietbi_profile_download',
+            ),
+        ] + super().get_urls()
+
+    def _profile_context(self, request, title):
+        return {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': title,
+        }
+
+    def profiles_view(self, request):
+        """Saved request profiles (see profiling.py), newest first"""
+        context = {
+            **self._profile_context(request, "Hồ sơ hiệu năng"),
+            'profiles': profiling.list_profiles(),
+            'keep': profiling.keep_count(),
+        }
+        return render(request, 'admin/qlthietbi/operationlog/profiles.html', context)
+
+    def profile_view(self, request, profile_id):
+        """One profile: its slowest functions and the SQL of the request"""
+        path = profiling.profile_path(profile_id, '.json')
+        if path is None:
+            raise Http404("Không tìm thấy hồ sơ hiệu năng")
+        with open(path, encoding='utf-8') as fileobj:
+            summary = json.load(fileobj)
+        context = {
+            **self._profile_context(request, f"Hồ sơ {profile_id}"),
+            'profile': summary,
+            'top_functions': profiling.top_functions(profile_id),
+        }
+        return render(request, 'admin/qlthietbi/operationlog/profile.html', context)
+
+    def profile_download_view(self, request, profile_id, suffix):
+        path = profiling.profile_path(profile_id, f'.{suffix}')
+        if path is None:
+            raise Http404("Không tìm thấy hồ sơ hiệu năng")
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=path.name)
+
+class DailyUsageAdmin(admin.ModelAdmin):
+    list_display = ('day', 'device', 'device_unit', 'hours', 'log_count', 'maintenance_count', 'error_count')
+    list_filter = ('device__department', 'day')
+    date_hierarchy = 'day'
+    list_select_related = ('device', 'device_unit')
+
+    # Maintained from the operation log; use rebuild_usage_rollup to correct it
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 admin.site.register(Department, DepartmentAdmin)
 admin.site.register(Location, LocationAdmin)
 admin.site.register(Device, DeviceAdmin)
 admin.site.register(DeviceUnit, DeviceUnitAdmin)
 admin.site.register(OperationLog, OperationLogAdmin)
+admin.site.register(DailyUsage, DailyUsageAdmin)
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class QlthietbiConfig(AppConfig):
     name = 'qlthietbi'
+
+    def ready(self):
+        from . import signals  # noqa: F401
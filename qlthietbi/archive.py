@@ -0,0 +1,329 @@
+"""Cold storage for old operation logs, one compressed file per month.
+
+``archive_logs`` moves logs that started before a cutoff out of the
+``OperationLog`` table into ``QLTHIETBI_ARCHIVE_DIR``:
+
+- ``nhat-ky-YYYY-MM.jsonl.gz``: the logs that started in that local month,
+  one JSON object per line, in ``(start_time, id)`` order, compressed as one
+  gzip member per ``BLOCK_SIZE`` logs
+- ``index.json``: per month, the number of logs, the newest position, the
+  latest end time, the hours logged per device, the file size and where
+  each block starts
+
+Files are streamed, never loaded whole: reads go forward line by line, and
+the history walks a month backwards one block at a time.
+
+The hour counters and the ``DailyUsage`` rollup are left as they are;
+``reconcile_hours`` and ``rebuild_usage_rollup`` count archived logs too.
+History pages and exports read the months their range reaches, so archived
+logs still show there.
+"""
+import bisect
+import gzip
+import heapq
+import itertools
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Device, DeviceUnit, OperationLog
+from .pagination import PAGE_SIZE, _page_queryset, _split_page, decode_cursor
+
+FIELDS = (
+    'id', 'device_id', 'device_unit_id', 'operator_name', 'start_time', 'end_time',
+    'duration', 'device_status', 'notes', 'client_id',
+)
+INDEX_FILE = 'index.json'
+DEFAULT_AFTER_DAYS = 365
+# Logs per gzip member of a month's file
+BLOCK_SIZE = 1000
+
+
+def archive_dir():
+    return Path(getattr(settings, 'QLTHIETBI_ARCHIVE_DIR', Path(settings.BASE_DIR) / 'archive'))
+
+
+def archive_after_days():
+    return getattr(settings, 'QLTHIETBI_ARCHIVE_AFTER_DAYS', DEFAULT_AFTER_DAYS)
+
+
+def month_key(moment):
+    """``YYYY-MM`` of the local month ``moment`` falls in"""
+    return timezone.localtime(moment).strftime('%Y-%m')
+
+
+def month_start(moment):
+    """Aware datetime at 00:00 on the first day of ``moment``'s local month"""
+    local = timezone.localtime(moment)
+    return timezone.make_aware(datetime(local.year, local.month, 1))
+
+
+def next_month(moment):
+    local = timezone.localtime(moment)
+    year, month = divmod(local.year * 12 + local.month, 12)
+    return timezone.make_aware(datetime(year, month + 1, 1))
+
+
+def partition_path(month):
+    return archive_dir() / f'nhat-ky-{month}.jsonl.gz'
+
+
+def _position(record):
+    return record['start_time'], record['id']
+
+
+def _encode(record):
+    record = dict(record)
+    record['start_time'] = record['start_time'].isoformat()
+    record['end_time'] = record['end_time'].isoformat()
+    if record['client_id'] is not None:
+        record['client_id'] = str(record['client_id'])
+    return record
+
+
+def _decode(record):
+    record['start_time'] = datetime.fromisoformat(record['start_time'])
+    record['end_time'] = datetime.fromisoformat(record['end_time'])
+    return record
+
+
+def _replace(path, write):
+    """Call ``write(fileobj)`` on a temporary file, then move it over ``path``"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile('wb', dir=path.parent, prefix='.tmp-', delete=False) as fileobj:
+        try:
+            write(fileobj)
+            fileobj.flush()
+            os.fsync(fileobj.fileno())
+        except BaseException:
+            os.unlink(fileobj.name)
+            raise
+    os.replace(fileobj.name, path)
+
+
+def read_index():
+    """``{month: entry}`` of the archived months; empty when nothing was archived"""
+    try:
+        with open(archive_dir() / INDEX_FILE, encoding='utf-8') as fileobj:
+            return json.load(fileobj)
+    except FileNotFoundError:
+        return {}
+
+
+def _open_partition(month):
+    try:
+        return open(partition_path(month), 'rb')
+    except FileNotFoundError:
+        return None
+
+
+def _blocks(entry, size):
+    """``[((start_time, id) of its first log, offset)]`` of a month's blocks.
+
+    None when the index does not describe the file on disk (an interrupted
+    write), in which case the file is read from the start.
+    """
+    if not entry or entry.get('size') != size:
+        return None
+    return [((datetime.fromisoformat(start), pk), offset) for start, pk, offset in entry['blocks']]
+
+
+def read_partition(month, entry=None, start=None):
+    """Stream a month's records in ``(start_time, id)`` order.
+
+    With the month's index ``entry`` and a ``start`` datetime, reading
+    begins at the block holding the first log from ``start`` on; earlier
+    logs of that block are still yielded.
+    """
+    fileobj = _open_partition(month)
+    if fileobj is None:
+        return
+    with fileobj:
+        blocks = _blocks(entry, os.fstat(fileobj.fileno()).st_size) if start else None
+        if blocks:
+            first = bisect.bisect_left([position for position, _ in blocks], (start, 0))
+            fileobj.seek(blocks[max(first - 1, 0)][1])
+        with gzip.GzipFile(fileobj=fileobj, mode='rb') as archive:
+            for line in archive:
+                yield _decode(json.loads(line))
+
+
+def _read_backwards(month, entry, position=None):
+    """A month's records in ``(-start_time, -id)`` order, before ``position`` if given"""
+    fileobj = _open_partition(month)
+    if fileobj is None:
+        return
+    with fileobj:
+        size = os.fstat(fileobj.fileno()).st_size
+        blocks = _blocks(entry, size) or [(None, 0)]
+        ends = [offset for _, offset in blocks[1:]] + [size]
+        spans = list(zip((offset for _, offset in blocks), ends))
+        if position and blocks[0][0] is not None:
+            # Blocks starting at or after the position hold nothing before it
+            spans = spans[:bisect.bisect_left([first for first, _ in blocks], position)]
+        for offset, end in reversed(spans):
+            fileobj.seek(offset)
+            block = [_decode(json.loads(line)) for line in gzip.decompress(fileobj.read(end - offset)).splitlines()]
+            for record in reversed(block):
+                if position is None or _position(record) < position:
+                    yield record
+
+
+def write_partition(month, rows):
+    """Merge logs (``values(*FIELDS)`` dicts) into a month's file and the index.
+
+    ``rows`` must be in ``(start_time, id)`` order; they and the records
+    already in the file are streamed into the new file, so neither is held
+    in memory. A record at the same position as a new row is replaced by
+    it, so an interrupted run can be repeated. Returns the month's index
+    entry.
+    """
+    merged = heapq.merge(rows, read_partition(month), key=_position)
+    entry = {'count': 0, 'hours': {}, 'blocks': []}
+
+    def write(fileobj):
+        block, newest, last_end = None, None, None
+        for record in merged:
+            position = _position(record)
+            if newest and position == _position(newest):
+                # The archived copy of a log archived again; the new row came first
+                continue
+            if entry['count'] % BLOCK_SIZE == 0:
+                if block:
+                    block.close()
+                entry['blocks'].append([record['start_time'].isoformat(), record['id'], fileobj.tell()])
+                # mtime=0 keeps the file identical for identical contents
+                block = gzip.GzipFile(fileobj=fileobj, mode='wb', mtime=0)
+            block.write(json.dumps(_encode(record), ensure_ascii=False).encode() + b'\n')
+            entry['count'] += 1
+            newest = record
+            last_end = max(last_end or record['end_time'], record['end_time'])
+            if record['duration']:
+                key = str(record['device_id'])
+                entry['hours'][key] = entry['hours'].get(key, 0.0) + record['duration']
+        block.close()
+        entry['size'] = fileobj.tell()
+        entry['newest'] = [newest['start_time'].isoformat(), newest['id']]
+        entry['last_end'] = last_end.isoformat()
+
+    _replace(partition_path(month), write)
+
+    index = read_index()
+    index[month] = entry
+    _replace(archive_dir() / INDEX_FILE, lambda fileobj: fileobj.write(
+        json.dumps(index, ensure_ascii=False, indent=1, sort_keys=True).encode()
+    ))
+    return entry
+
+
+def hours_by_device():
+    """``{device_id: hours}`` logged by the archived logs"""
+    totals = {}
+    for entry in read_index().values():
+        for device_id, hours in entry['hours'].items():
+            totals[int(device_id)] = totals.get(int(device_id), 0.0) + hours
+    return totals
+
+
+def records(start=None, end=None, ends_after=None):
+    """Archived records in chronological order.
+
+    Only logs with ``start <= start_time < end`` and, with ``ends_after``,
+    ``end_time > ends_after``; months outside the range are not read.
+    """
+    index = read_index()
+    for month in sorted(index):
+        if start and month < month_key(start):
+            continue
+        if end and month > month_key(end - timedelta(microseconds=1)):
+            break
+        if ends_after and datetime.fromisoformat(index[month]['last_end']) <= ends_after:
+            continue
+        for record in read_partition(month, index[month], start):
+            if start and record['start_time'] < start:
+                continue
+            if end and record['start_time'] >= end:
+                break
+            if ends_after and record['end_time'] <= ends_after:
+                continue
+            yield record
+
+
+def newest_position():
+    """``(start_time, id)`` of the newest archived log, or None"""
+    entries = read_index().values()
+    if not entries:
+        return None
+    return max((datetime.fromisoformat(entry['newest'][0]), entry['newest'][1]) for entry in entries)
+
+
+def records_before(position=None):
+    """Archived records in ``(-start_time, -id)`` order, after ``position`` if given"""
+    index = read_index()
+    for month in sorted(index, reverse=True):
+        if position and month > month_key(position[0]):
+            continue
+        yield from _read_backwards(month, index[month], position)
+
+
+def as_logs(archived):
+    """Unsaved ``OperationLog`` instances shaped like ``_log_list_queryset()`` rows.
+
+    ``device``, ``device_unit`` and ``detail_qr_code`` are set with at most
+    three queries. Logs whose device or unit has since been deleted are dropped,
+    as the database would have cascaded the delete to them.
+    """
+    archived = list(archived)
+    devices = Device.objects.in_bulk({record['device_id'] for record in archived})
+    units = DeviceUnit.objects.in_bulk({record['device_unit_id'] for record in archived if record['device_unit_id']})
+    first_units = {}
+    unitless = {record['device_id'] for record in archived if not record['device_unit_id']}
+    if unitless:
+        # Highest pk first, so the lowest one is written last
+        for device_id, qr_code in DeviceUnit.objects.filter(device_id__in=unitless).order_by('-pk').values_list('device_id', 'qr_code'):
+            first_units[device_id] = qr_code
+
+    logs = []
+    for record in archived:
+        device = devices.get(record['device_id'])
+        unit = units.get(record['device_unit_id'])
+        if device is None or (record['device_unit_id'] and unit is None):
+            continue
+        log = OperationLog(**record)
+        log.device = device
+        log.device_unit = unit
+        log.detail_qr_code = unit.qr_code if unit else first_units.get(device.pk)
+        logs.append(log)
+    return logs
+
+
+def _merge_page(items, cursor, page_size):
+    newest = newest_position()
+    # The live rows fill the page unless the archive holds a log newer than the last of them
+    if newest is not None and (len(items) <= page_size or (items[-1].start_time, items[-1].pk) < newest):
+        position = decode_cursor(cursor) if cursor else None
+        archived = as_logs(itertools.islice(records_before(position), page_size + 1))
+        merged = heapq.merge(items, archived, key=lambda log: (log.start_time, log.pk), reverse=True)
+        items = list(itertools.islice(merged, page_size + 1))
+    return _split_page(items, page_size)
+
+
+def history_page(queryset, cursor=None, page_size=PAGE_SIZE):
+    """``keyset_page`` over the live logs and the archive together.
+
+    The archive is only read once a page reaches past the live rows, so
+    recent pages cost the same single query as before.
+    """
+    return _merge_page(list(_page_queryset(queryset, cursor, page_size)), cursor, page_size)
+
+
+async def ahistory_page(queryset, cursor=None, page_size=PAGE_SIZE):
+    """Async variant of ``history_page``; the archive is read in a worker thread"""
+    items = [item async for item in _page_queryset(queryset, cursor, page_size)]
+    return await sync_to_async(_merge_page)(items, cursor, page_size)
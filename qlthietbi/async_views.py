@@ -0,0 +1,113 @@
+"""Async versions of the views hit hardest when a crew scans at shift change.
+
+Under ASGI (``core/asgi.py``) a request waiting on the database or the
+cache no longer holds a worker thread. Reads use the async ORM and cache
+APIs; writes go through ``sync_to_async``, since ``OperationLog.save``
+runs in a transaction and fires signals, and Django only runs
+transactions in sync code. Responses are identical to the sync views in
+``views.py``.
+
+The URLconf routes to these views when ``QLTHIETBI_ASYNC_VIEWS = True``.
+Leave it off under WSGI: there each async view needs its own event loop,
+which makes it slower than the sync view.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db.models import Count
+from django.http import Http404, JsonResponse
+from django.shortcuts import render
+from django.views.decorators.http import require_http_methods
+
+from .archive import ahistory_page
+from .cache import DASHBOARD_CACHE_KEY, DASHBOARD_CACHE_TIMEOUT, aget_unit_payload
+from .forecast import forecast
+from .models import DeviceUnit, OperationLog
+from .views import DASHBOARD_DUE_SOON, _log_list_queryset, _log_result, _parse_log_data, _save_unless_overlapping
+
+
+async def _build_dashboard_summary():
+    status_counts = {
+        status: count async for status, count in
+        DeviceUnit.objects.values_list('status').annotate(count=Count('id')).order_by()
+    }
+    return {
+        'normal_count': status_counts.get('NORMAL', 0),
+        'maintenance_count': status_counts.get('MAINTENANCE', 0),
+        'error_count': status_counts.get('ERROR', 0),
+        # A NumPy computation over two queries; it runs only when the cache is cold
+        'due_soon': await sync_to_async(forecast)(limit=DASHBOARD_DUE_SOON),
+        'recent_logs': [log async for log in _log_list_queryset().order_by('-start_time')[:10]],
+    }
+
+
+@require_http_methods(["GET"])
+async def dashboard(request):
+    """Dashboard view - shows summary cards and recent logs"""
+    context = await cache.aget(DASHBOARD_CACHE_KEY)
+    if context is None:
+        context = await _build_dashboard_summary()
+        await cache.aset(DASHBOARD_CACHE_KEY, context, DASHBOARD_CACHE_TIMEOUT)
+    return render(request, 'qlthietbi/dashboard.html', context)
+
+
+@require_http_methods(["GET"])
+async def device_detail(request, qr_code):
+    """Device detail view - shows device and units after QR scan"""
+    payload = await aget_unit_payload(qr_code)
+    if payload is None:
+        raise Http404("Không tìm thấy thiết bị")
+    return render(request, 'qlthietbi/device_detail.html', payload)
+
+
+@require_http_methods(["GET"])
+async def history(request):
+    """History view - displays operation logs, one keyset page at a time"""
+    logs, next_cursor = await ahistory_page(_log_list_queryset(), request.GET.get('cursor'))
+    context = {
+        'logs': logs,
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('cursor'),
+    }
+    return render(request, 'qlthietbi/history.html', context)
+
+
+@require_http_methods(["POST"])
+async def api_log_entry(request, qr_code):
+    """API endpoint for submitting operation logs (AJAX support for offline sync)"""
+    try:
+        payload = await aget_unit_payload(qr_code)
+        if payload is None:
+            return JsonResponse({'success': False, 'message': 'Không tìm thấy thiết bị'}, status=404)
+        device_unit = payload['device_unit']
+        device = payload['device']
+
+        try:
+            data = json.loads(request.body)
+        except json.JSONDecodeError:
+            return JsonResponse({'success': False, 'message': 'Invalid JSON'}, status=400)
+
+        fields, error = _parse_log_data(data)
+        if error:
+            return JsonResponse({'success': False, 'message': error}, status=400)
+
+        # A retry of a stored submission gets the original result; counters stay as they are
+        if fields['client_id']:
+            existing = await OperationLog.objects.filter(client_id=fields['client_id']).afirst()
+            if existing:
+                return JsonResponse(_log_result(existing, created=False))
+
+        # The overlap check and the insert share one transaction, which needs a sync thread
+        log, created, overlap = await sync_to_async(_save_unless_overlapping)(
+            OperationLog(device=device, device_unit=device_unit, **fields)
+        )
+        if overlap:
+            return JsonResponse(
+                {'success': False, 'message': overlap.overlap_message(), 'conflict_log_id': overlap.id},
+                status=409
+            )
+        return JsonResponse(_log_result(log, created))
+
+    except Exception as e:
+        return JsonResponse({'success': False, 'message': f'Lỗi: {str(e)}'}, status=500)
@@ -0,0 +1,97 @@
+"""Cache keys and invalidation for read-heavy pages and QR scans.
+
+Entries are deleted immediately and again when the surrounding transaction
+commits, so a reader racing with an uncommitted write cannot re-populate
+the cache with data that is about to change.
+"""
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Device, DeviceUnit
+
+DASHBOARD_CACHE_KEY = 'qlthietbi:dashboard'
+# Safety net only: every write that changes the dashboard invalidates it
+DASHBOARD_CACHE_TIMEOUT = 600
+
+# Scan payloads are invalidated on every write to the unit, its device,
+# its siblings, their locations and the device's logs
+UNIT_CACHE_TIMEOUT = 3600
+
+
+def _delete(*keys):
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_dashboard():
+    """Drop the cached dashboard summary"""
+    _delete(DASHBOARD_CACHE_KEY)
+
+
+def unit_cache_key(qr_code):
+    return f'qlthietbi:unit:{qr_code}'
+
+
+def get_unit_payload(qr_code):
+    """Everything a scan shows, or None if the code is unknown.
+
+    Returns ``{'device_unit', 'device', 'all_units'}`` with the device's
+    department and every unit's location loaded. A hit costs one cache
+    lookup; a miss costs two queries (the unit with its device, then the
+    sibling units).
+    """
+    key = unit_cache_key(qr_code)
+    payload = cache.get(key)
+    if payload is None:
+        device_unit = (
+            DeviceUnit.objects.select_related('device__department', 'location')
+            .filter(qr_code=qr_code).first()
+        )
+        if device_unit is None:
+            return None
+        device = device_unit.device
+        payload = {
+            'device_unit': device_unit,
+            'device': device,
+            'all_units': list(device.units.select_related('location').order_by('pk')),
+        }
+        cache.set(key, payload, UNIT_CACHE_TIMEOUT)
+    return payload
+
+
+async def aget_unit_payload(qr_code):
+    """Async variant of ``get_unit_payload``, with the same cache entries"""
+    key = unit_cache_key(qr_code)
+    payload = await cache.aget(key)
+    if payload is None:
+        device_unit = await (
+            DeviceUnit.objects.select_related('device__department', 'location')
+            .filter(qr_code=qr_code).afirst()
+        )
+        if device_unit is None:
+            return None
+        device = device_unit.device
+        payload = {
+            'device_unit': device_unit,
+            'device': device,
+            'all_units': [unit async for unit in device.units.select_related('location').order_by('pk')],
+        }
+        await cache.aset(key, payload, UNIT_CACHE_TIMEOUT)
+    return payload
+
+
+def invalidate_units(qr_codes):
+    """Drop the scan payloads of these QR codes"""
+    keys = [unit_cache_key(qr_code) for qr_code in qr_codes if qr_code]
+    if keys:
+        _delete(*keys)
+
+
+def invalidate_devices(device_ids):
+    """Bump the version of these devices and drop the scan payloads of their units.
+
+    ``device_ids`` is a list of ids or a ``values()`` subquery. The version is
+    bumped first, so a payload cached in between carries the new version.
+    """
+    Device.bump_versions(device_ids)
+    invalidate_units(DeviceUnit.objects.filter(device_id__in=device_ids).values_list('qr_code', flat=True))
@@ -0,0 +1,190 @@
+"""Streaming export of OperationLog rows to CSV/XLSX.
+
+Rows are read with ``values_list(...).iterator(chunk_size=...)`` joined with
+device, unit, department and location, so memory use stays constant no
+matter how many logs are exported. Archived months the date range reaches
+are merged in, in the same order.
+"""
+import csv
+import heapq
+import itertools
+from datetime import datetime, time, timedelta
+
+from django.utils import dateparse, timezone
+
+from . import archive
+from .models import Device, DeviceUnit, OperationLog
+
+FORMATS = ('csv', 'xlsx')
+CHUNK_SIZE = 2000
+
+# Excel's limit per sheet, header row included
+XLSX_SHEET_ROWS = 1_048_576
+# XLSX cannot be streamed, so the export view builds it within the request;
+# larger exports go to CSV or the export_logs command
+XLSX_VIEW_MAX_ROWS = 100_000
+
+COLUMNS = [
+    ('id', 'ID'),
+    ('start_time', 'Giờ nổ máy'),
+    ('end_time', 'Giờ tắt máy'),
+    ('duration', 'Giờ hoạt động (h)'),
+    ('device__department__name', 'Ngành'),
+    ('device__name', 'Thiết bị'),
+    ('device_unit__name', 'Khối'),
+    ('device_unit__qr_code', 'Mã QR'),
+    ('device_unit__location__name', 'Vị trí'),
+    ('operator_name', 'Người thực hiện'),
+    ('device_status', 'Trạng thái'),
+    ('notes', 'Ghi chú'),
+]
+STATUS_LABELS = dict(OperationLog.DEVICE_STATUS_CHOICES)
+
+
+class ExportTooLargeError(ValueError):
+    """More logs than an XLSX export may hold"""
+
+
+def day_start(day):
+    """Aware datetime at 00:00 of ``day`` in the current time zone"""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def parse_date(value):
+    """Parse an optional YYYY-MM-DD filter value; raises ValueError if malformed"""
+    if not value:
+        return None
+    parsed = dateparse.parse_date(value)
+    if parsed is None:
+        raise ValueError(value)
+    return parsed
+
+
+def export_queryset(date_from=None, date_to=None, department_id=None):
+    """Logs in chronological order; dates are inclusive and filter on start_time"""
+    logs = OperationLog.objects.order_by('start_time', 'id')
+    if date_from:
+        logs = logs.filter(start_time__gte=day_start(date_from))
+    if date_to:
+        logs = logs.filter(start_time__lt=day_start(date_to + timedelta(days=1)))
+    if department_id:
+        logs = logs.filter(device__department_id=department_id)
+    return logs
+
+
+def archived_rows(date_from=None, date_to=None, department_id=None):
+    """Archived logs as ``COLUMNS`` tuples, filtered and ordered like ``export_queryset``"""
+    start = day_start(date_from) if date_from else None
+    end = day_start(date_to + timedelta(days=1)) if date_to else None
+    devices = units = None
+    for record in archive.records(start, end):
+        if devices is None:
+            # Names are joined as they are now, as for the live rows
+            devices = {
+                pk: (name, department_id, department)
+                for pk, name, department_id, department in
+                Device.objects.values_list('pk', 'name', 'department_id', 'department__name')
+            }
+            units = {
+                pk: (name, qr_code, location)
+                for pk, name, qr_code, location in
+                DeviceUnit.objects.values_list('pk', 'name', 'qr_code', 'location__name')
+            }
+        device = devices.get(record['device_id'])
+        unit = units.get(record['device_unit_id'], (None, None, None))
+        # The database would have cascaded the delete of a device or unit to its logs
+        if device is None or (record['device_unit_id'] and unit[0] is None):
+            continue
+        if department_id and device[1] != department_id:
+            continue
+        values = dict(
+            record,
+            device__department__name=device[2],
+            device__name=device[0],
+            device_unit__name=unit[0],
+            device_unit__qr_code=unit[1],
+            device_unit__location__name=unit[2],
+        )
+        yield tuple(values[name] for name, _ in COLUMNS)
+
+
+def export_rows(date_from=None, date_to=None, department_id=None):
+    """``iter_rows`` over the live and the archived logs in the range"""
+    return iter_rows(
+        export_queryset(date_from, date_to, department_id),
+        archived=archived_rows(date_from, date_to, department_id),
+    )
+
+
+def check_export_size(max_rows, date_from=None, date_to=None, department_id=None):
+    """Raise ``ExportTooLargeError`` if the range holds more than ``max_rows`` logs.
+
+    Counts at most ``max_rows + 1`` logs, so a huge range costs no more
+    than a permitted one.
+    """
+    live = export_queryset(date_from, date_to, department_id).order_by()[:max_rows + 1].count()
+    archived = sum(1 for _ in itertools.islice(archived_rows(date_from, date_to, department_id), max_rows + 1 - live))
+    if live + archived > max_rows:
+        raise ExportTooLargeError(
+            f"Quá {max_rows} nhật ký cho một file XLSX: hãy xuất CSV hoặc dùng lệnh export_logs"
+        )
+
+
+def _format(value):
+    if isinstance(value, datetime):
+        return timezone.localtime(value).strftime('%Y-%m-%d %H:%M:%S')
+    return '' if value is None else value
+
+
+def iter_rows(logs, chunk_size=CHUNK_SIZE, archived=()):
+    """Yield the header, then one formatted row per log.
+
+    ``archived`` rows (see ``archived_rows``) are merged into the
+    chronological order of ``logs``.
+    """
+    yield [label for _, label in COLUMNS]
+    names = [name for name, _ in COLUMNS]
+    status_index = names.index('device_status')
+    start_index, id_index = names.index('start_time'), names.index('id')
+    live = logs.values_list(*names).iterator(chunk_size=chunk_size)
+    for row in heapq.merge(live, archived, key=lambda row: (row[start_index], row[id_index])):
+        row = [_format(value) for value in row]
+        row[status_index] = STATUS_LABELS.get(row[status_index], row[status_index])
+        yield row
+
+
+class _Echo:
+    """File-like object whose write() returns the line instead of storing it"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    """Encode rows as CSV lines, starting with a BOM so Excel detects UTF-8"""
+    writer = csv.writer(_Echo())
+    yield '\ufeff'
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def write_xlsx(rows, fileobj):
+    """Write rows to ``fileobj`` with openpyxl's write-only (streaming) workbook.
+
+    The first row is the header. A sheet holds at most ``XLSX_SHEET_ROWS``
+    rows; further logs go on new sheets, each starting with the header.
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    rows = iter(rows)
+    header = next(rows)
+    per_sheet = XLSX_SHEET_ROWS - 1
+    sheet = workbook.create_sheet(title="Nhật ký vận hành")
+    sheet.append(header)
+    for count, row in enumerate(rows):
+        if count and count % per_sheet == 0:
+            sheet = workbook.create_sheet(title=f"Nhật ký vận hành ({count // per_sheet + 1})")
+            sheet.append(header)
+        sheet.append(row)
+    workbook.save(fileobj)
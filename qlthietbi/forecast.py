@@ -0,0 +1,139 @@
+"""Maintenance forecasting for the whole fleet.
+
+Every unit of a device runs with it (see ``OperationLog.add_hours``), so a
+unit's usage rate is its device's recent hours per day. Rates come from
+one grouped query over the last ``window_days`` of logs; the projection
+for all units is then computed with NumPy arrays:
+
+    days_left = (maintenance_threshold - current_hours) / rate
+
+Units already past their threshold are due now (``days_left == 0``);
+units whose device has not run recently have no projected date and are
+left out. A date too far off for ``datetime.date`` is ``None``.
+"""
+from dataclasses import dataclass
+from datetime import timedelta
+
+import numpy as np
+from django.db.models import Min, Sum
+from django.utils import timezone
+
+from .models import DeviceUnit, OperationLog
+
+WINDOW_DAYS = 30
+HORIZON_DAYS = 30
+# A device seen for the first time today is rated over at least one day
+MIN_SPAN_DAYS = 1.0
+
+
+@dataclass
+class UnitForecast:
+    unit_id: int
+    device_id: int
+    current_hours: float
+    maintenance_threshold: float
+    hours_per_day: float
+    days_left: float
+    due_date: object
+    unit: object = None
+
+    @property
+    def overdue(self):
+        return self.current_hours >= self.maintenance_threshold
+
+    def as_dict(self):
+        return {
+            'unit_id': self.unit_id,
+            'device_id': self.device_id,
+            'qr_code': self.unit.qr_code if self.unit else None,
+            'unit': self.unit.name if self.unit else None,
+            'device': self.unit.device.name if self.unit else None,
+            'current_hours': round(self.current_hours, 2),
+            'maintenance_threshold': self.maintenance_threshold,
+            'hours_per_day': round(self.hours_per_day, 2),
+            'days_left': round(self.days_left, 1),
+            'due_date': self.due_date.isoformat() if self.due_date else None,
+            'overdue': self.overdue,
+        }
+
+
+def device_rates(window_days=WINDOW_DAYS, now=None):
+    """Return ``(device ids, hours per day)`` arrays, sorted by device id"""
+    now = now or timezone.now()
+    rows = list(
+        OperationLog.objects.filter(start_time__gte=now - timedelta(days=window_days), duration__isnull=False)
+        .values('device_id')
+        .annotate(hours=Sum('duration'), first_start=Min('start_time'))
+        .order_by('device_id')
+        .values_list('device_id', 'hours', 'first_start')
+    )
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    hours = np.array([row[1] for row in rows], dtype=float)
+    span_days = np.array([(now - row[2]).total_seconds() / 86400 for row in rows], dtype=float)
+    return ids, hours / np.maximum(span_days, MIN_SPAN_DAYS)
+
+
+def due_date(local_now, days_left):
+    """The local date ``days_left`` days after ``local_now``, or None past ``date.max``"""
+    try:
+        return (local_now + timedelta(days=days_left)).date()
+    except OverflowError:
+        return None
+
+
+def forecast(horizon_days=HORIZON_DAYS, limit=None, window_days=WINDOW_DAYS, now=None):
+    """Units due within ``horizon_days`` (None: any time), soonest first.
+
+    Overdue units come first, the furthest past their threshold leading.
+    The returned forecasts have ``unit`` loaded with its device and location.
+    """
+    now = now or timezone.now()
+    rated_ids, rates = device_rates(window_days, now)
+
+    units = np.array(
+        list(DeviceUnit.objects.values_list('pk', 'device_id', 'current_hours', 'maintenance_threshold')),
+        dtype=float,
+    ).reshape(-1, 4)
+    unit_ids = units[:, 0].astype(np.int64)
+    device_ids = units[:, 1].astype(np.int64)
+    current, threshold = units[:, 2], units[:, 3]
+
+    # Look up each unit's device rate (0 when the device has not run recently)
+    rate = np.zeros(len(units))
+    if len(rated_ids):
+        position = np.minimum(np.searchsorted(rated_ids, device_ids), len(rated_ids) - 1)
+        found = rated_ids[position] == device_ids
+        rate[found] = rates[position[found]]
+
+    remaining = threshold - current
+    days_left = np.full(len(units), np.inf)
+    running = rate > 0
+    days_left[running] = remaining[running] / rate[running]
+    days_left[remaining <= 0] = 0.0
+
+    selected = np.isfinite(days_left)
+    if horizon_days is not None:
+        selected &= days_left <= horizon_days
+    indices = np.flatnonzero(selected)
+    # Soonest first; among overdue units the furthest past their threshold first
+    indices = indices[np.lexsort((remaining[indices], days_left[indices]))]
+    if limit is not None:
+        indices = indices[:limit]
+
+    local_now = timezone.localtime(now)
+    results = [
+        UnitForecast(
+            unit_id=int(unit_ids[i]),
+            device_id=int(device_ids[i]),
+            current_hours=float(current[i]),
+            maintenance_threshold=float(threshold[i]),
+            hours_per_day=float(rate[i]),
+            days_left=float(days_left[i]),
+            due_date=due_date(local_now, float(days_left[i])),
+        )
+        for i in indices
+    ]
+    loaded = DeviceUnit.objects.select_related('device', 'location').in_bulk([f.unit_id for f in results])
+    for item in results:
+        item.unit = loaded.get(item.unit_id)
+    return results
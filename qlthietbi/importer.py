@@ -0,0 +1,297 @@
+"""Streaming bulk import of departments, devices, locations and units.
+
+Rows are read one at a time from CSV or XLSX and written in chunks: each
+chunk resolves (or creates) its departments, locations and devices through
+in-memory name maps and inserts its units with one ``bulk_create``, inside
+its own transaction. A chunk that fails to write is rolled back, reported
+against its rows and dropped from the maps, and the import goes on. A dry
+run validates the same way but writes nothing. QR images are rendered on
+demand at the ``/ma-qr/`` URLs.
+
+Expected columns (English or Vietnamese headers):
+
+    department | Ngành            (required)
+    device     | Thiết bị         (required)
+    unit       | Tên khối         (required)
+    qr_code    | Mã QR            (required, unique)
+    location   | Vị trí
+    maintenance_threshold | Định mức bảo dưỡng   (default 500)
+    status     | Trạng thái       (NORMAL / MAINTENANCE / ERROR)
+    description | Mô tả           (device description, used when it is created)
+"""
+import csv
+import io
+import math
+from dataclasses import dataclass, field
+
+from django.db import DatabaseError, transaction
+
+from .cache import invalidate_dashboard, invalidate_devices
+from .models import Department, Device, DeviceUnit, Location
+from .sync import record_changes
+
+FORMATS = ('csv', 'xlsx')
+
+HEADER_ALIASES = {
+    'department': 'department', 'ngành': 'department', 'nganh': 'department',
+    'device': 'device', 'thiết bị': 'device', 'thiet bi': 'device',
+    'unit': 'unit', 'tên khối': 'unit', 'ten khoi': 'unit', 'khối': 'unit',
+    'qr_code': 'qr_code', 'mã qr': 'qr_code', 'ma qr': 'qr_code',
+    'location': 'location', 'vị trí': 'location', 'vi tri': 'location',
+    'maintenance_threshold': 'maintenance_threshold', 'định mức bảo dưỡng': 'maintenance_threshold',
+    'status': 'status', 'trạng thái': 'status', 'trang thai': 'status',
+    'description': 'description', 'mô tả': 'description', 'mo ta': 'description',
+}
+REQUIRED_COLUMNS = ('department', 'device', 'unit', 'qr_code')
+STATUSES = {value for value, _ in DeviceUnit.STATUS_CHOICES}
+QR_CODE_MAX_LENGTH = DeviceUnit._meta.get_field('qr_code').max_length
+NAME_MAX_LENGTHS = {
+    'department': Department._meta.get_field('name').max_length,
+    'device': Device._meta.get_field('name').max_length,
+    'unit': DeviceUnit._meta.get_field('name').max_length,
+    'location': Location._meta.get_field('name').max_length,
+}
+
+
+@dataclass
+class ImportResult:
+    rows: int = 0
+    departments: int = 0
+    locations: int = 0
+    devices: int = 0
+    units: int = 0
+    errors: list = field(default_factory=list)  # (row number, message)
+    dry_run: bool = False
+
+
+class ImportFileError(ValueError):
+    """The file as a whole cannot be imported (format, missing columns)"""
+
+
+def _normalize_header(header):
+    key = str(header or '').strip().lower()
+    return HEADER_ALIASES.get(key, key)
+
+
+def _iter_csv(fileobj):
+    if isinstance(fileobj, io.TextIOBase):
+        text = fileobj
+    else:
+        text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+    reader = csv.reader(text)
+    header = next(reader, None)
+    if header is None:
+        return
+    yield [_normalize_header(h) for h in header]
+    yield from reader
+
+
+def _iter_xlsx(fileobj):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportFileError("Cần cài đặt openpyxl để nhập file XLSX")
+
+    workbook = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        yield [_normalize_header(h) for h in header]
+        for row in rows:
+            yield ['' if value is None else str(value) for value in row]
+    finally:
+        workbook.close()
+
+
+def iter_rows(fileobj, fmt):
+    """Yield ``(row number, {column: value})`` for each data row of the file"""
+    if fmt not in FORMATS:
+        raise ImportFileError(f"Định dạng không hỗ trợ: {fmt}")
+    rows = _iter_csv(fileobj) if fmt == 'csv' else _iter_xlsx(fileobj)
+
+    header = next(rows, None)
+    if header is None:
+        return
+    missing = [column for column in REQUIRED_COLUMNS if column not in header]
+    if missing:
+        raise ImportFileError(f"Thiếu cột bắt buộc: {', '.join(missing)}")
+
+    for number, values in enumerate(rows, start=2):
+        if not any(str(value).strip() for value in values):
+            continue
+        yield number, {column: str(value).strip() for column, value in zip(header, values)}
+
+
+class UnitImporter:
+    """Chunked importer; name maps live for the whole run, units only per chunk"""
+
+    def __init__(self, dry_run=False, chunk_size=1000):
+        self.chunk_size = max(1, chunk_size)
+        self.result = ImportResult(dry_run=dry_run)
+        self.departments = dict(Department.objects.values_list('name', 'pk'))
+        self.locations = dict(Location.objects.values_list('name', 'pk'))
+        self.devices = {
+            (department_id, name): pk
+            for pk, department_id, name in Device.objects.values_list('pk', 'department_id', 'name')
+        }
+        self.seen_qr_codes = set()
+        self.touched_devices = set()
+        # Rows a dry run would create get negative placeholder ids
+        self.planned_ids = 0
+        # (map, key) of the rows created by the current chunk
+        self.created = []
+
+    def run(self, rows):
+        self._run(rows)
+        if not self.result.dry_run:
+            invalidate_dashboard()
+            # Scans of existing devices list their new sibling units
+            invalidate_devices(self.touched_devices)
+        return self.result
+
+    def _run(self, rows):
+        chunk = []
+        for number, row in rows:
+            self.result.rows += 1
+            chunk.append((number, row))
+            if len(chunk) >= self.chunk_size:
+                self._import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self._import_chunk(chunk)
+
+    def _error(self, number, message):
+        self.result.errors.append((number, message))
+
+    def _validate(self, number, row):
+        for column in REQUIRED_COLUMNS:
+            if not row.get(column):
+                self._error(number, f"Thiếu giá trị cột {column}")
+                return None
+
+        qr_code = row['qr_code']
+        if len(qr_code) > QR_CODE_MAX_LENGTH:
+            self._error(number, f"Mã QR dài quá {QR_CODE_MAX_LENGTH} ký tự")
+            return None
+        if qr_code in self.seen_qr_codes:
+            self._error(number, f"Mã QR {qr_code} bị lặp trong file")
+            return None
+
+        status = (row.get('status') or 'NORMAL').upper()
+        if status not in STATUSES:
+            self._error(number, f"Trạng thái không hợp lệ: {row['status']}")
+            return None
+
+        for column, max_length in NAME_MAX_LENGTHS.items():
+            if len(row.get(column) or '') > max_length:
+                self._error(number, f"Giá trị cột {column} dài quá {max_length} ký tự")
+                return None
+
+        threshold = row.get('maintenance_threshold') or '500'
+        try:
+            threshold = float(threshold.replace(',', '.'))
+        except ValueError:
+            threshold = math.nan
+        if not math.isfinite(threshold):
+            self._error(number, f"Định mức bảo dưỡng không hợp lệ: {row['maintenance_threshold']}")
+            return None
+
+        self.seen_qr_codes.add(qr_code)
+        return status, threshold
+
+    def _create(self, names, key, model, **values):
+        """Id of the row ``names[key]``, created (or, in a dry run, planned) if missing"""
+        if key not in names:
+            if self.result.dry_run:
+                self.planned_ids -= 1
+                names[key] = self.planned_ids
+            else:
+                names[key] = model.objects.create(**values).pk
+            self.created.append((names, key))
+        return names[key]
+
+    def _department_id(self, name):
+        return self._create(self.departments, name, Department, name=name)
+
+    def _location_id(self, name):
+        if not name:
+            return None
+        return self._create(self.locations, name, Location, name=name)
+
+    def _device_id(self, department_id, name, description):
+        return self._create(
+            self.devices, (department_id, name), Device,
+            department_id=department_id, name=name, description=description,
+        )
+
+    def _import_chunk(self, chunk):
+        valid = []
+        for number, row in chunk:
+            checked = self._validate(number, row)
+            if checked:
+                valid.append((number, row, checked))
+
+        self.created, pending = [], []
+        try:
+            with transaction.atomic():
+                units = self._write_chunk(valid, pending)
+        except DatabaseError as e:
+            # Rolled back: later chunks must not point at the rows it created
+            for names, key in self.created:
+                del names[key]
+            for number, row in pending:
+                self.seen_qr_codes.discard(row['qr_code'])
+                self._error(number, f"Không ghi được dữ liệu: {e}")
+            return
+
+        for names, _ in self.created:
+            if names is self.departments:
+                self.result.departments += 1
+            elif names is self.locations:
+                self.result.locations += 1
+            else:
+                self.result.devices += 1
+        self.result.units += len(units)
+        self.touched_devices.update(unit.device_id for unit in units)
+
+    def _write_chunk(self, valid, pending):
+        """Create the chunk's units; ``pending`` collects the rows being written"""
+        existing = set(DeviceUnit.objects.filter(
+            qr_code__in=[row['qr_code'] for _, row, _ in valid]
+        ).values_list('qr_code', flat=True))
+
+        units = []
+        for number, row, (status, threshold) in valid:
+            if row['qr_code'] in existing:
+                self._error(number, f"Mã QR {row['qr_code']} đã tồn tại")
+                continue
+            pending.append((number, row))
+            department_id = self._department_id(row['department'])
+            device_id = self._device_id(department_id, row['device'], row.get('description', ''))
+            units.append(DeviceUnit(
+                device_id=device_id,
+                location_id=self._location_id(row.get('location', '')),
+                name=row['unit'],
+                qr_code=row['qr_code'],
+                maintenance_threshold=threshold,
+                status=status,
+            ))
+        if not self.result.dry_run:
+            DeviceUnit.objects.bulk_create(units)
+            # bulk_create bypasses the post_save signal that feeds offline sync
+            record_changes('unit', [unit.pk for unit in units])
+        return units
+
+
+def import_units(fileobj, fmt, dry_run=False, chunk_size=1000):
+    """Import a CSV/XLSX file; returns an ImportResult with per-row errors"""
+    return UnitImporter(dry_run=dry_run, chunk_size=chunk_size).run(iter_rows(fileobj, fmt))
+
+
+def write_error_report(errors, fileobj):
+    """Write ``(row number, message)`` pairs as CSV"""
+    writer = csv.writer(fileobj)
+    writer.writerow(['Dòng', 'Lỗi'])
+    writer.writerows(errors)
@@ -0,0 +1,111 @@
+"""Printable QR label sheets.
+
+Labels are laid out on A4 pages (150 dpi, 3 x 7 grid with cut lines), one
+QR code per label with the unit name and code as caption. Pages are
+rendered independently, so they can be drawn in a process pool; like
+``qr.py`` this module does not import Django.
+"""
+import io
+from concurrent.futures import ProcessPoolExecutor
+
+import qrcode
+from PIL import Image, ImageDraw, ImageFont
+
+DPI = 150
+PAGE_SIZE = (1240, 1754)  # A4 at 150 dpi
+COLUMNS = 3
+ROWS = 7
+LABELS_PER_PAGE = COLUMNS * ROWS
+MARGIN = 60
+PADDING = 12
+CAPTION_HEIGHT = 58
+
+FORMATS = ('pdf', 'png')
+
+
+def _font(size):
+    # DejaVu covers Vietnamese diacritics; Pillow's bundled font is the fallback
+    for name in ('DejaVuSans.ttf', 'Arial.ttf', 'arial.ttf'):
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size)
+
+
+def _qr_image(content, max_size):
+    """1-bit QR image scaled by a whole factor to fit in ``max_size`` pixels"""
+    # Two-module quiet zone; the cell padding and cut line add the rest
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, box_size=1, border=2)
+    qr.add_data(content)
+    qr.make(fit=True)
+    matrix = qr.get_matrix()
+    modules = len(matrix)
+
+    img = Image.new('1', (modules, modules), 1)
+    img.putdata([0 if dark else 1 for row in matrix for dark in row])
+    scale = max(1, max_size // modules)
+    return img.resize((modules * scale, modules * scale), Image.NEAREST)
+
+
+def _fit_text(draw, text, font, width):
+    """Truncate ``text`` with an ellipsis so that it fits in ``width`` pixels"""
+    if draw.textlength(text, font=font) <= width:
+        return text
+    while text and draw.textlength(text + '…', font=font) > width:
+        text = text[:-1]
+    return text + '…'
+
+
+def render_page(labels):
+    """Render one page of ``(qr_code, caption)`` labels and return PNG bytes"""
+    page = Image.new('1', PAGE_SIZE, 1)
+    draw = ImageDraw.Draw(page)
+    cell_width = (PAGE_SIZE[0] - 2 * MARGIN) // COLUMNS
+    cell_height = (PAGE_SIZE[1] - 2 * MARGIN) // ROWS
+    qr_max = min(cell_width, cell_height - CAPTION_HEIGHT) - 2 * PADDING
+    caption_font = _font(22)
+    code_font = _font(18)
+
+    for index, (qr_code, caption) in enumerate(labels[:LABELS_PER_PAGE]):
+        x0 = MARGIN + (index % COLUMNS) * cell_width
+        y0 = MARGIN + (index // COLUMNS) * cell_height
+        # Cut guide
+        draw.rectangle([x0, y0, x0 + cell_width - 1, y0 + cell_height - 1], outline=0)
+
+        qr = _qr_image(qr_code, qr_max)
+        page.paste(qr, (x0 + (cell_width - qr.width) // 2, y0 + PADDING))
+
+        center = x0 + cell_width // 2
+        text_y = y0 + PADDING + qr.height + 6
+        text_width = cell_width - 2 * PADDING
+        draw.text((center, text_y), _fit_text(draw, caption, caption_font, text_width),
+                  font=caption_font, fill=0, anchor='mt')
+        draw.text((center, text_y + 28), _fit_text(draw, qr_code, code_font, text_width),
+                  font=code_font, fill=0, anchor='mt')
+
+    buffer = io.BytesIO()
+    page.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def unit_labels(units):
+    """``(qr_code, caption)`` pairs for an iterable of DeviceUnit"""
+    return [(unit.qr_code, unit.name) for unit in units if unit.qr_code]
+
+
+def render_pages(labels, workers=1):
+    """Split ``labels`` into pages and render them, in parallel when ``workers > 1``"""
+    chunks = [labels[i:i + LABELS_PER_PAGE] for i in range(0, len(labels), LABELS_PER_PAGE)]
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+            return list(pool.map(render_page, chunks))
+    return [render_page(chunk) for chunk in chunks]
+
+
+def write_pdf(pages, fp):
+    """Write rendered PNG pages to ``fp`` as one multi-page PDF"""
+    images = [Image.open(io.BytesIO(png)) for png in pages]
+    if not images:
+        images = [Image.new('1', PAGE_SIZE, 1)]
+    images[0].save(fp, 'PDF', save_all=True, append_images=images[1:], resolution=DPI)
@@ -0,0 +1,96 @@
+"""Move old operation logs out of the database into monthly archive files.
+
+Logs that started before the first day of the month ``--days`` ago are
+written to ``QLTHIETBI_ARCHIVE_DIR`` (see ``qlthietbi.archive``), one month
+at a time. A month's rows are streamed from the database ``--batch-size``
+at a time into its file, outside any transaction; only then are they
+deleted, a batch per short transaction, so other writers are never locked
+out for long. A log created during the run is left for the next one.
+
+An interrupted run can simply be repeated: logs already in a month's file
+are replaced, not duplicated. Until then, logs written to a file but not
+yet deleted are counted twice by the history and exports. Hour counters
+and the daily usage rollup are not touched.
+
+    python manage.py archive_logs --dry-run
+    python manage.py archive_logs --days 365
+"""
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from qlthietbi import archive
+from qlthietbi.cache import invalidate_dashboard, invalidate_devices
+from qlthietbi.forecast import WINDOW_DAYS
+from qlthietbi.models import OperationLog
+from qlthietbi.signals import bulk_log_changes
+
+
+class Command(BaseCommand):
+    help = "Chuyển nhật ký vận hành cũ ra file lưu trữ nén theo tháng"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=archive.archive_after_days(),
+                            help="Lưu trữ nhật ký cũ hơn bấy nhiêu ngày (làm tròn về đầu tháng)")
+        parser.add_argument('--dry-run', action='store_true', help="Chỉ báo cáo, không chuyển")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Số nhật ký mỗi lượt đọc/xoá")
+
+    def handle(self, *args, **options):
+        if options['days'] < WINDOW_DAYS:
+            raise CommandError(f"--days phải từ {WINDOW_DAYS} trở lên: dự báo bảo dưỡng đọc nhật ký {WINDOW_DAYS} ngày gần nhất")
+
+        started = time.perf_counter()
+        cutoff = archive.month_start(timezone.now() - timedelta(days=options['days']))
+        # Logs created from here on are left for the next run
+        last_pk = OperationLog.objects.aggregate(last=Max('pk'))['last'] or 0
+        old = OperationLog.objects.filter(start_time__lt=cutoff, pk__lte=last_pk)
+        first = old.order_by('start_time').values_list('start_time', flat=True).first()
+        moved = 0
+        month_start = archive.month_start(first) if first else cutoff
+
+        while month_start < cutoff:
+            month_end = archive.next_month(month_start)
+            month = archive.month_key(month_start)
+            logs = old.filter(start_time__gte=month_start, start_time__lt=month_end)
+            month_start = month_end
+            count = logs.count()
+            if not count:
+                continue
+            if not options['dry_run']:
+                self._archive_month(month, logs, options['batch_size'])
+            moved += count
+            self.stdout.write(f"{month}: {count} nhật ký")
+
+        if moved and not options['dry_run']:
+            # The dashboard lists the latest logs, which may have been archived
+            invalidate_dashboard()
+
+        elapsed = time.perf_counter() - started
+        verb = "Sẽ chuyển" if options['dry_run'] else "Đã chuyển"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {moved} nhật ký trước {timezone.localtime(cutoff):%d/%m/%Y} "
+            f"vào {archive.archive_dir()} ({elapsed:.2f}s)"
+        ))
+
+    def _archive_month(self, month, logs, batch_size):
+        device_ids = set()
+
+        def rows():
+            for row in logs.order_by('start_time', 'id').values(*archive.FIELDS).iterator(chunk_size=batch_size):
+                device_ids.add(row['device_id'])
+                yield row
+
+        archive.write_partition(month, rows())
+        while True:
+            with transaction.atomic():
+                ids = list(logs.order_by('pk').values_list('pk', flat=True)[:batch_size])
+                if not ids:
+                    break
+                # The device versions are bumped once per month below, not once per log
+                with bulk_log_changes():
+                    OperationLog.objects.filter(pk__in=ids).delete()
+        invalidate_devices(device_ids)
@@ -0,0 +1,54 @@
+"""Export the operation log to CSV or XLSX in constant memory.
+
+    python manage.py export_logs --from 2026-01-01 --to 2026-06-30 --output nhat-ky.csv
+    python manage.py export_logs --department 2 --format xlsx --output nhat-ky.xlsx
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from qlthietbi.exporter import FORMATS, export_rows, iter_csv, parse_date, write_xlsx
+
+
+class Command(BaseCommand):
+    help = "Xuất nhật ký vận hành ra CSV/XLSX (đọc theo lô, bộ nhớ không đổi)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', help="Từ ngày (YYYY-MM-DD, theo giờ nổ máy)")
+        parser.add_argument('--to', dest='date_to', help="Đến ngày (YYYY-MM-DD, tính cả ngày này)")
+        parser.add_argument('--department', type=int, help="Chỉ nhật ký của ngành (id)")
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--output', default='-', help="File đích; '-' là stdout (chỉ CSV)")
+
+    def handle(self, *args, **options):
+        try:
+            date_from = parse_date(options['date_from'])
+            date_to = parse_date(options['date_to'])
+        except ValueError as e:
+            raise CommandError(f"Ngày không hợp lệ: {e}")
+
+        count = 0
+
+        def counted(rows):
+            nonlocal count
+            for row in rows:
+                count += 1
+                yield row
+
+        started = time.perf_counter()
+        rows = counted(export_rows(date_from, date_to, options['department']))
+        if options['format'] == 'csv':
+            if options['output'] == '-':
+                self.stdout.writelines(iter_csv(rows))
+                return
+            with open(options['output'], 'w', newline='', encoding='utf-8') as f:
+                f.writelines(iter_csv(rows))
+        else:
+            if options['output'] == '-':
+                raise CommandError("XLSX cần --output là đường dẫn file")
+            write_xlsx(rows, options['output'])
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Đã xuất {max(count - 1, 0)} nhật ký vào {options['output']} ({elapsed:.2f}s)"
+        ))
@@ -0,0 +1,135 @@
+"""Generate or regenerate QR images for device units in bulk.
+
+Only needed with ``QLTHIETBI_STORE_QR_IMAGES``: otherwise QR codes are
+rendered on demand and no files are kept.
+
+Rendering runs in a process pool; files are written and the ``qr_image``
+column is updated with ``bulk_update`` one batch at a time. Images are
+named after the unit id (``unit_<id>_<qr_code>.png``), so files left with
+``unit_new_...`` names by older versions are renamed, and images named
+after an earlier code of the unit are rendered again.
+
+    python manage.py generate_qr_codes                  # missing, misnamed or stale images
+    python manage.py generate_qr_codes --force          # regenerate everything
+    python manage.py generate_qr_codes --device 3 --workers 8
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from qlthietbi.models import DeviceUnit
+from qlthietbi.qr import UPLOAD_DIR, qr_filename, render_qr_png
+
+
+class Command(BaseCommand):
+    help = "Tạo/tạo lại ảnh mã QR cho các khối chi tiết (song song nhiều tiến trình)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help="Tạo lại ảnh cho mọi khối được chọn, kể cả khi đã có")
+        parser.add_argument('--department', type=int, help="Chỉ các khối thuộc ngành (id)")
+        parser.add_argument('--device', type=int, help="Chỉ các khối thuộc thiết bị (id)")
+        parser.add_argument('--location', type=int, help="Chỉ các khối tại vị trí (id)")
+        parser.add_argument('--qr-code', action='append', dest='qr_codes', help="Chỉ các mã QR này (lặp lại được)")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help="Số tiến trình vẽ ảnh (mặc định: số CPU)")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Số khối mỗi lượt ghi file và bulk_update")
+
+    def handle(self, *args, **options):
+        units = DeviceUnit.objects.exclude(qr_code='').order_by('pk')
+        if options['department']:
+            units = units.filter(device__department_id=options['department'])
+        if options['device']:
+            units = units.filter(device_id=options['device'])
+        if options['location']:
+            units = units.filter(location_id=options['location'])
+        if options['qr_codes']:
+            units = units.filter(qr_code__in=options['qr_codes'])
+        units = units.only('pk', 'qr_code', 'qr_image')
+
+        workers = max(1, options['workers'])
+        batch_size = max(1, options['batch_size'])
+        pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+        started = time.perf_counter()
+        totals = [0, 0, 0]
+        try:
+            for batch in self._batches(units.iterator(chunk_size=batch_size), batch_size):
+                counts = self._process_batch(batch, options['force'], pool)
+                totals = [a + b for a, b in zip(totals, counts)]
+        finally:
+            if pool:
+                pool.shutdown()
+        rendered, renamed, skipped = totals
+
+        elapsed = time.perf_counter() - started
+        rate = rendered / elapsed if elapsed > 0 else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f"Đã tạo {rendered} ảnh, đổi tên {renamed}, bỏ qua {skipped} "
+            f"trong {elapsed:.2f}s ({rate:.1f} ảnh/s, {workers} tiến trình)"
+        ))
+
+    @staticmethod
+    def _batches(iterable, size):
+        batch = []
+        for item in iterable:
+            batch.append(item)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _process_batch(self, batch, force, pool):
+        """Render, rename and save one batch; returns (rendered, renamed, skipped)"""
+        to_render = []
+        changed = []
+        renamed = skipped = 0
+
+        for unit in batch:
+            expected = UPLOAD_DIR + qr_filename(unit.pk, unit.qr_code)
+            current = unit.qr_image.name if unit.qr_image else ''
+            if force or not current or not default_storage.exists(current):
+                to_render.append(unit)
+            elif current == expected:
+                skipped += 1
+            elif current.startswith(UPLOAD_DIR + f"unit_new_{unit.qr_code}"):
+                # Image is fine but was saved under a temporary name: move it
+                with default_storage.open(current, 'rb') as f:
+                    content = f.read()
+                unit.qr_image.name = self._write(expected, content)
+                default_storage.delete(current)
+                changed.append(unit)
+                renamed += 1
+            else:
+                # Rendered for an earlier code of the unit (changed with update()): stale
+                to_render.append(unit)
+
+        contents = [unit.qr_code for unit in to_render]
+        if pool:
+            images = pool.map(render_qr_png, contents, chunksize=max(1, len(contents) // 32))
+        else:
+            images = map(render_qr_png, contents)
+
+        for unit, png in zip(to_render, images):
+            old = unit.qr_image.name if unit.qr_image else ''
+            expected = UPLOAD_DIR + qr_filename(unit.pk, unit.qr_code)
+            if old and old != expected and default_storage.exists(old):
+                default_storage.delete(old)
+            unit.qr_image.name = self._write(expected, png)
+            changed.append(unit)
+
+        DeviceUnit.objects.bulk_update(changed, ['qr_image'])
+        return len(to_render), renamed, skipped
+
+    @staticmethod
+    def _write(name, content):
+        """Write a file under its exact name, replacing any existing file"""
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        return default_storage.save(name, ContentFile(content))
@@ -0,0 +1,53 @@
+"""Bulk import departments, devices, locations and units from CSV/XLSX.
+
+    python manage.py import_units tau-01.xlsx --dry-run
+    python manage.py import_units tau-01.csv --chunk-size 2000 --errors loi.csv
+"""
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from qlthietbi.importer import FORMATS, ImportFileError, import_units, write_error_report
+
+
+class Command(BaseCommand):
+    help = "Nhập ngành/thiết bị/vị trí/khối chi tiết từ file CSV hoặc XLSX (ghi theo lô)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File CSV hoặc XLSX")
+        parser.add_argument('--format', choices=FORMATS, help="Mặc định theo đuôi file")
+        parser.add_argument('--dry-run', action='store_true', help="Kiểm tra, không ghi vào CSDL")
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Số dòng mỗi lô bulk_create")
+        parser.add_argument('--errors', help="Ghi danh sách lỗi theo dòng ra file CSV")
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        fmt = options['format'] or path.suffix.lower().lstrip('.')
+        if fmt not in FORMATS:
+            raise CommandError(f"Không nhận ra định dạng file: {path.name} (dùng --format)")
+
+        started = time.perf_counter()
+        try:
+            with open(path, 'rb') as f:
+                result = import_units(f, fmt, dry_run=options['dry_run'], chunk_size=options['chunk_size'])
+        except (OSError, ImportFileError) as e:
+            raise CommandError(str(e))
+        elapsed = time.perf_counter() - started
+
+        for number, message in result.errors[:20]:
+            self.stderr.write(f"Dòng {number}: {message}")
+        if len(result.errors) > 20:
+            self.stderr.write(f"... và {len(result.errors) - 20} lỗi khác")
+        if options['errors']:
+            with open(options['errors'], 'w', newline='', encoding='utf-8') as f:
+                write_error_report(result.errors, f)
+
+        prefix = "[Chạy thử] " if result.dry_run else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}Đọc {result.rows} dòng trong {elapsed:.2f}s: "
+            f"{result.units} khối, {result.devices} thiết bị, {result.departments} ngành, "
+            f"{result.locations} vị trí mới; {len(result.errors)} lỗi"
+        ))
+        if result.units and not result.dry_run:
+            self.stdout.write("Chạy `python manage.py generate_qr_codes` để tạo ảnh mã QR.")
@@ -0,0 +1,62 @@
+"""Lay out QR labels for a department, device or location on printable sheets.
+
+    python manage.py print_qr_labels --department 1 --output nhan-qr.pdf
+    python manage.py print_qr_labels --location 4 --format png --output nhan-qr/
+"""
+import os
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from qlthietbi.labels import FORMATS, render_pages, unit_labels, write_pdf
+from qlthietbi.models import DeviceUnit
+
+
+class Command(BaseCommand):
+    help = "In tờ nhãn mã QR (PDF nhiều trang hoặc các trang PNG) cho ngành/thiết bị/vị trí"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--department', type=int, action='append', default=[], help="Id ngành (lặp lại được)")
+        parser.add_argument('--device', type=int, action='append', default=[], help="Id thiết bị (lặp lại được)")
+        parser.add_argument('--location', type=int, action='append', default=[], help="Id vị trí (lặp lại được)")
+        parser.add_argument('--format', choices=FORMATS, default='pdf', help="pdf (mặc định) hoặc png")
+        parser.add_argument('--output', required=True,
+                            help="File PDF, hoặc thư mục chứa các trang PNG")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help="Số tiến trình vẽ trang (mặc định: số CPU)")
+
+    def handle(self, *args, **options):
+        if not (options['department'] or options['device'] or options['location']):
+            raise CommandError("Cần chọn ít nhất một --department, --device hoặc --location")
+
+        units = DeviceUnit.objects.all()
+        if options['department']:
+            units = units.filter(device__department_id__in=options['department'])
+        if options['device']:
+            units = units.filter(device_id__in=options['device'])
+        if options['location']:
+            units = units.filter(location_id__in=options['location'])
+        units = units.order_by('device__name', 'name', 'pk').only('name', 'qr_code')
+
+        labels = unit_labels(units)
+        if not labels:
+            raise CommandError("Không có khối chi tiết nào phù hợp")
+
+        started = time.perf_counter()
+        pages = render_pages(labels, workers=max(1, options['workers']))
+
+        output = Path(options['output'])
+        if options['format'] == 'pdf':
+            output.parent.mkdir(parents=True, exist_ok=True)
+            with open(output, 'wb') as f:
+                write_pdf(pages, f)
+        else:
+            output.mkdir(parents=True, exist_ok=True)
+            for number, png in enumerate(pages, start=1):
+                (output / f"trang-{number:03d}.png").write_bytes(png)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Đã in {len(labels)} nhãn trên {len(pages)} trang vào {output} ({elapsed:.2f}s)"
+        ))
@@ -0,0 +1,28 @@
+"""Delete old rows of the offline sync change list.
+
+Clients whose copy is older than the oldest row left get a full snapshot
+on their next sync instead of a delta, so keep at least as many days as a
+tablet may reasonably stay offline. The newest row is always kept: it
+carries the current sync version.
+
+    python manage.py prune_sync_changes --days 90
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from qlthietbi.models import SyncChange
+from qlthietbi.sync import current_version
+
+
+class Command(BaseCommand):
+    help = "Xoá các thay đổi đồng bộ ngoại tuyến cũ"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help="Giữ lại thay đổi của bấy nhiêu ngày gần nhất")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        deleted, _ = SyncChange.objects.filter(created_at__lt=cutoff, id__lt=current_version()).delete()
+        self.stdout.write(self.style.SUCCESS(f"Đã xoá {deleted} thay đổi cũ hơn {options['days']} ngày"))
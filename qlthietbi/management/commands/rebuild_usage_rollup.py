@@ -0,0 +1,81 @@
+"""Rebuild the DailyUsage rollup from the operation log.
+
+Logs are streamed with ``iterator()`` and accumulated in memory per
+``(device, unit, day)``, together with the archived logs in the range
+(see ``archive_logs``), then the affected rollup rows are replaced in one
+transaction. Use it to backfill history or after deleting logs.
+
+    python manage.py rebuild_usage_rollup
+    python manage.py rebuild_usage_rollup --from 2026-01-01 --to 2026-03-31
+"""
+import itertools
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from qlthietbi import archive
+from qlthietbi.exporter import day_start, parse_date
+from qlthietbi.models import DailyUsage, Device, DeviceUnit, OperationLog
+from qlthietbi.usage import accumulate
+
+
+class Command(BaseCommand):
+    help = "Tính lại bảng thống kê giờ chạy theo ngày từ nhật ký vận hành"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', help="Từ ngày (YYYY-MM-DD)")
+        parser.add_argument('--to', dest='date_to', help="Đến ngày (YYYY-MM-DD, tính cả ngày này)")
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help="Số nhật ký đọc mỗi lượt từ cơ sở dữ liệu")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Số dòng thống kê mỗi lần bulk_create")
+
+    def handle(self, *args, **options):
+        try:
+            date_from = parse_date(options['date_from'])
+            date_to = parse_date(options['date_to'])
+        except ValueError as e:
+            raise CommandError(f"Ngày không hợp lệ: {e}")
+
+        started = time.perf_counter()
+        logs = OperationLog.objects.filter(duration__isnull=False).only(
+            'device_id', 'device_unit_id', 'start_time', 'end_time', 'duration', 'device_status'
+        )
+        # A log that started the day before the range may still run into it
+        ends_after = day_start(date_from) if date_from else None
+        end = day_start(date_to + timedelta(days=1)) if date_to else None
+        if ends_after:
+            logs = logs.filter(end_time__gt=ends_after)
+        if end:
+            logs = logs.filter(start_time__lt=end)
+        # Archived logs of deleted devices or units would have been deleted with them
+        device_ids = set(Device.objects.values_list('pk', flat=True))
+        unit_ids = set(DeviceUnit.objects.values_list('pk', flat=True))
+        archived = (
+            OperationLog(**record) for record in archive.records(end=end, ends_after=ends_after)
+            if record['duration'] is not None and record['device_id'] in device_ids
+            and (record['device_unit_id'] is None or record['device_unit_id'] in unit_ids)
+        )
+        rollup = accumulate(itertools.chain(logs.iterator(chunk_size=options['chunk_size']), archived))
+
+        rows = [
+            DailyUsage(device_id=device_id, device_unit_id=unit_id, day=day, **totals)
+            for (device_id, unit_id, day), totals in rollup.items()
+            if (not date_from or day >= date_from) and (not date_to or day <= date_to)
+        ]
+        stale = DailyUsage.objects.all()
+        if date_from:
+            stale = stale.filter(day__gte=date_from)
+        if date_to:
+            stale = stale.filter(day__lte=date_to)
+
+        with transaction.atomic():
+            deleted, _ = stale.delete()
+            DailyUsage.objects.bulk_create(rows, batch_size=options['batch_size'])
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Đã tính lại {len(rows)} dòng thống kê (xoá {deleted} dòng cũ) trong {elapsed:.2f}s"
+        ))
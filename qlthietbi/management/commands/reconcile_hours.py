@@ -0,0 +1,125 @@
+"""Recompute hour counters from the operation log and fix any drift.
+
+``Device.total_system_hours`` and ``DeviceUnit.current_hours`` are running
+totals kept by ``OperationLog.save()``; deletions, queryset updates and
+failed saves are never reversed. This command walks devices in id order, one chunk at a time, and
+for each chunk:
+
+* sums the logged durations with one grouped aggregate, adding the hours
+  of archived logs from the archive index (see ``archive_logs``),
+* compares them with the stored counters,
+* corrects the drifted rows with ``bulk_update``.
+
+Only device counters are touched by default. A unit's counter starts when
+the unit is installed or reset after maintenance, so its device's log
+total is only its true value for units that ran with the device from its
+first log; ``--units`` sets every unit to that total as well.
+
+Each chunk is its own short transaction, so the SQLite file is only locked
+briefly and other writers get in between chunks. Corrections are applied
+as ``F() + delta``, so hours added concurrently are never lost.
+
+    python manage.py reconcile_hours --dry-run
+    python manage.py reconcile_hours --chunk-size 200 --units
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Sum
+
+from qlthietbi import archive
+from qlthietbi.cache import invalidate_dashboard, invalidate_devices
+from qlthietbi.models import Device, DeviceUnit, OperationLog
+
+
+class Command(BaseCommand):
+    help = "Tính lại giờ tích luỹ của thiết bị/khối từ nhật ký và sửa sai lệch"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Chỉ báo cáo sai lệch, không sửa")
+        parser.add_argument('--chunk-size', type=int, default=500, help="Số thiết bị mỗi lượt (mỗi giao dịch)")
+        parser.add_argument('--tolerance', type=float, default=0.01, help="Sai lệch (giờ) được bỏ qua")
+        parser.add_argument('--units', action='store_true',
+                            help="Đặt cả giờ chạy của khối bằng tổng nhật ký của thiết bị (xoá mốc đặt lại sau bảo dưỡng)")
+        parser.add_argument('--pause', type=float, default=0.0, help="Nghỉ giữa các lượt (giây)")
+
+    def handle(self, *args, **options):
+        chunk_size = max(1, options['chunk_size'])
+        self.verbosity = options['verbosity']
+        self.archived_hours = archive.hours_by_device()
+        started = time.perf_counter()
+        totals = {'devices': 0, 'device_drift': 0, 'unit_drift': 0}
+        last_pk = 0
+
+        while True:
+            with transaction.atomic():
+                devices = list(
+                    Device.objects.filter(pk__gt=last_pk).order_by('pk')
+                    .values_list('pk', 'total_system_hours')[:chunk_size]
+                )
+                if not devices:
+                    break
+                last_pk = devices[-1][0]
+                device_drift, unit_drift = self._reconcile_chunk(devices, options)
+
+            totals['devices'] += len(devices)
+            totals['device_drift'] += device_drift
+            totals['unit_drift'] += unit_drift
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        fixed = totals['device_drift'] or totals['unit_drift']
+        if fixed and not options['dry_run']:
+            # bulk_update bypasses the model signals
+            invalidate_dashboard()
+
+        elapsed = time.perf_counter() - started
+        verb = "Phát hiện" if options['dry_run'] else "Đã sửa"
+        self.stdout.write(self.style.SUCCESS(
+            f"Đã kiểm tra {totals['devices']} thiết bị trong {elapsed:.2f}s. "
+            f"{verb} sai lệch ở {totals['device_drift']} thiết bị và {totals['unit_drift']} khối"
+        ))
+
+    def _reconcile_chunk(self, devices, options):
+        """Fix one chunk of ``(pk, total_system_hours)``; returns the drift counts"""
+        ids = [pk for pk, _ in devices]
+        logged = dict(
+            OperationLog.objects.filter(device_id__in=ids, duration__isnull=False)
+            .values_list('device_id').annotate(hours=Sum('duration')).order_by()
+        )
+        for pk in ids:
+            if pk in self.archived_hours:
+                logged[pk] = logged.get(pk, 0.0) + self.archived_hours[pk]
+
+        drifted_devices = []
+        for pk, stored in devices:
+            delta = self._delta(logged.get(pk, 0.0), stored, options['tolerance'])
+            if delta:
+                self._report(f"Thiết bị #{pk}", stored, logged.get(pk, 0.0))
+                drifted_devices.append(Device(pk=pk, total_system_hours=F('total_system_hours') + delta))
+
+        drifted_units = []
+        if options['units']:
+            units = DeviceUnit.objects.filter(device_id__in=ids).values_list('pk', 'device_id', 'current_hours')
+            for pk, device_id, stored in units.iterator():
+                delta = self._delta(logged.get(device_id, 0.0), stored, options['tolerance'])
+                if delta:
+                    self._report(f"Khối #{pk}", stored, logged.get(device_id, 0.0))
+                    drifted_units.append(DeviceUnit(pk=pk, current_hours=F('current_hours') + delta))
+
+        if not options['dry_run']:
+            Device.objects.bulk_update(drifted_devices, ['total_system_hours'])
+            DeviceUnit.objects.bulk_update(drifted_units, ['current_hours'], batch_size=1000)
+            if drifted_devices or drifted_units:
+                invalidate_devices(ids)
+        return len(drifted_devices), len(drifted_units)
+
+    @staticmethod
+    def _delta(expected, stored, tolerance):
+        delta = round(expected - stored, 2)
+        return delta if abs(delta) > tolerance else 0.0
+
+    def _report(self, label, stored, expected):
+        if self.verbosity >= 1:
+            self.stdout.write(f"{label}: lưu {stored:.2f} h, theo nhật ký {expected:.2f} h")
@@ -0,0 +1,104 @@
+"""In-process request metrics, exported in the Prometheus text format.
+
+``MetricsMiddleware`` (``middleware.py``) observes three histograms per view
+for every request: wall time, number of DB queries and time spent in the
+DB. A histogram is a fixed list of bucket counters behind a lock, so
+recording costs a bisect and a few additions. ``/metrics`` renders them.
+
+The numbers live in the worker's memory: each process of a multi-process
+server exports its own, and they reset on restart. Prometheus adds up the
+counters across workers and restarts.
+"""
+import threading
+from bisect import bisect_left
+
+# Upper bounds of the buckets; Prometheus adds +Inf
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+METRICS = (
+    ('qlthietbi_request_duration_seconds', 'Wall time of a request, per view', LATENCY_BUCKETS),
+    ('qlthietbi_db_queries', 'DB queries issued by a request, per view', QUERY_BUCKETS),
+    ('qlthietbi_db_duration_seconds', 'Time spent in the DB during a request, per view', LATENCY_BUCKETS),
+)
+
+
+class Histogram:
+    """Cumulative-bucket histogram, safe to update from several threads"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One counter per bucket, plus the overflow (+Inf)
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def snapshot(self):
+        """``(cumulative counts per bucket, sum, count)`` read consistently"""
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        cumulative, running = [], 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return cumulative, total, running
+
+
+class Registry:
+    """Histograms by metric name and (view, method) labels"""
+
+    def __init__(self):
+        self.histograms = {name: {} for name, _, _ in METRICS}
+        self.buckets = {name: buckets for name, _, buckets in METRICS}
+        self.lock = threading.Lock()
+
+    def histogram(self, name, labels):
+        series = self.histograms[name]
+        histogram = series.get(labels)
+        if histogram is None:
+            with self.lock:
+                histogram = series.setdefault(labels, Histogram(self.buckets[name]))
+        return histogram
+
+    def observe_request(self, view, method, duration, queries, db_duration):
+        labels = (view, method)
+        self.histogram('qlthietbi_request_duration_seconds', labels).observe(duration)
+        self.histogram('qlthietbi_db_queries', labels).observe(queries)
+        self.histogram('qlthietbi_db_duration_seconds', labels).observe(db_duration)
+
+    def clear(self):
+        with self.lock:
+            for series in self.histograms.values():
+                series.clear()
+
+    def render(self):
+        """All series in the Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for name, help_text, buckets in METRICS:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            # Copied under the lock: another thread may be adding a series
+            with self.lock:
+                series = sorted(self.histograms[name].items())
+            for (view, method), histogram in series:
+                labels = f'view="{_escape(view)}",method="{_escape(method)}"'
+                cumulative, total, count = histogram.snapshot()
+                for bound, value in zip(buckets + (float('inf'),), cumulative):
+                    le = '+Inf' if bound == float('inf') else repr(float(bound))
+                    lines.append(f'{name}_bucket{{{labels},le="{le}"}} {value}')
+                lines.append(f'{name}_sum{{{labels}}} {total!r}')
+                lines.append(f'{name}_count{{{labels}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
@@ -0,0 +1,159 @@
+import cProfile
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.db import connection
+
+from . import profiling
+from .metrics import registry
+
+
+class QueryTimer:
+    """``execute_wrapper`` that counts the queries of a request and times them"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+def _install(wrapper):
+    connection.execute_wrappers.append(wrapper)
+
+
+def _uninstall(wrapper):
+    connection.execute_wrappers.remove(wrapper)
+
+
+# Methods with a series of their own; the client picks the method, so any
+# other verb is counted under OTHER rather than creating new series
+METRIC_METHODS = frozenset({'GET', 'POST', 'HEAD'})
+
+
+def _method_label(request):
+    return request.method if request.method in METRIC_METHODS else 'OTHER'
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        # 404 before a view was found; one series for all of them
+        return 'unmatched'
+    return match.view_name or match._func_path
+
+
+class MetricsMiddleware:
+    """Record wall time, DB query count and DB time of every request, per view
+
+    For a streaming response (the log export) only the time until the
+    response is returned is counted, not the streaming of the body.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with connection.execute_wrapper(timer):
+            response = self.get_response(request)
+        self._record(request, time.perf_counter() - started, timer)
+        return response
+
+    async def __acall__(self, request):
+        timer = QueryTimer()
+        started = time.perf_counter()
+        # Connections are per thread, and the ORM runs on the request's sync
+        # thread, not the event loop: install the wrapper there
+        await sync_to_async(_install)(timer)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(_uninstall)(timer)
+        self._record(request, time.perf_counter() - started, timer)
+        return response
+
+    @staticmethod
+    def _record(request, duration, timer):
+        registry.observe_request(_view_name(request), _method_label(request), duration, timer.count, timer.duration)
+
+
+class ProfilerMiddleware:
+    """Run a staff user's request under cProfile when it asks for it (``?profile=1``)
+
+    Other requests cost one lookup in ``request.META``. The profile and the
+    SQL of the request are saved by ``profiling.save``; the response carries
+    its id in ``X-Profile-Id``. Under ASGI only the code on the event loop
+    is profiled, not the ORM work on the sync thread (its SQL is still
+    logged). As with the metrics, streaming a response body is not included.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not profiling.requested(request) or not request.user.is_staff:
+            return self.get_response(request)
+        if not profiling.profiling_lock.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            profiler, query_log = cProfile.Profile(), profiling.QueryLog()
+            started = time.perf_counter()
+            with connection.execute_wrapper(query_log):
+                profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    profiler.disable()
+            elapsed = time.perf_counter() - started
+            response['X-Profile-Id'] = profiling.save(profiler, query_log, request, response, elapsed, request.user)
+        finally:
+            profiling.profiling_lock.release()
+        return response
+
+    async def __acall__(self, request):
+        if not profiling.requested(request):
+            return await self.get_response(request)
+        user = await request.auser()
+        if not user.is_staff or not profiling.profiling_lock.acquire(blocking=False):
+            return await self.get_response(request)
+        try:
+            profiler, query_log = cProfile.Profile(), profiling.QueryLog()
+            started = time.perf_counter()
+            await sync_to_async(_install)(query_log)
+            profiler.enable()
+            try:
+                response = await self.get_response(request)
+            finally:
+                profiler.disable()
+                await sync_to_async(_uninstall)(query_log)
+            elapsed = time.perf_counter() - started
+            response['X-Profile-Id'] = await sync_to_async(profiling.save)(
+                profiler, query_log, request, response, elapsed, user
+            )
+        finally:
+            profiling.profiling_lock.release()
+        return response
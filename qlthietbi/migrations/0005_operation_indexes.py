@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qlthietbi', '0004_alter_operationlog_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='deviceunit',
+            index=models.Index(fields=['status'], name='unit_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='operationlog',
+            index=models.Index(fields=['-start_time', '-id'], name='oplog_start_time_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='operationlog',
+            index=models.Index(fields=['device', '-start_time'], name='oplog_device_start_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qlthietbi', '0005_operation_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyUsage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='Ngày')),
+                ('hours', models.FloatField(default=0.0, verbose_name='Giờ hoạt động (h)')),
+                ('log_count', models.PositiveIntegerField(default=0, verbose_name='Số nhật ký')),
+                ('normal_count', models.PositiveIntegerField(default=0, verbose_name='Bình thường')),
+                ('maintenance_count', models.PositiveIntegerField(default=0, verbose_name='Cần bảo dưỡng')),
+                ('error_count', models.PositiveIntegerField(default=0, verbose_name='Sự cố')),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_usage', to='qlthietbi.device', verbose_name='Thiết bị')),
+                ('device_unit', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='qlthietbi.deviceunit', verbose_name='Khối chi tiết')),
+            ],
+            options={
+                'verbose_name': '6. Thống kê giờ chạy theo ngày',
+                'verbose_name_plural': '6. Thống kê giờ chạy theo ngày',
+                'ordering': ['-day'],
+                'indexes': [models.Index(fields=['day', 'device'], name='daily_usage_day_device_idx')],
+                'constraints': [models.UniqueConstraint(fields=('device', 'device_unit', 'day'), name='daily_usage_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qlthietbi', '0006_daily_usage'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='operationlog',
+            name='oplog_device_start_idx',
+        ),
+        migrations.AddIndex(
+            model_name='operationlog',
+            index=models.Index(fields=['device', 'start_time', 'end_time'], name='oplog_device_interval_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qlthietbi', '0007_operationlog_interval_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False, verbose_name='Phiên bản dữ liệu'),
+        ),
+    ]
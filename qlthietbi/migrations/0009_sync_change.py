@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qlthietbi', '0008_device_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(choices=[('department', 'Ngành'), ('location', 'Vị trí'), ('device', 'Thiết bị'), ('unit', 'Khối chi tiết')], max_length=20, verbose_name='Loại dữ liệu')),
+                ('object_id', models.PositiveIntegerField(verbose_name='ID')),
+                ('deleted', models.BooleanField(default=False, verbose_name='Đã xoá')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Thời điểm')),
+            ],
+            options={
+                'verbose_name': 'Thay đổi dữ liệu đồng bộ',
+                'verbose_name_plural': 'Thay đổi dữ liệu đồng bộ',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qlthietbi', '0009_sync_change'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='operationlog',
+            name='client_id',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True, verbose_name='Mã gửi từ máy trạm'),
+        ),
+    ]
@@ -1,8 +1,12 @@
-from django.db import models
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
 from django.utils import timezone
 from django.core.files.base import ContentFile
-import io
-import qrcode
+
+from .qr import UPLOAD_DIR, qr_filename, render_qr_png
+from .usage import accumulate, empty_totals
 
 class Department(models.Model):
     name = models.CharField(max_length = 100, verbose_name = "Tên ngành")
@@ -17,6 +21,22 @@ class Device(models.Model):
     name = models.CharField(max_length = 200, verbose_name="Tên thiết bị")
     description = models.TextField(blank = True, verbose_name = "Mô tả") 
     total_system_hours = models.FloatField(default = 0.0, verbose_name = "Tổng giờ tích luỹ")
+    # Bumped on every change to the device, its units or its logs; read APIs derive ETags from it
+    version = models.PositiveIntegerField(default = 1, editable = False, verbose_name = "Phiên bản dữ liệu")
+
+    @staticmethod
+    def bump_versions(device_ids):
+        """Increment the version of these devices (ids or a values() subquery)"""
+        Device.objects.filter(pk__in = device_ids).update(version = F('version') + 1)
+
+    def save(self, *args, **kwargs):
+        # Never write back a version read earlier: it would undo concurrent bumps
+        if not self._state.adding and self.pk and not kwargs.get('update_fields'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'version'
+            ]
+        super().save(*args, **kwargs)
     
     def __str__(self):
         return self.name
@@ -45,7 +65,7 @@ class DeviceUnit(models.Model):
     location = models.ForeignKey(Location, on_delete = models.SET_NULL, null = True, verbose_name = "Vị trí lắp đặt")
     name = models.CharField(max_length = 200, verbose_name = "Tên khối")
     qr_code = models.CharField(max_length = 50, unique = True, verbose_name = "Mã QR")
-    qr_image = models.ImageField(upload_to='qr_codes/units/', blank=True, null=True, verbose_name="Mã QR")
+    qr_image = models.ImageField(upload_to=UPLOAD_DIR, blank=True, null=True, verbose_name="Mã QR")
 
     current_hours = models.FloatField(default = 0.0, verbose_name = "Giờ chạy")  
     maintenance_threshold = models.FloatField(default = 500.0, verbose_name = "Định mức bảo dưỡng")
@@ -53,28 +73,36 @@ class DeviceUnit(models.Model):
 
     def generate_qr_code(self):
         """Generate QR code image from unit qr_code"""
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(self.qr_code)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        img_io = io.BytesIO()
-        img.save(img_io, 'PNG')
-        img_io.seek(0)
-        
-        filename = f"unit_{self.id or 'new'}_{self.qr_code}.png"
-        self.qr_image.save(filename, ContentFile(img_io.getvalue()), save=False)
+        filename = qr_filename(self.id, self.qr_code)
+        self.qr_image.save(filename, ContentFile(render_qr_png(self.qr_code)), save=False)
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The stored code: when it changes, the stored image is stale
+        instance._stored_qr_code = instance.__dict__.get('qr_code')
+        return instance
+
     def save(self, *args, **kwargs):
-        if not self.qr_image and self.qr_code:
+        stored_qr_code = getattr(self, '_stored_qr_code', None)
+        if self.qr_image and stored_qr_code is not None and stored_qr_code != self.qr_code:
+            self.qr_image.delete(save = False)
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'qr_image'}
+        # Pages and labels render the code on demand (unit_qr_png/unit_qr_svg);
+        # a file is only kept when QLTHIETBI_STORE_QR_IMAGES asks for one
+        needs_qr = (
+            not self.qr_image and self.qr_code
+            and getattr(settings, 'QLTHIETBI_STORE_QR_IMAGES', False)
+        )
+        if needs_qr and self.pk:
             self.generate_qr_code()
         super().save(*args, **kwargs)
+        if needs_qr and not self.qr_image:
+            # New unit: render once it has an id so the file is named after it
+            self.generate_qr_code()
+            super().save(update_fields = ['qr_image'])
+        self._stored_qr_code = self.qr_code
 
     def __str__(self):
         return self.name
@@ -82,6 +110,13 @@ class DeviceUnit(models.Model):
     class Meta:
         verbose_name = "4. Khối chi tiết"
         verbose_name_plural = "4. Khối chi tiết"
+        indexes = [
+            # Dashboard status breakdown and admin status filter
+            models.Index(fields = ['status'], name = 'unit_status_idx'),
+        ]
+
+# Fields of a log that its usage rollup entries depend on
+USAGE_FIELDS = ('device_id', 'device_unit_id', 'start_time', 'end_time', 'duration', 'device_status')
 
 class OperationLog(models.Model):
     # Device status choices - reported by operator
@@ -99,31 +134,106 @@ class OperationLog(models.Model):
     duration = models.FloatField(blank = True, null = True, verbose_name = "Giờ hoạt động (h)")
     device_status = models.CharField(max_length = 20, choices = DEVICE_STATUS_CHOICES, default = 'NORMAL', verbose_name = "Trạng thái thiết bị khi tắt máy")
     notes = models.TextField(blank = True, verbose_name = "Ghi chú/Mô tả vấn đề")
+    # Idempotency key generated by the client: resubmitting it returns the stored log
+    client_id = models.UUIDField(unique = True, null = True, blank = True, editable = False, verbose_name = "Mã gửi từ máy trạm")
     
+    @staticmethod
+    def calculate_duration(start_time, end_time):
+        """Return the running time in hours (2 decimals), or None if not positive"""
+        seconds = (end_time - start_time).total_seconds()
+        if seconds <= 0:
+            return None
+        return round(seconds / 3600, 2)
+
+    @staticmethod
+    def add_hours(device_id, hours, device_status = None):
+        """Add running hours (negative to take them back) to a device and all of its units.
+
+        Uses two set-based UPDATEs with F() expressions so concurrent
+        submissions never overwrite each other's totals. The units take
+        ``device_status`` unless it is None.
+        """
+        Device.objects.filter(pk = device_id).update(
+            total_system_hours = F('total_system_hours') + hours
+        )
+        # Every unit of the device runs with it and takes the operator's reported status
+        changes = {'current_hours': F('current_hours') + hours}
+        if device_status is not None:
+            changes['status'] = device_status
+        DeviceUnit.objects.filter(device_id = device_id).update(**changes)
+
+    @classmethod
+    def find_overlap(cls, device_id, start_time, end_time, exclude_pk = None):
+        """Return a log of the device whose run overlaps [start_time, end_time), or None.
+
+        A device's logs do not overlap each other, so only two candidates can
+        conflict: the first log starting inside the range and the last one
+        starting before it. Each is one seek on the (device, start_time,
+        end_time) index, so the check is O(log n) however long the history.
+        """
+        logs = cls.objects.filter(device_id = device_id)
+        if exclude_pk:
+            logs = logs.exclude(pk = exclude_pk)
+        inside = logs.filter(start_time__gte = start_time, start_time__lt = end_time).order_by('start_time').first()
+        if inside:
+            return inside
+        before = logs.filter(start_time__lt = start_time).order_by('-start_time').first()
+        if before and before.end_time > start_time:
+            return before
+        return None
+
+    @classmethod
+    async def afind_overlap(cls, device_id, start_time, end_time, exclude_pk = None):
+        """Async variant of ``find_overlap``"""
+        logs = cls.objects.filter(device_id = device_id)
+        if exclude_pk:
+            logs = logs.exclude(pk = exclude_pk)
+        inside = await logs.filter(start_time__gte = start_time, start_time__lt = end_time).order_by('start_time').afirst()
+        if inside:
+            return inside
+        before = await logs.filter(start_time__lt = start_time).order_by('-start_time').afirst()
+        if before and before.end_time > start_time:
+            return before
+        return None
+
+    def overlap_message(self):
+        """Error shown when a new log would overlap this one"""
+        start = timezone.localtime(self.start_time).strftime('%d/%m/%Y %H:%M')
+        end = timezone.localtime(self.end_time).strftime('%d/%m/%Y %H:%M')
+        return f"Trùng thời gian với nhật ký đã ghi của {self.operator_name} ({start} - {end})"
+
+    def clean(self):
+        if self.device_id and self.start_time and self.end_time and self.end_time > self.start_time:
+            overlap = self.find_overlap(self.device_id, self.start_time, self.end_time, exclude_pk = self.pk)
+            if overlap:
+                raise ValidationError(overlap.overlap_message())
+
     def save(self, *args, **kwargs):
+        duration = None
         # Calculate duration only if both times are set
         if self.start_time and self.end_time:
-            diff = self.end_time - self.start_time
+            duration = self.calculate_duration(self.start_time, self.end_time)
             # Only process if duration is positive
-            if diff.total_seconds() > 0:
-                self.duration = round(diff.total_seconds() / 3600, 2)
-                self.device.total_system_hours += self.duration
-                self.device.save()
-                
-                # Update all units of this device with:
-                # 1. Add operation hours
-                # 2. Update status based on operator's report
-                if self.device.pk:
-                    units = self.device.units.all()
-                    for unit in units:
-                        # Add duration to each unit's current hours (for tracking)
-                        unit.current_hours += self.duration
-                        
-                        # Update unit status from operator's report
-                        unit.status = self.device_status
-                        
-                        unit.save()
-        super().save(*args, **kwargs)
+            if duration is not None:
+                self.duration = duration
+
+        with transaction.atomic():
+            # An edit replaces the stored log's share of the counters and the usage rollup
+            previous = None
+            if not self._state.adding and self.pk:
+                previous = OperationLog.objects.filter(pk = self.pk).only(*USAGE_FIELDS).first()
+            super().save(*args, **kwargs)
+            hours = duration or 0.0
+            if previous is None:
+                if duration is not None:
+                    self.add_hours(self.device_id, duration, self.device_status)
+            elif previous.device_id != self.device_id:
+                # Moved to another device: its hours leave the old one
+                self.add_hours(previous.device_id, -(previous.duration or 0.0))
+                self.add_hours(self.device_id, hours, self.device_status)
+            elif hours != (previous.duration or 0.0):
+                self.add_hours(self.device_id, round(hours - (previous.duration or 0.0), 2), self.device_status)
+            DailyUsage.record([self], removed = [previous] if previous else ())
     
     def __str__(self):
         return f"Log: {self.device.name} - {self.duration}h - {self.get_device_status_display()}"
@@ -132,4 +242,120 @@ class OperationLog(models.Model):
         verbose_name = "5. Nhật ký máy"
         verbose_name_plural = "5. Nhật ký máy"
         ordering = ['-start_time']
+        indexes = [
+            # History/dashboard keyset pages ordered by (-start_time, -id)
+            models.Index(fields = ['-start_time', '-id'], name = 'oplog_start_time_id_idx'),
+            # Per-device logs by time (admin device filter, exports) and overlap
+            # checks, which read end_time straight from the index
+            models.Index(fields = ['device', 'start_time', 'end_time'], name = 'oplog_device_interval_idx'),
+        ]
+
+class DailyUsage(models.Model):
+    """Running hours and log counts per device, unit and local day.
+
+    Maintained incrementally by ``OperationLog.save()`` (an edit swaps the
+    old values of the log for the new ones) and the batch sync API;
+    ``rebuild_usage_rollup`` recomputes it from the whole log.
+    """
+    device = models.ForeignKey(Device, on_delete = models.CASCADE, related_name = 'daily_usage', verbose_name = "Thiết bị")
+    device_unit = models.ForeignKey(DeviceUnit, on_delete = models.CASCADE, null = True, blank = True, verbose_name = "Khối chi tiết")
+    day = models.DateField(verbose_name = "Ngày")
+    hours = models.FloatField(default = 0.0, verbose_name = "Giờ hoạt động (h)")
+    log_count = models.PositiveIntegerField(default = 0, verbose_name = "Số nhật ký")
+    normal_count = models.PositiveIntegerField(default = 0, verbose_name = "Bình thường")
+    maintenance_count = models.PositiveIntegerField(default = 0, verbose_name = "Cần bảo dưỡng")
+    error_count = models.PositiveIntegerField(default = 0, verbose_name = "Sự cố")
+
+    @classmethod
+    def record(cls, logs, removed = ()):
+        """Add logs to the rollup, and take ``removed`` logs out of it.
+
+        Existing rows get F() increments in one ``bulk_update`` and missing
+        rows are inserted with one ``bulk_create``, so the query count does
+        not depend on how many logs are recorded.
+        """
+        rollup = accumulate(logs)
+        for key, totals in accumulate(removed).items():
+            current = rollup.setdefault(key, empty_totals())
+            for name, value in totals.items():
+                current[name] -= value
+        rollup = {key: totals for key, totals in rollup.items() if any(totals.values())}
+        if not rollup:
+            return
+        existing = {
+            (row.device_id, row.device_unit_id, row.day): row
+            for row in cls.objects.filter(
+                device_id__in = {key[0] for key in rollup},
+                day__in = {key[2] for key in rollup},
+            )
+        }
+        changed, missing = [], []
+        for (device_id, unit_id, day), totals in rollup.items():
+            row = existing.get((device_id, unit_id, day))
+            if row is None:
+                # Counts cannot go below zero, should a removed log never have been recorded
+                totals = {name: max(value, 0) for name, value in totals.items()}
+                missing.append(cls(device_id = device_id, device_unit_id = unit_id, day = day, **totals))
+                continue
+            for name, value in totals.items():
+                setattr(row, name, F(name) + value)
+            changed.append(row)
+
+        if changed:
+            cls.objects.bulk_update(changed, list(empty_totals()))
+        if missing:
+            try:
+                with transaction.atomic():
+                    cls.objects.bulk_create(missing)
+            except IntegrityError:
+                # A concurrent request created some of these rows first
+                for row in missing:
+                    cls._increment(row)
+
+    @classmethod
+    def _increment(cls, row):
+        totals = {name: getattr(row, name) for name in empty_totals()}
+        rows = cls.objects.filter(device_id = row.device_id, device_unit_id = row.device_unit_id, day = row.day)
+        if not rows.update(**{name: F(name) + value for name, value in totals.items()}):
+            row.save()
+
+    def __str__(self):
+        return f"{self.device} - {self.day}: {self.hours:.2f}h"
 
+    class Meta:
+        verbose_name = "6. Thống kê giờ chạy theo ngày"
+        verbose_name_plural = "6. Thống kê giờ chạy theo ngày"
+        ordering = ['-day']
+        constraints = [
+            models.UniqueConstraint(fields = ['device', 'device_unit', 'day'], name = 'daily_usage_unique'),
+        ]
+        indexes = [
+            # Reports filter on a date range first, then group by device/department
+            models.Index(fields = ['day', 'device'], name = 'daily_usage_day_device_idx'),
+        ]
+
+class SyncChange(models.Model):
+    """Append-only list of changes to the fleet data the PWA keeps offline.
+
+    The id is the sync version: a client that holds version N asks for the
+    changes with a greater id. Old rows may be deleted; clients further
+    behind than the oldest row get a full snapshot instead.
+    """
+    MODEL_CHOICES = [
+        ('department', 'Ngành'),
+        ('location', 'Vị trí'),
+        ('device', 'Thiết bị'),
+        ('unit', 'Khối chi tiết'),
+    ]
+
+    model = models.CharField(max_length = 20, choices = MODEL_CHOICES, verbose_name = "Loại dữ liệu")
+    object_id = models.PositiveIntegerField(verbose_name = "ID")
+    deleted = models.BooleanField(default = False, verbose_name = "Đã xoá")
+    created_at = models.DateTimeField(auto_now_add = True, verbose_name = "Thời điểm")
+
+    def __str__(self):
+        return f"#{self.pk} {self.model} {self.object_id}{' (xoá)' if self.deleted else ''}"
+
+    class Meta:
+        verbose_name = "Thay đổi dữ liệu đồng bộ"
+        verbose_name_plural = "Thay đổi dữ liệu đồng bộ"
@@ -0,0 +1,54 @@
+"""Sort-and-sweep detection of overlapping runs.
+
+Intervals are any objects with ``device_id``, ``start_time`` and
+``end_time`` (OperationLog instances or the lightweight rows used by the
+scanner). They must arrive sorted by ``(device_id, start_time)``; each
+device is swept once, keeping a heap of the runs still open, so the cost
+is O(n log n + overlaps) instead of comparing every pair.
+"""
+import heapq
+from collections import namedtuple
+from itertools import count, groupby
+from operator import attrgetter
+
+
+def overlapping_pairs(intervals):
+    """Yield ``(earlier, later)`` for every pair of overlapping runs"""
+    for _, runs in groupby(intervals, key=attrgetter('device_id')):
+        open_runs = []  # heap of (end_time, tiebreak, run)
+        tiebreak = count()
+        for run in runs:
+            while open_runs and open_runs[0][0] <= run.start_time:
+                heapq.heappop(open_runs)
+            for _, _, earlier in open_runs:
+                yield earlier, run
+            heapq.heappush(open_runs, (run.end_time, next(tiebreak), run))
+
+
+_Tagged = namedtuple('_Tagged', 'device_id start_time end_time run is_candidate')
+
+
+def _tagged(runs, is_candidate):
+    return [_Tagged(run.device_id, run.start_time, run.end_time, run, is_candidate) for run in runs]
+
+
+def conflicts(existing, candidates):
+    """Return ``(candidate, run it overlaps)`` for each rejected candidate.
+
+    A candidate is rejected if it overlaps an existing run, or a candidate
+    accepted before it (in start order). Inputs may be in any order.
+    """
+    by_start = attrgetter('device_id', 'start_time')
+    rejected = {}
+    merged = sorted(_tagged(existing, False) + _tagged(candidates, True), key=by_start)
+    for earlier, later in overlapping_pairs(merged):
+        if earlier.is_candidate != later.is_candidate:
+            candidate, other = (earlier, later) if earlier.is_candidate else (later, earlier)
+            rejected.setdefault(id(candidate.run), (candidate.run, other.run))
+
+    # Among the remaining candidates the first one to start wins
+    remaining = sorted((run for run in candidates if id(run) not in rejected), key=by_start)
+    for earlier, later in overlapping_pairs(remaining):
+        if id(earlier) not in rejected:
+            rejected.setdefault(id(later), (later, earlier))
+    return list(rejected.values())
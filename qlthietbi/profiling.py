@@ -0,0 +1,138 @@
+"""On-demand request profiles, kept in a rotating directory.
+
+A staff user adds ``?profile=1`` to a URL (or sends an ``X-Profile``
+header) and ``ProfilerMiddleware`` runs that request under cProfile. Two
+files are saved per request in ``QLTHIETBI_PROFILE_DIR``:
+
+- ``<id>.prof``: the cProfile stats, for ``python -m pstats`` or snakeviz
+- ``<id>.json``: the request, its timings and every SQL query it ran
+
+Only the newest ``QLTHIETBI_PROFILE_KEEP`` profiles are kept. The admin
+lists them under the operation log changelist ("Hồ sơ hiệu năng").
+"""
+import io
+import json
+import pstats
+import re
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.text import slugify
+
+PROFILE_PARAM = 'profile'
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+DEFAULT_KEEP = 50
+
+# cProfile cannot profile two requests at once; a second one runs unprofiled
+profiling_lock = threading.Lock()
+
+_PROFILE_ID = re.compile(r'^\d{8}-\d{6}-\d{6}-[\w-]+$')
+
+
+def requested(request):
+    """Whether the request asks to be profiled; checks the raw query string first, as it is cheap"""
+    if PROFILE_HEADER in request.META:
+        return True
+    return PROFILE_PARAM in request.META.get('QUERY_STRING', '') and PROFILE_PARAM in request.GET
+
+
+def profile_dir():
+    return Path(getattr(settings, 'QLTHIETBI_PROFILE_DIR', Path(settings.BASE_DIR) / 'profiles'))
+
+
+def keep_count():
+    return getattr(settings, 'QLTHIETBI_PROFILE_KEEP', DEFAULT_KEEP)
+
+
+def profile_path(profile_id, suffix):
+    """Path of a saved profile file, or None for an unknown or malformed id"""
+    if not _PROFILE_ID.match(profile_id) or suffix not in ('.prof', '.json'):
+        return None
+    path = profile_dir() / f'{profile_id}{suffix}'
+    return path if path.is_file() else None
+
+
+class QueryLog:
+    """``execute_wrapper`` that keeps the SQL, parameters and time of each query"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries.append({'sql': sql, 'params': repr(params), 'many': many, 'ms': round(elapsed * 1000, 3)})
+
+
+def save(profiler, query_log, request, response, elapsed, user):
+    """Write the stats and the request summary; return the profile id"""
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    match = getattr(request, 'resolver_match', None)
+    view = match.view_name if match else 'unmatched'
+    now = timezone.now()
+    profile_id = f"{now:%Y%m%d-%H%M%S-%f}-{slugify(view.replace(':', '-')) or 'view'}"
+
+    profiler.dump_stats(directory / f'{profile_id}.prof')
+    summary = {
+        'id': profile_id,
+        'created_at': now.isoformat(),
+        'method': request.method,
+        'path': request.get_full_path(),
+        'view': view,
+        'status': response.status_code,
+        'user': user.get_username(),
+        'elapsed_ms': round(elapsed * 1000, 1),
+        'query_count': len(query_log.queries),
+        'query_ms': round(sum(query['ms'] for query in query_log.queries), 1),
+        'queries': query_log.queries,
+    }
+    with open(directory / f'{profile_id}.json', 'w', encoding='utf-8') as fileobj:
+        json.dump(summary, fileobj, ensure_ascii=False, indent=1)
+    prune(directory)
+    return profile_id
+
+
+def prune(directory=None):
+    """Delete all but the newest QLTHIETBI_PROFILE_KEEP profiles"""
+    directory = directory or profile_dir()
+    # Ids start with a timestamp, so names sort by age
+    stats_files = sorted(directory.glob('*.prof'), reverse=True)
+    for path in stats_files[keep_count():]:
+        path.unlink(missing_ok=True)
+        path.with_suffix('.json').unlink(missing_ok=True)
+
+
+def list_profiles():
+    """Summaries of the saved profiles, newest first, without their query lists"""
+    directory = profile_dir()
+    if not directory.is_dir():
+        return []
+    profiles = []
+    for path in sorted(directory.glob('*.json'), reverse=True):
+        try:
+            with open(path, encoding='utf-8') as fileobj:
+                summary = json.load(fileobj)
+        except (OSError, ValueError):
+            continue
+        summary.pop('queries', None)
+        summary['created_at'] = datetime.fromisoformat(summary['created_at'])
+        profiles.append(summary)
+    return profiles
+
+
+def top_functions(profile_id, limit=40):
+    """pstats text of the functions with the most cumulative time"""
+    path = profile_path(profile_id, '.prof')
+    if path is None:
+        return ''
+    out = io.StringIO()
+    pstats.Stats(str(path), stream=out).sort_stats('cumulative').print_stats(limit)
+    return out.getvalue()
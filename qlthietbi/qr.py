@@ -0,0 +1,81 @@
+"""QR code rendering.
+
+Kept free of Django imports so the functions can run in worker processes.
+"""
+import hashlib
+import io
+from functools import lru_cache
+
+import qrcode
+
+UPLOAD_DIR = 'qr_codes/units/'
+
+# Bump when the rendering below changes so clients drop their cached images
+RENDER_VERSION = 1
+
+CONTENT_TYPES = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+
+def _make_qr(content):
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(content)
+    qr.make(fit=True)
+    return qr
+
+
+def render_qr_png(content):
+    """Render ``content`` as a QR code and return the PNG bytes"""
+    img = _make_qr(content).make_image(fill_color="black", back_color="white")
+
+    img_io = io.BytesIO()
+    img.save(img_io, 'PNG')
+    return img_io.getvalue()
+
+
+def qr_filename(unit_id, qr_code):
+    """File name of a unit's QR image, e.g. ``unit_12_GKY-PWR.png``"""
+    return f"unit_{unit_id or 'new'}_{qr_code}.png"
+
+
+def render_qr_svg(content):
+    """Render ``content`` as a compact SVG (one path, one segment per run of dark modules)"""
+    matrix = _make_qr(content).get_matrix()
+    size = len(matrix)
+    segments = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < size:
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < size and row[x]:
+                x += 1
+            segments.append(f"M{start} {y}h{x - start}v1H{start}z")
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="#fff"/>'
+        f'<path d="{"".join(segments)}" fill="#000"/></svg>'
+    ).encode()
+
+
+@lru_cache(maxsize=2048)
+def render_qr(content, fmt):
+    """Rendered QR bytes for ``fmt`` ('png' or 'svg'), memoised by content"""
+    if fmt == 'svg':
+        return render_qr_svg(content)
+    return render_qr_png(content)
+
+
+def qr_etag(content, fmt):
+    """Strong validator for a rendered QR; depends only on what is drawn"""
+    digest = hashlib.sha256(f"{RENDER_VERSION}:{fmt}:{content}".encode()).hexdigest()
+    return f'"{digest[:32]}"'
@@ -0,0 +1,113 @@
+"""Model signal handlers that keep cached data in step with the database"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .cache import invalidate_dashboard, invalidate_devices, invalidate_units
+from .models import Department, Device, DeviceUnit, Location, OperationLog
+from .sync import FEED, record_changes
+
+# Set while logs are changed in bulk; the caller invalidates the caches once
+_bulk_log_changes = ContextVar('bulk_log_changes', default=False)
+
+
+@contextmanager
+def bulk_log_changes():
+    """Skip the per-log cache invalidation of the log handlers inside the block"""
+    token = _bulk_log_changes.set(True)
+    try:
+        yield
+    finally:
+        _bulk_log_changes.reset(token)
+
+
+@receiver(post_save, sender=Device)
+@receiver(post_delete, sender=Device)
+@receiver(post_save, sender=DeviceUnit)
+@receiver(post_delete, sender=DeviceUnit)
+@receiver(post_save, sender=OperationLog)
+@receiver(post_delete, sender=OperationLog)
+def dashboard_changed(sender, **kwargs):
+    if sender is OperationLog and _bulk_log_changes.get():
+        return
+    invalidate_dashboard()
+
+
+@receiver(pre_save, sender=DeviceUnit)
+def remember_unit_before_save(sender, instance, **kwargs):
+    # A unit moved to another device or given a new code leaves stale payloads behind
+    instance._cached_before = None
+    if instance.pk:
+        instance._cached_before = DeviceUnit.objects.filter(pk=instance.pk).values_list('qr_code', 'device_id').first()
+
+
+@receiver(post_save, sender=DeviceUnit)
+@receiver(post_delete, sender=DeviceUnit)
+def unit_changed(sender, instance, **kwargs):
+    # Siblings list this unit, so the whole device is dropped
+    qr_codes, device_ids = [instance.qr_code], {instance.device_id}
+    before = getattr(instance, '_cached_before', None)
+    if before:
+        qr_codes.append(before[0])
+        device_ids.add(before[1])
+    invalidate_units(qr_codes)
+    invalidate_devices(device_ids)
+
+
+@receiver(post_save, sender=Device)
+@receiver(post_delete, sender=Device)
+def device_changed(sender, instance, **kwargs):
+    invalidate_devices([instance.pk])
+
+
+@receiver(post_save, sender=OperationLog)
+@receiver(post_delete, sender=OperationLog)
+def log_changed(sender, instance, **kwargs):
+    # Saving a log updates the hours and status of every unit of its device
+    if not _bulk_log_changes.get():
+        invalidate_devices([instance.device_id])
+
+
+@receiver(post_save, sender=Location)
+@receiver(pre_delete, sender=Location)
+def location_changed(sender, instance, **kwargs):
+    # pre_delete: the units still point at the location before SET_NULL runs
+    invalidate_devices(DeviceUnit.objects.filter(location=instance).values('device_id'))
+
+
+@receiver(post_save, sender=Department)
+def department_changed(sender, instance, **kwargs):
+    invalidate_devices(Device.objects.filter(department=instance).values('pk'))
+
+
+FEED_SENDERS = {Department: 'department', Location: 'location', Device: 'device', DeviceUnit: 'unit'}
+
+
+@receiver(post_save, sender=Department)
+@receiver(post_save, sender=Location)
+@receiver(post_save, sender=Device)
+@receiver(post_save, sender=DeviceUnit)
+def feed_row_saved(sender, instance, update_fields=None, **kwargs):
+    model = FEED_SENDERS[sender]
+    # Saves touching only columns outside the feed (QR image, counters) change nothing offline
+    if update_fields is not None and not set(update_fields) & {
+        column.removesuffix('_id') for column in FEED[model][2]
+    }:
+        return
+    record_changes(model, [instance.pk])
+
+
+@receiver(post_delete, sender=Department)
+@receiver(post_delete, sender=Location)
+@receiver(post_delete, sender=Device)
+@receiver(post_delete, sender=DeviceUnit)
+def feed_row_deleted(sender, instance, **kwargs):
+    record_changes(FEED_SENDERS[sender], [instance.pk], deleted=True)
+
+
+@receiver(pre_delete, sender=Location)
+def location_units_unset(sender, instance, **kwargs):
+    # SET_NULL clears the units' location with a plain UPDATE, without signals
+    record_changes('unit', DeviceUnit.objects.filter(location=instance).values_list('pk', flat=True))
@@ -0,0 +1,16 @@
+'use strict';
+// Admin AutocompleteFilter: picking an object in the search box applies the filter
+{
+    const $ = django.jQuery;
+
+    $(function() {
+        $('.autocomplete-filter select').on('change', function() {
+            const item = this.closest('.autocomplete-filter');
+            const url = new URL(item.dataset.baseUrl, window.location.href);
+            if (this.value) {
+                url.searchParams.set(item.dataset.lookup, this.value);
+            }
+            window.location.href = url.href;
+        });
+    });
+}
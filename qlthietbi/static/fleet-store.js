@@ -0,0 +1,116 @@
+// Offline copy of the fleet (departments, locations, devices, units) in IndexedDB.
+// Loaded by the service worker (importScripts) and by the offline unit page.
+const FleetStore = (() => {
+  const DB_NAME = 'skts';
+  const DB_VERSION = 1;
+  const STORES = ['departments', 'locations', 'devices', 'units'];
+  const SNAPSHOT_URL = '/api/dong-bo/du-lieu/';
+  const CHANGES_URL = '/api/dong-bo/thay-doi/';
+
+  function request(req) {
+    return new Promise((resolve, reject) => {
+      req.onsuccess = () => resolve(req.result);
+      req.onerror = () => reject(req.error);
+    });
+  }
+
+  function done(tx) {
+    return new Promise((resolve, reject) => {
+      tx.oncomplete = () => resolve();
+      tx.onerror = () => reject(tx.error);
+      tx.onabort = () => reject(tx.error);
+    });
+  }
+
+  function open() {
+    const req = indexedDB.open(DB_NAME, DB_VERSION);
+    req.onupgradeneeded = () => {
+      const db = req.result;
+      STORES.forEach((name) => {
+        if (!db.objectStoreNames.contains(name)) {
+          const store = db.createObjectStore(name, { keyPath: 'id' });
+          if (name === 'units') {
+            // Not unique: a delta may move a code between units in either order
+            store.createIndex('qr_code', 'qr_code');
+            store.createIndex('device_id', 'device_id');
+          }
+        }
+      });
+      if (!db.objectStoreNames.contains('meta')) {
+        db.createObjectStore('meta');
+      }
+    };
+    return request(req);
+  }
+
+  // Rows arrive as value lists; payload.fields names the columns once
+  function toObject(fields, row) {
+    const item = {};
+    fields.forEach((field, i) => { item[field] = row[i]; });
+    return item;
+  }
+
+  async function apply(payload) {
+    const db = await open();
+    const tx = db.transaction([...STORES, 'meta'], 'readwrite');
+    STORES.forEach((name) => {
+      const store = tx.objectStore(name);
+      if (payload.full) {
+        store.clear();
+      }
+      (payload.deleted[name] || []).forEach((id) => store.delete(id));
+      (payload[name] || []).forEach((row) => store.put(toObject(payload.fields[name], row)));
+    });
+    tx.objectStore('meta').put(payload.version, 'version');
+    await done(tx);
+    db.close();
+    return payload.version;
+  }
+
+  async function version() {
+    const db = await open();
+    const value = await request(db.transaction('meta').objectStore('meta').get('version'));
+    db.close();
+    return value || 0;
+  }
+
+  // Fetch the deltas since the stored version (a snapshot the first time) and apply them
+  async function sync() {
+    const since = await version();
+    const url = since ? `${CHANGES_URL}?since=${since}` : SNAPSHOT_URL;
+    const response = await fetch(url, { credentials: 'same-origin', cache: 'no-store' });
+    if (!response.ok) {
+      throw new Error(`Fleet sync failed: ${response.status}`);
+    }
+    const payload = await response.json();
+    if (!payload.full && payload.version === since) {
+      return since;
+    }
+    return apply(payload);
+  }
+
+  // Unit for a QR code with its device, department, location and sibling units
+  async function lookup(qrCode) {
+    const db = await open();
+    const tx = db.transaction(STORES);
+    const unit = await request(tx.objectStore('units').index('qr_code').get(qrCode));
+    if (!unit) {
+      db.close();
+      return null;
+    }
+    const device = await request(tx.objectStore('devices').get(unit.device_id));
+    const department = device ? await request(tx.objectStore('departments').get(device.department_id)) : null;
+    const location = unit.location_id ? await request(tx.objectStore('locations').get(unit.location_id)) : null;
+    const siblings = await request(tx.objectStore('units').index('device_id').getAll(unit.device_id));
+    db.close();
+    return {
+      unit,
+      device,
+      department,
+      location,
+      siblings,
+    };
+  }
+
+  return { open, apply, version, sync, lookup };
+})();
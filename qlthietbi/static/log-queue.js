@@ -0,0 +1,196 @@
+// Offline write queue: operation logs recorded without a connection, kept in IndexedDB
+// until the batch sync API accepts them. Shared by the pages and the service worker.
+const LogQueue = (() => {
+  const DB_NAME = 'skts-outbox';
+  const DB_VERSION = 1;
+  const SYNC_URL = '/api/dong-bo-nhat-ky/';
+  const SYNC_TAG = 'sync-logs';
+  // Stays well under the server's limit of 500 logs per request
+  const BATCH_SIZE = 50;
+  // Retry delays double from 30 s up to one hour
+  const BACKOFF_BASE = 30 * 1000;
+  const BACKOFF_MAX = 60 * 60 * 1000;
+
+  function request(req) {
+    return new Promise((resolve, reject) => {
+      req.onsuccess = () => resolve(req.result);
+      req.onerror = () => reject(req.error);
+    });
+  }
+
+  function done(tx) {
+    return new Promise((resolve, reject) => {
+      tx.oncomplete = () => resolve();
+      tx.onerror = () => reject(tx.error);
+      tx.onabort = () => reject(tx.error);
+    });
+  }
+
+  function open() {
+    const req = indexedDB.open(DB_NAME, DB_VERSION);
+    req.onupgradeneeded = () => {
+      const db = req.result;
+      // Waiting to be sent, in the order they were recorded
+      db.createObjectStore('pending', { keyPath: 'id', autoIncrement: true });
+      // Refused by the server (unknown unit, overlap...): kept for the operator to review
+      db.createObjectStore('rejected', { keyPath: 'id' });
+      // CSRF token and retry state
+      db.createObjectStore('meta');
+    };
+    return request(req);
+  }
+
+  async function withStores(names, mode, work) {
+    const db = await open();
+    const tx = db.transaction(names, mode);
+    const result = await work(tx);
+    await done(tx);
+    db.close();
+    return result;
+  }
+
+  function getMeta(key) {
+    return withStores(['meta'], 'readonly', (tx) => request(tx.objectStore('meta').get(key)));
+  }
+
+  function setMeta(key, value) {
+    return withStores(['meta'], 'readwrite', (tx) => request(tx.objectStore('meta').put(value, key)));
+  }
+
+  // The service worker cannot read cookies, so pages hand it the CSRF token
+  function setToken(token) {
+    return setMeta('csrf_token', token);
+  }
+
+  // Random UUID v4; crypto.randomUUID needs HTTPS, which LAN installs may lack
+  function newId() {
+    const bytes = crypto.getRandomValues(new Uint8Array(16));
+    bytes[6] = (bytes[6] & 0x0f) | 0x40;
+    bytes[8] = (bytes[8] & 0x3f) | 0x80;
+    const hex = Array.from(bytes, (byte) => byte.toString(16).padStart(2, '0')).join('');
+    return `${hex.slice(0, 8)}-${hex.slice(8, 12)}-${hex.slice(12, 16)}-${hex.slice(16, 20)}-${hex.slice(20)}`;
+  }
+
+  // Each entry keeps its client_id through every retry, so the server stores it once
+  function add(entry) {
+    return withStores(['pending'], 'readwrite', (tx) => request(tx.objectStore('pending').add({
+      ...entry,
+      client_id: entry.client_id || newId(),
+      queued_at: new Date().toISOString(),
+    })));
+  }
+
+  function counts() {
+    return withStores(['pending', 'rejected'], 'readonly', async (tx) => ({
+      pending: await request(tx.objectStore('pending').count()),
+      rejected: await request(tx.objectStore('rejected').count()),
+    }));
+  }
+
+  function rejected() {
+    return withStores(['rejected'], 'readonly', (tx) => request(tx.objectStore('rejected').getAll()));
+  }
+
+  function clearRejected() {
+    return withStores(['rejected'], 'readwrite', (tx) => request(tx.objectStore('rejected').clear()));
+  }
+
+  function nextBatch() {
+    return withStores(['pending'], 'readonly', (tx) => request(tx.objectStore('pending').getAll(null, BATCH_SIZE)));
+  }
+
+  // Drop accepted entries and move refused ones aside, in one transaction
+  function settle(batch, results) {
+    return withStores(['pending', 'rejected'], 'readwrite', (tx) => {
+      const pending = tx.objectStore('pending');
+      results.forEach((result) => {
+        const entry = batch[result.index];
+        pending.delete(entry.id);
+        if (!result.success) {
+          tx.objectStore('rejected').put({ ...entry, message: result.message });
+        }
+      });
+    });
+  }
+
+  async function backOff() {
+    const state = (await getMeta('retry')) || { failures: 0 };
+    const failures = state.failures + 1;
+    const delay = Math.min(BACKOFF_BASE * 2 ** (failures - 1), BACKOFF_MAX);
+    await setMeta('retry', { failures, retry_at: Date.now() + delay });
+  }
+
+  let flushing = null;
+
+  // Send the queue in batches. Returns the number of entries settled; throws
+  // when the server could not be reached, after scheduling the next retry.
+  // Unless `force` is set, nothing is sent before that retry time.
+  function flush(force) {
+    // One flush at a time, or a batch could be sent twice
+    if (!flushing) {
+      flushing = sendAll(force).finally(() => { flushing = null; });
+    }
+    return flushing;
+  }
+
+  async function sendAll(force) {
+    const state = await getMeta('retry');
+    if (!force && state && state.retry_at > Date.now()) {
+      return 0;
+    }
+    const token = await getMeta('csrf_token');
+    let settled = 0;
+    for (;;) {
+      const batch = await nextBatch();
+      if (!batch.length) {
+        break;
+      }
+      let response;
+      try {
+        response = await fetch(SYNC_URL, {
+          method: 'POST',
+          credentials: 'same-origin',
+          headers: { 'Content-Type': 'application/json', 'X-CSRFToken': token || '' },
+          body: JSON.stringify({ logs: batch }),
+        });
+      } catch (error) {
+        await backOff();
+        throw error;
+      }
+      if (!response.ok) {
+        // 400 means the request itself is malformed and would fail forever
+        if (response.status === 400) {
+          const body = await response.json().catch(() => ({}));
+          await settle(batch, batch.map((_, index) => ({ index, success: false, message: body.message })));
+          settled += batch.length;
+          continue;
+        }
+        await backOff();
+        throw new Error(`Log sync failed: ${response.status}`);
+      }
+      const body = await response.json();
+      await settle(batch, body.results);
+      settled += batch.length;
+    }
+    await setMeta('retry', null);
+    return settled;
+  }
+
+  // Ask for a flush: Background Sync when available (it survives the page being
+  // closed), otherwise the service worker, otherwise this page
+  async function requestFlush() {
+    if ('serviceWorker' in navigator) {
+      const registration = await navigator.serviceWorker.ready;
+      if ('sync' in registration) {
+        return registration.sync.register(SYNC_TAG);
+      }
+      if (navigator.serviceWorker.controller) {
+        navigator.serviceWorker.controller.postMessage({ type: 'SYNC_PENDING_LOGS' });
+        return undefined;
+      }
+    }
+    return flush(false).catch(() => {});
+  }
+
+  return { SYNC_TAG, open, newId, add, counts, rejected, clearRejected, setToken, flush, requestFlush };
+})();
@@ -1,10 +1,46 @@
 // Service Worker for PWA - Offline Support with Background Sync
-const CACHE_VERSION = 'skts-v1';
+importScripts('/static/fleet-store.js', '/static/log-queue.js');
+
+const CACHE_VERSION = 'skts-v4';
+const OFFLINE_UNIT_PAGE = '/ngoai-tuyen/khoi/';
 const CACHE_ASSETS = [
   '/',
   '/static/manifest.json',
+  '/static/fleet-store.js',
+  '/static/log-queue.js',
   '/offline/',
+  OFFLINE_UNIT_PAGE,
 ];
+// Never kept in the runtime cache: log exports can be large and hold data the
+// device should not keep, API JSON is revalidated with ETags and the offline
+// copy lives in IndexedDB, and staff pages stay on the server
+const NO_CACHE_PREFIXES = ['/api/', '/xuat-nhat-ky/', '/metrics', '/admin/'];
+// Resync the offline fleet copy at most this often while pages are browsed online
+const FLEET_SYNC_INTERVAL = 5 * 60 * 1000;
+let lastFleetSync = 0;
+
+function syncFleet(force) {
+  const now = Date.now();
+  if (!force && now - lastFleetSync < FLEET_SYNC_INTERVAL) {
+    return Promise.resolve();
+  }
+  lastFleetSync = now;
+  return FleetStore.sync().catch((error) => {
+    lastFleetSync = 0;
+    console.log('Fleet sync failed:', error);
+  });
+}
+
+// Offline scan (or log form) of a unit never opened online: render it from the fleet copy
+function offlineUnitPage(url) {
+  const match = url.pathname.match(/^\/(?:thiet-bi|ghi-nhat-ky)\/([^/]+)\/$/);
+  if (!match) {
+    return Promise.resolve(null);
+  }
+  return FleetStore.lookup(decodeURIComponent(match[1]))
+    .then((found) => (found ? caches.match(OFFLINE_UNIT_PAGE) : null))
+    .catch(() => null);
+}
 
 // Install: Cache core assets
 self.addEventListener('install', (event) => {
@@ -29,11 +65,18 @@ self.addEventListener('activate', (event) => {
           }
         })
       );
-    })
+    }).then(() => syncFleet(true))
   );
   self.clients.claim();
 });
 
+// Periodic Background Sync, where the browser offers it
+self.addEventListener('periodicsync', (event) => {
+  if (event.tag === 'sync-fleet') {
+    event.waitUntil(syncFleet(true));
+  }
+});
+
 // Fetch: Network first, fallback to cache
 self.addEventListener('fetch', (event) => {
   const { request } = event;
@@ -49,6 +92,33 @@ self.addEventListener('fetch', (event) => {
     return;
   }
 
+  if (NO_CACHE_PREFIXES.some((prefix) => url.pathname.startsWith(prefix))) {
+    return;
+  }
+
+  // QR images never change for a given URL: serve from cache when present
+  if (url.pathname.startsWith('/ma-qr/')) {
+    event.respondWith(
+      caches.match(request).then((cachedResponse) => {
+        return cachedResponse || fetch(request).then((response) => {
+          if (response.status === 200) {
+            const responseToCache = response.clone();
+            caches.open(CACHE_VERSION).then((cache) => {
+              cache.put(request, responseToCache);
+            });
+          }
+          return response;
+        });
+      })
+    );
+    return;
+  }
+
+  // Pages load fine: the network is back, so bring the fleet copy up to date
+  if (request.mode === 'navigate') {
+    event.waitUntil(syncFleet(false));
+  }
+
   event.respondWith(
     fetch(request)
       .then((response) => {
@@ -69,7 +139,7 @@ self.addEventListener('fetch', (event) => {
           }
           // Return offline page for HTML requests
           if (request.headers.get('accept').includes('text/html')) {
-            return caches.match('/offline/');
+            return offlineUnitPage(url).then((page) => page || caches.match('/offline/'));
           }
           return new Response('Offline', {
             status: 503,
@@ -80,25 +150,31 @@ self.addEventListener('fetch', (event) => {
   );
 });
 
-// Background Sync: Resend pending logs when online
+// Background Sync: send the queued offline logs. A failed flush rejects so the
+// browser retries later with its own backoff; on the last try the queue keeps
+// the entries and pages request another flush when they next load.
 self.addEventListener('sync', (event) => {
-  if (event.tag === 'sync-logs') {
-    event.waitUntil(syncPendingLogs());
+  if (event.tag === LogQueue.SYNC_TAG) {
+    event.waitUntil(syncPendingLogs(true).catch((error) => {
+      if (!event.lastChance) {
+        throw error;
+      }
+    }));
   }
 });
 
-function syncPendingLogs() {
-  return new Promise((resolve) => {
-    // Get pending log from IndexedDB or localStorage
-    self.clients.matchAll().then((clients) => {
-      clients.forEach((client) => {
-        client.postMessage({
-          type: 'SYNC_LOGS',
-          status: 'ready',
-        });
-      });
-    });
-    resolve();
+function syncPendingLogs(force) {
+  return LogQueue.flush(force).then((settled) => {
+    if (settled) {
+      notifyClients({ type: 'SYNC_LOGS', status: 'done', settled });
+    }
+    return settled;
+  });
+}
+
+function notifyClients(message) {
+  return self.clients.matchAll().then((clients) => {
+    clients.forEach((client) => client.postMessage(message));
   });
 }
 
@@ -108,9 +184,13 @@ self.addEventListener('message', (event) => {
     self.skipWaiting();
   }
   
+  if (event.data && event.data.type === 'REFRESH_FLEET') {
+    event.waitUntil(syncFleet(true));
+  }
+
   if (event.data && event.data.type === 'SYNC_PENDING_LOGS') {
-    // Handle pending logs sync request from client
-    event.waitUntil(syncPendingLogs());
+    // No Background Sync in this browser: flush now, unless still backing off
+    event.waitUntil(syncPendingLogs(false).catch(() => {}));
   }
 });
 
@@ -0,0 +1,85 @@
+"""Snapshot and delta feed of the fleet data the PWA keeps offline.
+
+Departments, locations, devices and units are sent as compact rows (lists
+of values, with the column names once under ``fields``). Every write to
+them appends a SyncChange row (see ``signals.py``); its id is the sync
+version. ``changes_since(N)`` returns the current rows of everything
+changed after N plus the ids deleted since, so a resync only transfers
+the deltas. Hour counters and statuses change with every log and are not
+part of the feed; the online JSON API serves them.
+
+SyncChange ids must become visible in commit order for this to be exact,
+which holds on SQLite since it serializes write transactions.
+"""
+from .models import Department, Device, DeviceUnit, Location, SyncChange
+
+# model key -> (feed name, model, columns)
+FEED = {
+    'department': ('departments', Department, ('id', 'name')),
+    'location': ('locations', Location, ('id', 'name')),
+    'device': ('devices', Device, ('id', 'department_id', 'name')),
+    'unit': ('units', DeviceUnit, ('id', 'device_id', 'location_id', 'name', 'qr_code', 'maintenance_threshold')),
+}
+
+
+def record_changes(model, ids, deleted=False):
+    """Append changes for ``ids`` of a feed model (``'unit'``, ``'device'``, ...)"""
+    SyncChange.objects.bulk_create([
+        SyncChange(model=model, object_id=object_id, deleted=deleted) for object_id in ids
+    ])
+
+
+def current_version():
+    return SyncChange.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def _payload(version, full, rows, deleted):
+    return {
+        'version': version,
+        'full': full,
+        'fields': {name: list(columns) for name, _, columns in FEED.values()},
+        **rows,
+        'deleted': deleted,
+    }
+
+
+def snapshot(version=None):
+    """Every department, location, device and unit, as of ``version``"""
+    version = current_version() if version is None else version
+    rows = {
+        name: list(model.objects.order_by('pk').values_list(*columns))
+        for name, model, columns in FEED.values()
+    }
+    return _payload(version, True, rows, {name: [] for name, _, _ in FEED.values()})
+
+
+def changes_since(since):
+    """Rows changed and ids deleted after version ``since``.
+
+    Falls back to a snapshot when ``since`` is 0, ahead of the server (the
+    database was replaced) or older than the oldest change still kept.
+    """
+    version = current_version()
+    oldest = SyncChange.objects.order_by('id').values_list('id', flat=True).first()
+    if since <= 0 or since > version or (oldest is not None and since < oldest - 1):
+        return snapshot(version)
+
+    # The last change of each object decides whether it is sent or deleted
+    latest = {}
+    for model, object_id, deleted in (
+        SyncChange.objects.filter(id__gt=since, id__lte=version)
+        .order_by('id').values_list('model', 'object_id', 'deleted').iterator()
+    ):
+        latest[model, object_id] = deleted
+
+    rows, removed = {}, {}
+    for key, (name, model, columns) in FEED.items():
+        changed = [object_id for (kind, object_id), deleted in latest.items() if kind == key and not deleted]
+        rows[name] = list(model.objects.filter(pk__in=changed).order_by('pk').values_list(*columns)) if changed else []
+        # An object deleted before it was ever saved again is gone for good
+        existing = {row[0] for row in rows[name]}
+        removed[name] = [
+            object_id for (kind, object_id), deleted in latest.items()
+            if kind == key and (deleted or object_id not in existing)
+        ]
+    return _payload(version, False, rows, removed)
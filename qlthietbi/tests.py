@@ -1,11 +1,34 @@
-from django.test import TestCase, Client
+from django.test import TestCase, TransactionTestCase, Client, override_settings
 from django.urls import reverse
 from django.contrib.auth.models import User
 from django.utils import timezone
-from datetime import timedelta
+from datetime import datetime, timedelta
 import json
+import threading
+import time
 
-from .models import Device, DeviceUnit, OperationLog, Department, Location
+from .models import DailyUsage, Device, DeviceUnit, OperationLog, Department, Location
+
+# Whatever core/settings.py says, the suite keeps no QR image files and
+# never writes into the project's media/ directory
+_media_root = None
+_media_override = None
+
+
+def setUpModule():
+    import tempfile
+    global _media_root, _media_override
+    
+    _media_root = tempfile.mkdtemp()
+    _media_override = override_settings(MEDIA_ROOT=_media_root, QLTHIETBI_STORE_QR_IMAGES=False)
+    _media_override.enable()
+
+
+def tearDownModule():
+    import shutil
+    
+    _media_override.disable()
+    shutil.rmtree(_media_root, ignore_errors=True)
 
 
 class OfflineLogSubmissionTest(TestCase):
@@ -221,6 +244,16 @@ class OfflineDataPersistenceTest(TestCase):
         
         self.assertEqual(restored['operator_name'], 'Thủy thủ A')
         self.assertEqual(restored['qr_code'], 'DEVICE001')
+    
+    def test_offline_message(self):
+        """Test that offline saves show the message the UI guidelines mandate"""
+        dept = Department.objects.create(name="Hệ thống chính")
+        device = Device.objects.create(name="Động cơ chính", department=dept)
+        DeviceUnit.objects.create(device=device, name="Khối 1", qr_code="DEVICE001")
+        
+        for url in (reverse('log_entry', args=['DEVICE001']), reverse('offline_unit')):
+            with self.subTest(url=url):
+                self.assertContains(self.client.get(url), 'Mất kết nối. Dữ liệu đã lưu tạm vào máy.')
 
 
 class ServiceWorkerTest(TestCase):
@@ -278,6 +311,29 @@ class CSRFandNetworkSecurityTest(TestCase):
         )
         # Note: This test will fail until settings are updated
         # We're documenting what needs to be tested
+    
+    def test_queued_logs_sync_with_page_token(self):
+        """Test the CSRF token pages hand to the offline queue is accepted by the batch API"""
+        import re
+        
+        response = self.client.get(reverse('dashboard'))
+        token = re.search(r'<meta name="csrf-token" content="([^"]+)">', response.content.decode()).group(1)
+        self.assertContains(response, 'log-queue.js')
+        
+        start_time = timezone.now() - timedelta(hours=3)
+        logs = [{
+            'qr_code': 'DEVICE001',
+            'operator_name': 'Thủy thủ A',
+            'start_time': (start_time + timedelta(hours=offset)).isoformat(),
+            'end_time': (start_time + timedelta(hours=offset + 1)).isoformat(),
+        } for offset in (0, 1)]
+        url = reverse('api_batch_log_entry')
+        body = json.dumps({'logs': logs})
+        response = self.client.post(url, data=body, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post(url, data=body, content_type='application/json', HTTP_X_CSRFTOKEN=token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['saved'], 2)
 
 
 class DurationCalculationTest(TestCase):
@@ -338,3 +394,1393 @@ class DurationCalculationTest(TestCase):
         self.device.refresh_from_db()
         self.assertAlmostEqual(self.device.total_system_hours, 
                               initial_hours + 5.0, places=2)
+
+
+class BatchLogSyncTest(TestCase):
+    """Test batch replay of offline operation logs"""
+    
+    def setUp(self):
+        self.client = Client()
+        self.dept = Department.objects.create(name="Hệ thống chính")
+        self.device = Device.objects.create(name="Động cơ chính", department=self.dept)
+        self.other_device = Device.objects.create(name="Máy phát điện", department=self.dept)
+        self.unit_a = DeviceUnit.objects.create(device=self.device, name="Khối 1", qr_code="DEVICE001")
+        self.unit_b = DeviceUnit.objects.create(device=self.device, name="Khối 2", qr_code="DEVICE002")
+        self.unit_c = DeviceUnit.objects.create(device=self.other_device, name="Khối 1", qr_code="GEN001")
+        self.base_time = timezone.make_aware(datetime(2026, 3, 10, 0, 0))
+    
+    def _log(self, qr_code, hours, offset=0, **extra):
+        # Logs of one device must not overlap, so each starts ``offset`` hours into the day
+        start_time = self.base_time + timedelta(hours=offset)
+        data = {
+            'qr_code': qr_code,
+            'operator_name': 'Thủy thủ A',
+            'start_time': start_time.isoformat(),
+            'end_time': (start_time + timedelta(hours=hours)).isoformat(),
+        }
+        data.update(extra)
+        return data
+    
+    def _post(self, logs):
+        return self.client.post(
+            reverse('api_batch_log_entry'),
+            data=json.dumps({'logs': logs}),
+            content_type='application/json',
+        )
+    
+    def test_batch_creates_logs_and_updates_hours(self):
+        """Test that a batch across devices writes every log and accumulates hours"""
+        response = self._post([
+            self._log('DEVICE001', 2),
+            self._log('DEVICE002', 1, offset=2, device_status='MAINTENANCE'),
+            self._log('GEN001', 3),
+        ])
+        self.assertEqual(response.status_code, 200)
+        payload = response.json()
+        self.assertEqual(payload['saved'], 3)
+        self.assertTrue(all(r['success'] for r in payload['results']))
+        self.assertEqual(OperationLog.objects.count(), 3)
+        
+        self.device.refresh_from_db()
+        self.other_device.refresh_from_db()
+        self.unit_a.refresh_from_db()
+        self.unit_c.refresh_from_db()
+        self.assertAlmostEqual(self.device.total_system_hours, 3.0, places=2)
+        self.assertAlmostEqual(self.other_device.total_system_hours, 3.0, places=2)
+        self.assertAlmostEqual(self.unit_a.current_hours, 3.0, places=2)
+        self.assertEqual(self.unit_a.status, 'MAINTENANCE')
+        self.assertEqual(self.unit_c.status, 'NORMAL')
+    
+    def test_batch_reports_invalid_items(self):
+        """Test that invalid items are reported per item and do not block valid ones"""
+        response = self._post([
+            self._log('DEVICE001', 2),
+            self._log('UNKNOWN', 1),
+            self._log('DEVICE001', -1),
+        ])
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([r['success'] for r in results], [True, False, False])
+        self.assertEqual(results[2]['message'], 'Giờ tắt máy phải sau giờ nổ máy')
+        self.assertEqual(OperationLog.objects.count(), 1)
+    
+    def test_batch_rejects_malformed_fields(self):
+        """Test that wrong types, unknown statuses and long fields fail only their own item"""
+        response = self._post([
+            self._log('DEVICE001', 1, device_status={'x': 1}),
+            self._log('DEVICE001', 1, offset=1, device_status='BOGUS'),
+            self._log('DEVICE001', 1, offset=2, operator_name=['Thủy thủ A']),
+            self._log('DEVICE001', 1, offset=3, operator_name='A' * 51),
+            self._log('DEVICE001', 1, offset=4, start_time=12),
+            self._log('DEVICE001', 1, offset=5, device_status='ERROR'),
+        ])
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([r['success'] for r in results], [False] * 5 + [True])
+        self.assertEqual(results[1]['message'], 'Trạng thái thiết bị không hợp lệ')
+        self.assertEqual(set(DeviceUnit.objects.values_list('status', flat=True)), {'ERROR', 'NORMAL'})
+        self.unit_a.refresh_from_db()
+        self.assertEqual(self.unit_a.status, 'ERROR')
+    
+    def test_batch_query_count(self):
+        """Test that the number of queries does not grow with the batch size"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        
+        # The first log of a day inserts its usage rollup row; later ones update it
+        self._post([self._log('DEVICE001', 1)])
+        with CaptureQueriesContext(connection) as single:
+            self._post([self._log('DEVICE001', 1, offset=1)])
+        with CaptureQueriesContext(connection) as many:
+            response = self._post([self._log('DEVICE001', 1, offset=2 + i) for i in range(20)])
+        
+        self.assertEqual(response.json()['saved'], 20)
+        self.assertEqual(len(many), len(single))
+    
+    def test_batch_requires_log_list(self):
+        """Test that a body without a log list is rejected"""
+        response = self.client.post(
+            reverse('api_batch_log_entry'),
+            data=json.dumps({'qr_code': 'DEVICE001'}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class ConcurrentHourAccumulationTest(TransactionTestCase):
+    """Test that parallel log submissions never lose hours"""
+    
+    WORKERS = 8
+    LOGS_PER_WORKER = 5
+    
+    def setUp(self):
+        self.dept = Department.objects.create(name="Hệ thống chính")
+        self.device = Device.objects.create(name="Động cơ chính", department=self.dept)
+        self.unit = DeviceUnit.objects.create(device=self.device, name="Khối 1", qr_code="DEVICE001")
+    
+    def _submit_logs(self, barrier):
+        from django.db import OperationalError, connection
+        
+        try:
+            # Each worker holds a stale Device instance, like parallel requests would
+            device = Device.objects.get(pk=self.device.pk)
+            barrier.wait()
+            start_time = timezone.now()
+            for _ in range(self.LOGS_PER_WORKER):
+                log = OperationLog(
+                    device=device,
+                    device_unit=self.unit,
+                    operator_name='Thủy thủ A',
+                    start_time=start_time,
+                    end_time=start_time + timedelta(hours=1),
+                )
+                # SQLite allows a single writer; retry when the table is locked
+                while True:
+                    try:
+                        log.save()
+                        break
+                    except OperationalError:
+                        time.sleep(0.01)
+        finally:
+            connection.close()
+    
+    def test_parallel_submissions_keep_all_hours(self):
+        """Test that totals equal the sum of all submitted durations"""
+        barrier = threading.Barrier(self.WORKERS)
+        threads = [
+            threading.Thread(target=self._submit_logs, args=(barrier,))
+            for _ in range(self.WORKERS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        expected = float(self.WORKERS * self.LOGS_PER_WORKER)
+        self.device.refresh_from_db()
+        self.unit.refresh_from_db()
+        self.assertEqual(OperationLog.objects.count(), self.WORKERS * self.LOGS_PER_WORKER)
+        self.assertAlmostEqual(self.device.total_system_hours, expected, places=2)
+        self.assertAlmostEqual(self.unit.current_hours, expected, places=2)
+
+    def test_parallel_double_taps_save_one_log(self):
+        """Test that the same run submitted at once without a key is saved once"""
+        from unittest import mock
+        from django.db import OperationalError, connection
+        from .views import _save_unless_overlapping
+
+        start_time = timezone.now()
+        started = threading.Barrier(self.WORKERS)
+        find_overlap = OperationLog.find_overlap
+        checking = []
+        most_checking = []
+        outcomes = []
+
+        def find_slowly(*args, **kwargs):
+            # Keep each check in flight long enough for the others to start theirs
+            checking.append(1)
+            most_checking.append(len(checking))
+            time.sleep(0.05)
+            checking.pop()
+            return find_overlap(*args, **kwargs)
+
+        def submit():
+            try:
+                started.wait()
+                while True:
+                    try:
+                        log = OperationLog(
+                            device=self.device, device_unit=self.unit, operator_name='Thủy thủ A',
+                            start_time=start_time, end_time=start_time + timedelta(hours=1),
+                        )
+                        outcomes.append(_save_unless_overlapping(log))
+                        break
+                    except OperationalError:
+                        time.sleep(0.01)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=submit) for _ in range(self.WORKERS)]
+        with mock.patch.object(OperationLog, 'find_overlap', side_effect=find_slowly):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        # The device lock lets one submission check (and save) at a time
+        self.assertEqual(max(most_checking), 1)
+        saved = [log for log, created, _ in outcomes if created]
+        self.assertEqual(len(saved), 1)
+        # Every later submission saw the first one as an overlap
+        self.assertEqual([overlap.pk for _, _, overlap in outcomes if overlap], [saved[0].pk] * (self.WORKERS - 1))
+        self.device.refresh_from_db()
+        self.assertAlmostEqual(self.device.total_system_hours, 1.0, places=2)
+
+
+class OverlapDetectionTest(TestCase):
+    """Test rejection of overlapping and duplicate operation logs"""
+    
+    def setUp(self):
+        dept = Department.objects.create(name="Hệ thống chính")
+        self.device = Device.objects.create(name="Động cơ chính", department=dept)
+        self.other_device = Device.objects.create(name="Máy phát điện", department=dept)
+        DeviceUnit.objects.create(device=self.device, name="Khối 1", qr_code="DEVICE001")
+        DeviceUnit.objects.create(device=self.other_device, name="Khối 1", qr_code="GEN001")
+        self.start = timezone.make_aware(datetime(2026, 3, 10, 8, 0))
+        self.existing = OperationLog(
+            device=self.device, operator_name='Thủy thủ A', start_time=self.start, end_time=self.start + timedelta(hours=2)
+        )
+        self.existing.save()
+    
+    def _payload(self, qr_code, start_hour, end_hour):
+        return {
+            'qr_code': qr_code,
+            'operator_name': 'Thủy thủ B',
+            'start_time': (self.start + timedelta(hours=start_hour)).isoformat(),
+            'end_time': (self.start + timedelta(hours=end_hour)).isoformat(),
+        }
+    
+    def test_find_overlap(self):
+        """Test the two-candidate interval check"""
+        find = OperationLog.find_overlap
+        self.assertEqual(find(self.device.pk, self.start, self.start + timedelta(hours=2)), self.existing)
+        self.assertEqual(find(self.device.pk, self.start - timedelta(hours=1), self.start + timedelta(minutes=1)), self.existing)
+        self.assertEqual(find(self.device.pk, self.start + timedelta(hours=1), self.start + timedelta(hours=5)), self.existing)
+        # Touching runs do not overlap, nor do runs of another device
+        self.assertIsNone(find(self.device.pk, self.start + timedelta(hours=2), self.start + timedelta(hours=3)))
+        self.assertIsNone(find(self.other_device.pk, self.start, self.start + timedelta(hours=2)))
+    
+    def test_api_rejects_duplicate(self):
+        """Test that a replayed log is answered with 409 and not counted twice"""
+        response = self.client.post(
+            reverse('api_log_entry', args=['DEVICE001']),
+            data=json.dumps(self._payload('DEVICE001', 0, 2)),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['conflict_log_id'], self.existing.pk)
+        self.device.refresh_from_db()
+        self.assertEqual(self.device.total_system_hours, 2.0)
+    
+    def test_form_rejects_overlap(self):
+        """Test that the log entry form refuses an overlapping run"""
+        response = self.client.post(reverse('log_entry', args=['DEVICE001']), {
+            'operator_name': 'Thủy thủ B',
+            'start_time': '2026-03-10T09:00',
+            'end_time': '2026-03-10T11:00',
+        })
+        self.assertRedirects(response, reverse('log_entry', args=['DEVICE001']))
+        self.assertEqual(OperationLog.objects.count(), 1)
+
+    def test_form_accepts_local_times(self):
+        """Test that datetime-local values without an offset are stored as local times"""
+        response = self.client.post(reverse('log_entry', args=['DEVICE001']), {
+            'operator_name': 'Thủy thủ B',
+            'start_time': '2026-03-10T10:00',
+            'end_time': '2026-03-10T11:30',
+        })
+        self.assertRedirects(response, reverse('device_detail', args=['DEVICE001']))
+        log = OperationLog.objects.latest('id')
+        self.assertEqual(log.start_time, self.start + timedelta(hours=2))
+        self.assertEqual(log.duration, 1.5)
+
+    def test_batch_rejects_overlaps(self):
+        """Test overlaps against stored logs and within the batch itself"""
+        response = self.client.post(
+            reverse('api_batch_log_entry'),
+            data=json.dumps({'logs': [
+                self._payload('DEVICE001', 1, 3),
+                self._payload('DEVICE001', 3, 4),
+                self._payload('DEVICE001', 3.5, 5),
+                self._payload('GEN001', 0, 2),
+            ]}),
+            content_type='application/json',
+        )
+        results = response.json()['results']
+        self.assertEqual([r['success'] for r in results], [False, True, False, True])
+        self.assertEqual(results[0]['conflict_log_id'], self.existing.pk)
+    
+    def test_scanner_finds_legacy_overlaps(self):
+        """Test the sort-and-sweep scanner on data written before the check"""
+        from django.core.management import call_command
+        from io import StringIO
+        
+        OperationLog.objects.bulk_create([
+            OperationLog(device=self.device, operator_name='Thủy thủ B', start_time=self.start + timedelta(hours=h),
+                         end_time=self.start + timedelta(hours=h + length), duration=length)
+            for h, length in ((1, 2), (1.5, 0.25), (4, 1))
+        ])
+        out = StringIO()
+        call_command('find_overlapping_logs', stdout=out)
+        # (existing, 1-3), (existing, 1.5-1.75) and (1-3, 1.5-1.75)
+        self.assertIn('Tìm thấy 3 cặp trùng', out.getvalue())
+
+
+class ScanPayloadCacheTest(TestCase):
+    """Test the cached QR-to-unit resolution used by scans"""
+    
+    def setUp(self):
+        from django.core.cache import cache
+        
+        cache.clear()
+        self.dept = Department.objects.create(name="Hệ thống chính")
+        self.location = Location.objects.create(name="Khoang máy")
+        self.device = Device.objects.create(name="Động cơ chính", department=self.dept)
+        self.unit = DeviceUnit.objects.create(
+            device=self.device, location=self.location, name="Khối 1", qr_code="DEVICE001"
+        )
+        DeviceUnit.objects.create(device=self.device, location=self.location, name="Khối 2", qr_code="DEVICE002")
+        self.url = reverse('device_detail', args=['DEVICE001'])
+    
+    def test_repeat_scan_hits_cache(self):
+        """Test that a repeated scan and the log form run no queries"""
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+            self.client.get(reverse('log_entry', args=['DEVICE001']))
+        self.assertContains(response, 'Khối 2')
+        self.assertContains(response, 'Khoang máy')
+    
+    def test_unknown_code_is_404(self):
+        """Test that unknown codes are not resolved"""
+        response = self.client.get(reverse('device_detail', args=['UNKNOWN']))
+        self.assertEqual(response.status_code, 404)
+    
+    def test_writes_invalidate_payload(self):
+        """Test that unit, sibling, device, location and log writes refresh the scan"""
+        self.client.get(self.url)
+        
+        sibling = DeviceUnit.objects.get(qr_code='DEVICE002')
+        sibling.name = "Khối phụ"
+        sibling.save()
+        self.assertContains(self.client.get(self.url), 'Khối phụ')
+        
+        self.device.name = "Động cơ số 1"
+        self.device.save()
+        self.assertContains(self.client.get(self.url), 'Động cơ số 1')
+        
+        self.location.name = "Khoang lái"
+        self.location.save()
+        self.assertContains(self.client.get(self.url), 'Khoang lái')
+        
+        start = timezone.now() - timedelta(hours=3)
+        OperationLog(
+            device=self.device, device_unit=self.unit, operator_name='Thủy thủ A',
+            start_time=start, end_time=start + timedelta(hours=2), device_status='ERROR',
+        ).save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['device_unit'].current_hours, 2.0)
+        self.assertEqual(response.context['device_unit'].status, 'ERROR')
+    
+    def test_changed_code_drops_old_entry(self):
+        """Test that a renamed QR code no longer resolves from the cache"""
+        self.client.get(self.url)
+        self.unit.qr_code = 'DEVICE009'
+        self.unit.save()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class ConditionalReadApiTest(TestCase):
+    """Test the JSON read API and its version-based ETags"""
+    
+    def setUp(self):
+        from django.core.cache import cache
+        
+        cache.clear()
+        dept = Department.objects.create(name="Hệ thống chính")
+        self.device = Device.objects.create(name="Động cơ chính", department=dept)
+        self.unit = DeviceUnit.objects.create(device=self.device, name="Khối 1", qr_code="DEVICE001")
+        DeviceUnit.objects.create(device=self.device, name="Khối 2", qr_code="DEVICE002")
+    
+    def _add_log(self):
+        start = timezone.now() - timedelta(hours=3)
+        OperationLog(
+            device=self.device, device_unit=self.unit, operator_name='Thủy thủ A',
+            start_time=start, end_time=start + timedelta(hours=2),
+        ).save()
+    
+    def test_device_revalidation(self):
+        """Test 200 with an ETag, then 304 until the device changes"""
+        url = reverse('api_device', args=[self.device.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['device']['units']), 2)
+        self.assertIn('no-cache', response['Cache-Control'])
+        etag = response['ETag']
+        
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        
+        self._add_log()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['device']['total_system_hours'], 2.0)
+    
+    def test_unit_revalidation_without_queries(self):
+        """Test that a cached unit is revalidated without touching the database"""
+        url = reverse('api_unit', args=['DEVICE001'])
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        
+        sibling = DeviceUnit.objects.get(qr_code='DEVICE002')
+        sibling.status = 'ERROR'
+        sibling.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['device']['units'][1]['status'], 'ERROR')
+    
+    def test_device_logs(self):
+        """Test the recent logs endpoint and its ETag"""
+        url = reverse('api_device_logs', args=[self.device.pk])
+        etag = self.client.get(url)['ETag']
+        self._add_log()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['logs']), 1)
+        
+        response = self.client.get(reverse('api_device', args=[9999]))
+        self.assertEqual(response.status_code, 404)
+    
+    def test_admin_save_keeps_version(self):
+        """Test that saving a stale device instance does not roll its version back"""
+        stale = Device.objects.get(pk=self.device.pk)
+        self._add_log()
+        bumped = Device.objects.get(pk=self.device.pk).version
+        stale.name = "Động cơ số 1"
+        stale.save()
+        self.assertGreater(Device.objects.get(pk=self.device.pk).version, bumped)
+
+
+class FleetSyncFeedTest(TestCase):
+    """Test the fleet snapshot and delta feed used by the offline copy"""
+    
+    def setUp(self):
+        self.dept = Department.objects.create(name="Hệ thống chính")
+        self.location = Location.objects.create(name="Buồng máy")
+        self.device = Device.objects.create(name="Động cơ chính", department=self.dept)
+        self.unit = DeviceUnit.objects.create(
+            device=self.device, location=self.location, name="Khối 1", qr_code="DEVICE001"
+        )
+        self.other = DeviceUnit.objects.create(device=self.device, name="Khối 2", qr_code="DEVICE002")
+    
+    def _rows(self, payload, name):
+        fields = payload['fields'][name]
+        return {row[0]: dict(zip(fields, row)) for row in payload[name]}
+    
+    def test_snapshot_and_revalidation(self):
+        """Test the snapshot holds the whole fleet and is 304 until something changes"""
+        url = reverse('api_fleet_snapshot')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        payload = response.json()
+        self.assertTrue(payload['full'])
+        units = self._rows(payload, 'units')
+        self.assertEqual(units[self.unit.pk]['qr_code'], 'DEVICE001')
+        self.assertEqual(units[self.unit.pk]['location_id'], self.location.pk)
+        self.assertEqual(self._rows(payload, 'devices')[self.device.pk]['department_id'], self.dept.pk)
+        self.assertEqual(response['ETag'], f'"fleet-{payload["version"]}"')
+        
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        
+        self.location.name = "Buồng máy 2"
+        self.location.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=f'"fleet-{payload["version"]}"')
+        self.assertEqual(response.status_code, 200)
+    
+    def test_delta_only_sends_changes(self):
+        """Test a resync returns the renamed unit and the deleted one, nothing else"""
+        version = self.client.get(reverse('api_fleet_snapshot')).json()['version']
+        self.unit.name = "Khối 1 (mới)"
+        self.unit.save()
+        other_pk = self.other.pk
+        self.other.delete()
+        
+        payload = self.client.get(reverse('api_fleet_changes'), {'since': version}).json()
+        self.assertFalse(payload['full'])
+        self.assertGreater(payload['version'], version)
+        self.assertEqual(list(self._rows(payload, 'units')), [self.unit.pk])
+        self.assertEqual(self._rows(payload, 'units')[self.unit.pk]['name'], "Khối 1 (mới)")
+        self.assertEqual(payload['deleted']['units'], [other_pk])
+        self.assertEqual(payload['devices'], [])
+        
+        payload = self.client.get(reverse('api_fleet_changes'), {'since': payload['version']}).json()
+        self.assertFalse(payload['full'])
+        self.assertEqual(payload['units'], [])
+        self.assertEqual(payload['deleted']['units'], [])
+    
+    def test_hours_do_not_produce_changes(self):
+        """Test that logging hours is not sent through the offline feed"""
+        from .sync import current_version
+        
+        version = current_version()
+        start = timezone.now() - timedelta(hours=3)
+        OperationLog(
+            device=self.device, device_unit=self.unit, operator_name='Thủy thủ A',
+            start_time=start, end_time=start + timedelta(hours=2),
+        ).save()
+        self.assertEqual(current_version(), version)
+    
+    def test_location_delete_resends_units(self):
+        """Test that units whose location is removed come back without it"""
+        from .sync import current_version
+        
+        version = current_version()
+        location_pk = self.location.pk
+        self.location.delete()
+        payload = self.client.get(reverse('api_fleet_changes'), {'since': version}).json()
+        self.assertEqual(payload['deleted']['locations'], [location_pk])
+        self.assertIsNone(self._rows(payload, 'units')[self.unit.pk]['location_id'])
+    
+    def test_stale_or_unknown_version_falls_back_to_snapshot(self):
+        """Test a client behind the pruned history, or ahead of the server, gets everything"""
+        from .models import SyncChange
+        from .sync import current_version
+        
+        version = current_version()
+        self.unit.name = "Khối 1 (mới)"
+        self.unit.save()
+        SyncChange.objects.filter(id__lte=version).delete()
+        
+        payload = self.client.get(reverse('api_fleet_changes'), {'since': 1}).json()
+        self.assertTrue(payload['full'])
+        self.assertEqual(len(payload['units']), 2)
+        payload = self.client.get(reverse('api_fleet_changes'), {'since': version + 100}).json()
+        self.assertTrue(payload['full'])
+        response = self.client.get(reverse('api_fleet_changes'), {'since': 'abc'})
+        self.assertEqual(response.status_code, 400)
+    
+    def test_imported_units_are_recorded(self):
+        """Test that units created by the bulk importer reach the feed"""
+        import io
+        from .importer import import_units
+        from .sync import current_version
+        
+        version = current_version()
+        csv_file = io.StringIO("department,device,unit,qr_code\nHệ thống chính,Máy phát,Khối A,GEN001\n")
+        import_units(csv_file, 'csv')
+        payload = self.client.get(reverse('api_fleet_changes'), {'since': version}).json()
+        self.assertIn('GEN001', [row[4] for row in payload['units']])
+    
+    def test_serviceworker_served_from_root(self):
+        """Test the worker is served at the site root so it controls every page"""
+        response = self.client.get(reverse('serviceworker'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(reverse('serviceworker'), '/serviceworker.js')
+        self.assertIn('application/javascript', response['Content-Type'])
+        self.assertIn(b'fleet-store.js', response.content)
+        # Exports and API responses bypass the runtime cache
+        self.assertIn(b"'/api/', '/xuat-nhat-ky/'", response.content)
+        
+        response = self.client.get(reverse('offline_unit'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'fleet-store.js')
+    
+    def test_prune_keeps_current_version(self):
+        """Test pruning never drops the row carrying the current version"""
+        from django.core.management import call_command
+        from io import StringIO
+        from .models import SyncChange
+        from .sync import current_version
+        
+        version = current_version()
+        SyncChange.objects.update(created_at=timezone.now() - timedelta(days=365))
+        call_command('prune_sync_changes', days=30, stdout=StringIO())
+        self.assertEqual(list(SyncChange.objects.values_list('id', flat=True)), [version])
+        payload = self.client.get(reverse('api_fleet_changes'), {'since': version}).json()
+        self.assertFalse(payload['full'])
+
+
+class IdempotentLogSubmissionTest(TestCase):
+    """Test that resubmitting a log with the same client_id stores it once"""
+    
+    def setUp(self):
+        dept = Department.objects.create(name="Hệ thống chính")
+        self.device = Device.objects.create(name="Động cơ chính", department=dept)
+        self.unit = DeviceUnit.objects.create(device=self.device, name="Khối 1", qr_code="DEVICE001")
+        self.start_time = timezone.now() - timedelta(hours=5)
+        self.client_id = '0f5d3c7e-2b1a-4c8e-9d6f-1a2b3c4d5e6f'
+    
+    def _data(self, offset=0, **extra):
+        start_time = self.start_time + timedelta(hours=offset)
+        data = {
+            'operator_name': 'Thủy thủ A',
+            'start_time': start_time.isoformat(),
+            'end_time': (start_time + timedelta(hours=2)).isoformat(),
+            'client_id': self.client_id,
+        }
+        data.update(extra)
+        return data
+    
+    def _hours(self):
+        return (
+            Device.objects.get(pk=self.device.pk).total_system_hours,
+            DeviceUnit.objects.get(pk=self.unit.pk).current_hours,
+        )
+    
+    def test_api_retry_returns_original_result(self):
+        """Test a retried API call returns the first log and adds no hours"""
+        url = reverse('api_log_entry', args=['DEVICE001'])
+        first = self.client.post(url, data=json.dumps(self._data()), content_type='application/json').json()
+        self.assertTrue(first['success'])
+        self.assertFalse(first['duplicate'])
+        
+        retry = self.client.post(url, data=json.dumps(self._data()), content_type='application/json')
+        self.assertEqual(retry.status_code, 200)
+        self.assertTrue(retry.json()['duplicate'])
+        self.assertEqual(retry.json()['log_id'], first['log_id'])
+        self.assertEqual(OperationLog.objects.count(), 1)
+        self.assertEqual(self._hours(), (2.0, 2.0))
+    
+    def test_invalid_client_id_rejected(self):
+        """Test a malformed key is refused instead of silently ignored"""
+        url = reverse('api_log_entry', args=['DEVICE001'])
+        response = self.client.post(url, data=json.dumps(self._data(client_id='abc')), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(OperationLog.objects.count(), 0)
+    
+    def test_concurrent_insert_of_same_key(self):
+        """Test the unique constraint resolves a race to the stored log without double hours"""
+        from .views import _save_new_log
+        
+        first, created = _save_new_log(OperationLog(device=self.device, device_unit=self.unit, client_id=self.client_id,
+                                                    operator_name='A', start_time=self.start_time,
+                                                    end_time=self.start_time + timedelta(hours=2)))
+        self.assertTrue(created)
+        # Same key but a different run: the check before saving was passed by both requests
+        start_time = self.start_time + timedelta(hours=3)
+        log, created = _save_new_log(OperationLog(device=self.device, device_unit=self.unit, client_id=self.client_id,
+                                                  operator_name='A', start_time=start_time,
+                                                  end_time=start_time + timedelta(hours=2)))
+        self.assertFalse(created)
+        self.assertEqual(log.pk, first.pk)
+        self.assertEqual(self._hours(), (2.0, 2.0))
+    
+    def test_batch_retry_and_repeated_key(self):
+        """Test a replayed batch and a key repeated within one batch are stored once"""
+        url = reverse('api_batch_log_entry')
+        other_id = '5b9e1f0a-7c3d-4e2b-8a6f-9d0c1b2a3e4f'
+        logs = [
+            dict(self._data(), qr_code='DEVICE001'),
+            dict(self._data(offset=3, client_id=other_id), qr_code='DEVICE001'),
+            dict(self._data(offset=3, client_id=other_id), qr_code='DEVICE001'),
+        ]
+        body = self.client.post(url, data=json.dumps({'logs': logs}), content_type='application/json').json()
+        self.assertEqual(body['saved'], 2)
+        self.assertEqual(body['duplicates'], 1)
+        self.assertTrue(body['results'][2]['success'])
+        self.assertEqual(body['results'][2]['log_id'], body['results'][1]['log_id'])
+        self.assertEqual(body['results'][2]['index'], 2)
+        
+        replay = self.client.post(url, data=json.dumps({'logs': logs}), content_type='application/json').json()
+        self.assertEqual(replay['saved'], 0)
+        self.assertEqual(replay['duplicates'], 3)
+        self.assertEqual(replay['failed'], 0)
+        self.assertEqual([result['log_id'] for result in replay['results']],
+                         [result['log_id'] for result in body['results']])
+        self.assertEqual(OperationLog.objects.count(), 2)
+        self.assertEqual(self._hours(), (4.0, 4.0))
+    
+    def test_form_resubmission(self):
+        """Test a resent form POST is acknowledged without a second log"""
+        url = reverse('log_entry', args=['DEVICE001'])
+        data = self._data()
+        data['start_time'] = data['start_time'][:16]
+        data['end_time'] = data['end_time'][:16]
+        self.client.post(url, data)
+        response = self.client.post(url, data, follow=True)
+        self.assertContains(response, 'Nhật ký này đã được lưu trước đó')
+        self.assertEqual(OperationLog.objects.count(), 1)
+        self.assertEqual(self._hours(), (2.0, 2.0))
+
+
+class AsyncViewsTest(TestCase):
+    """Test the async scan, logging, dashboard and history views"""
+    
+    def setUp(self):
+        from django.core.cache import cache
+        from django.test import AsyncRequestFactory
+        
+        cache.clear()
+        self.factory = AsyncRequestFactory()
+        dept = Department.objects.create(name="Hệ thống chính")
+        location = Location.objects.create(name="Buồng máy")
+        self.device = Device.objects.create(name="Động cơ chính", department=dept)
+        self.unit = DeviceUnit.objects.create(device=self.device, location=location, name="Khối 1", qr_code="DEVICE001")
+        DeviceUnit.objects.create(device=self.device, name="Khối 2", qr_code="DEVICE002", status='ERROR')
+        self.start_time = timezone.now() - timedelta(hours=10)
+    
+    def _log_body(self, offset=0, **extra):
+        start_time = self.start_time + timedelta(hours=offset)
+        data = {
+            'operator_name': 'Thủy thủ A',
+            'start_time': start_time.isoformat(),
+            'end_time': (start_time + timedelta(hours=2)).isoformat(),
+        }
+        data.update(extra)
+        return json.dumps(data)
+    
+    async def _post_log(self, qr_code, body):
+        from .async_views import api_log_entry
+        
+        request = self.factory.post(f'/api/ghi-nhat-ky/{qr_code}/', data=body, content_type='application/json')
+        return await api_log_entry(request, qr_code)
+    
+    async def test_device_detail(self):
+        """Test a scan renders the unit and serves repeats from the payload cache"""
+        from django.http import Http404
+        from .async_views import device_detail
+        
+        response = await device_detail(self.factory.get('/thiet-bi/DEVICE001/'), 'DEVICE001')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Khối 2')
+        self.assertContains(response, 'Buồng máy')
+        with self.assertRaises(Http404):
+            await device_detail(self.factory.get('/thiet-bi/UNKNOWN/'), 'UNKNOWN')
+    
+    async def test_log_entry_write_path(self):
+        """Test an async submission saves once, counts hours and rejects overlaps"""
+        client_id = '0f5d3c7e-2b1a-4c8e-9d6f-1a2b3c4d5e6f'
+        response = await self._post_log('DEVICE001', self._log_body(client_id=client_id))
+        self.assertEqual(response.status_code, 200)
+        first = json.loads(response.content)
+        self.assertTrue(first['success'])
+        
+        response = await self._post_log('DEVICE001', self._log_body(client_id=client_id))
+        self.assertTrue(json.loads(response.content)['duplicate'])
+        response = await self._post_log('DEVICE002', self._log_body(offset=1))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(json.loads(response.content)['conflict_log_id'], first['log_id'])
+        response = await self._post_log('UNKNOWN', self._log_body(offset=5))
+        self.assertEqual(response.status_code, 404)
+        
+        self.assertEqual(await OperationLog.objects.acount(), 1)
+        device = await Device.objects.aget(pk=self.device.pk)
+        self.assertEqual(device.total_system_hours, 2.0)
+    
+    async def test_dashboard_and_history(self):
+        """Test the async dashboard and history pages match the data"""
+        from .async_views import dashboard, history
+        
+        for offset in range(0, 60, 3):
+            await self._post_log('DEVICE001', self._log_body(offset=offset - 60))
+        response = await dashboard(self.factory.get('/'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Động cơ chính')
+        
+        response = await history(self.factory.get('/lich-su/'))
+        self.assertEqual(response.status_code, 200)
+        # Same page as the sync view
+        sync_response = await self.async_client.get(reverse('history'))
+        operator = 'Thủy thủ A'.encode()
+        self.assertEqual(response.content.count(operator), sync_response.content.count(operator))
+        self.assertGreaterEqual(response.content.count(operator), 20)
+
+
+class RequestMetricsTest(TestCase):
+    """Test the per-view metrics middleware and the /metrics endpoint"""
+    
+    def setUp(self):
+        from .metrics import registry
+        
+        self.registry = registry
+        registry.clear()
+        dept = Department.objects.create(name="Hệ thống chính")
+        device = Device.objects.create(name="Động cơ chính", department=dept)
+        DeviceUnit.objects.create(device=device, name="Khối 1", qr_code="DEVICE001")
+    
+    def _line(self, body, metric, view, method='GET'):
+        prefix = f'{metric}{{view="{view}",method="{method}"}} '
+        for line in body.splitlines():
+            if line.startswith(prefix):
+                return line[len(prefix):]
+        return None
+    
+    def test_records_time_and_queries_per_view(self):
+        """Test that each request adds its wall time, query count and DB time to its view's series"""
+        from django.core.cache import cache
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('device_detail', args=['DEVICE001']))
+        cold_queries = len(queries)
+        self.client.get(reverse('device_detail', args=['DEVICE001']))
+        self.client.get('/khong-ton-tai/')
+        
+        with override_settings(QLTHIETBI_METRICS_IPS=['127.0.0.1']):
+            response = self.client.get(reverse('metrics'))
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        body = response.content.decode()
+        self.assertIn('# TYPE qlthietbi_request_duration_seconds histogram', body)
+        self.assertEqual(self._line(body, 'qlthietbi_request_duration_seconds_count', 'device_detail'), '2')
+        # The second scan is served from the cache
+        self.assertEqual(self._line(body, 'qlthietbi_db_queries_sum', 'device_detail'), repr(float(cold_queries)))
+        self.assertEqual(self._line(body, 'qlthietbi_db_queries_count', 'unmatched'), '1')
+        self.assertIn('qlthietbi_db_queries_bucket{view="device_detail",method="GET",le="+Inf"} 2', body)
+        self.assertGreater(float(self._line(body, 'qlthietbi_db_duration_seconds_sum', 'device_detail')), 0)
+    
+    def test_access(self):
+        """Test that /metrics is for staff and the configured addresses only"""
+        # The test client connects from 127.0.0.1, as a local reverse proxy would
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        with override_settings(QLTHIETBI_METRICS_IPS=['127.0.0.1']):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+        
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+    
+    def test_unknown_methods_share_one_series(self):
+        """Test that arbitrary HTTP verbs are counted under OTHER"""
+        self.client.generic('BREW', reverse('dashboard'))
+        self.client.generic('PURGE', reverse('dashboard'))
+        
+        body = self.registry.render()
+        self.assertEqual(self._line(body, 'qlthietbi_request_duration_seconds_count', 'dashboard', 'OTHER'), '2')
+        self.assertNotIn('BREW', body)
+    
+    def test_histogram_buckets_are_cumulative(self):
+        """Test that bucket counts include every smaller bucket"""
+        from .metrics import Histogram
+        
+        histogram = Histogram((1, 5, 10))
+        for value in (0, 1, 3, 7, 50):
+            histogram.observe(value)
+        self.assertEqual(histogram.snapshot(), ([2, 3, 4, 5], 61.0, 5))
+    
+    async def test_async_requests_count_queries_on_the_sync_thread(self):
+        """Test that queries run through sync_to_async are counted under ASGI"""
+        from asgiref.sync import sync_to_async
+        from django.http import HttpResponse
+        from django.test import AsyncRequestFactory
+        from .middleware import MetricsMiddleware
+        
+        async def view(request):
+            await Device.objects.acount()
+            await sync_to_async(lambda: list(DeviceUnit.objects.all()))()
+            return HttpResponse()
+        
+        middleware = MetricsMiddleware(view)
+        await middleware(AsyncRequestFactory().get('/'))
+        body = self.registry.render()
+        self.assertEqual(self._line(body, 'qlthietbi_db_queries_sum', 'unmatched'), '2.0')
+    
+    def test_restricted_to_scraper_and_staff(self):
+        """Test that other addresses need a staff login"""
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.5').status_code, 403)
+        User.objects.create_user('admin', password='matkhau', is_staff=True)
+        self.client.login(username='admin', password='matkhau')
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.5').status_code, 200)
+
+
+class QueryBudgetTest(TestCase):
+    """Cap the queries of each view, whatever the fleet size, so N+1 regressions fail"""
+    
+    # View name -> most queries it may issue with a cold cache
+    BUDGETS = {
+        'dashboard': 4,
+        'device_detail': 2,
+        'log_entry': 2,
+        'history': 1,
+        'api_history': 1,
+        'api_device': 3,
+        'api_device_logs': 2,
+        'api_unit': 2,
+        'usage_report': 3,
+        'maintenance_forecast': 2,
+        'api_fleet_snapshot': 5,
+    }
+    
+    def _seed(self, devices):
+        dept = Department.objects.create(name=f"Ngành {devices}")
+        location = Location.objects.create(name=f"Hầm máy {devices}")
+        start = timezone.make_aware(datetime(2026, 3, 1))
+        for index in range(devices):
+            device = Device.objects.create(name=f"Máy {devices}-{index}", department=dept)
+            for unit in range(2):
+                DeviceUnit.objects.create(
+                    device=device, name=f"Khối {unit}", qr_code=f"Q{devices}-{index}-{unit}", location=location
+                )
+            for hour in range(0, 30, 10):
+                OperationLog(
+                    device=device, device_unit=device.units.first(), operator_name='Thủy thủ A',
+                    start_time=start + timedelta(hours=hour), end_time=start + timedelta(hours=hour + 1),
+                ).save()
+        return device
+    
+    def _urls(self, device):
+        qr_code = device.units.first().qr_code
+        return {
+            'dashboard': reverse('dashboard'),
+            'device_detail': reverse('device_detail', args=[qr_code]),
+            'log_entry': reverse('log_entry', args=[qr_code]),
+            'history': reverse('history'),
+            'api_history': reverse('api_history'),
+            'api_device': reverse('api_device', args=[device.id]),
+            'api_device_logs': reverse('api_device_logs', args=[device.id]),
+            'api_unit': reverse('api_unit', args=[qr_code]),
+            'usage_report': reverse('usage_report'),
+            'maintenance_forecast': reverse('maintenance_forecast'),
+            'api_fleet_snapshot': reverse('api_fleet_snapshot'),
+        }
+    
+    def _count(self, url, method='get', **kwargs):
+        from django.core.cache import cache
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, **kwargs)
+        self.assertLess(response.status_code, 400, url)
+        return len(queries)
+    
+    def test_read_views_within_budget(self):
+        """Test every read view against its budget, with 2 and then 12 devices"""
+        small = {name: self._count(url) for name, url in self._urls(self._seed(2)).items()}
+        large = {name: self._count(url) for name, url in self._urls(self._seed(12)).items()}
+        for name, budget in self.BUDGETS.items():
+            with self.subTest(view=name):
+                self.assertLessEqual(large[name], budget)
+                self.assertEqual(small[name], large[name], 'query count grows with the fleet')
+    
+    def test_log_writes_within_budget(self):
+        """Test a single log and a batch, whose only per-device queries are the hour updates"""
+        self._seed(6)
+        units = [device.units.first() for device in Device.objects.all()]
+        start = timezone.make_aware(datetime(2027, 1, 1))
+        
+        def entry(unit, hour):
+            return {
+                'qr_code': unit.qr_code,
+                'operator_name': 'Thủy thủ B',
+                'start_time': (start + timedelta(hours=hour)).isoformat(),
+                'end_time': (start + timedelta(hours=hour + 1)).isoformat(),
+            }
+        
+        queries = self._count(
+            reverse('api_log_entry', args=[units[0].qr_code]), 'post',
+            data=json.dumps(entry(units[0], 0)), content_type='application/json',
+        )
+        # Includes the device lock taken around the overlap check and its savepoint
+        self.assertLessEqual(queries, 18)
+        # Two logs per device; OperationLog.add_hours runs two UPDATEs per device,
+        # the devices are locked with one more
+        logs = [entry(unit, hour) for unit in units for hour in (2, 4)]
+        queries = self._count(
+            reverse('api_batch_log_entry'), 'post', data=json.dumps({'logs': logs}), content_type='application/json',
+        )
+        self.assertLessEqual(queries, 13 + 2 * len(units))
+
+
+class RequestProfilerTest(TestCase):
+    """Test the staff-only request profiler and its admin pages"""
+    
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        
+        self.profile_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(QLTHIETBI_PROFILE_DIR=self.profile_dir, QLTHIETBI_PROFILE_KEEP=2)
+        self.settings_override.enable()
+        dept = Department.objects.create(name="Hệ thống chính")
+        device = Device.objects.create(name="Động cơ chính", department=dept)
+        DeviceUnit.objects.create(device=device, name="Khối 1", qr_code="DEVICE001")
+        self.staff = User.objects.create_superuser('admin', 'admin@example.com', 'matkhau123')
+    
+    def tearDown(self):
+        import shutil
+        self.settings_override.disable()
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+    
+    def _saved(self):
+        import os
+        return sorted(os.listdir(self.profile_dir))
+    
+    def test_only_staff_requests_are_profiled(self):
+        """Test that the switch does nothing for anonymous users"""
+        response = self.client.get(reverse('history') + '?profile=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(self._saved(), [])
+    
+    def test_saves_stats_and_sql(self):
+        """Test that a profiled request leaves cProfile stats and its SQL"""
+        import pstats
+        from pathlib import Path
+        
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('history') + '?profile=1')
+        profile_id = response['X-Profile-Id']
+        self.assertTrue(profile_id.endswith('-history'))
+        self.assertEqual(self._saved(), [f'{profile_id}.json', f'{profile_id}.prof'])
+        
+        stats = pstats.Stats(str(Path(self.profile_dir) / f'{profile_id}.prof'))
+        self.assertTrue(any(name == 'history' for _, _, name in stats.stats))
+        summary = json.loads((Path(self.profile_dir) / f'{profile_id}.json').read_text(encoding='utf-8'))
+        self.assertEqual((summary['view'], summary['status'], summary['user']), ('history', 200, 'admin'))
+        self.assertEqual(summary['query_count'], len(summary['queries']))
+        self.assertTrue(any('qlthietbi_operationlog' in query['sql'] for query in summary['queries']))
+        
+        # The header works too; requests without either are not profiled
+        self.assertIn('X-Profile-Id', self.client.get(reverse('dashboard'), HTTP_X_PROFILE='1'))
+        self.assertNotIn('X-Profile-Id', self.client.get(reverse('dashboard') + '?profiler=1'))
+    
+    def test_keeps_newest_profiles(self):
+        """Test that old profiles are rotated out"""
+        self.client.force_login(self.staff)
+        ids = [self.client.get(reverse('scan') + '?profile=1')['X-Profile-Id'] for _ in range(3)]
+        self.assertEqual(self._saved(), sorted(f'{profile_id}{suffix}' for profile_id in ids[1:] for suffix in ('.json', '.prof')))
+    
+    def test_admin_lists_and_downloads(self):
+        """Test the admin list, detail and download pages"""
+        self.client.force_login(self.staff)
+        profile_id = self.client.get(reverse('history') + '?profile=1')['X-Profile-Id']
+        
+        response = self.client.get(reverse('admin:qlthietbi_profiles'))
+        self.assertContains(response, reverse('admin:qlthietbi_profile', args=[profile_id]))
+        response = self.client.get(reverse('admin:qlthietbi_profile', args=[profile_id]))
+        self.assertContains(response, 'qlthietbi_operationlog')
+        self.assertContains(response, 'cumulative')
+        response = self.client.get(reverse('admin:qlthietbi_profile_download', args=[profile_id, 'prof']))
+        self.assertEqual(response['Content-Disposition'], f'attachment; filename="{profile_id}.prof"')
+        
+        response = self.client.get(reverse('admin:qlthietbi_profile_download', args=['..-etc-passwd', 'json']))
+        self.assertEqual(response.status_code, 404)
+        self.client.logout()
+        response = self.client.get(reverse('admin:qlthietbi_profiles'))
+        self.assertEqual(response.status_code, 302)
+
+
+class ScalableAdminChangelistTest(TestCase):
+    """Test that the operation log and unit changelists avoid N+1 queries and full scans"""
+    
+    def setUp(self):
+        dept = Department.objects.create(name="Hệ thống chính")
+        location = Location.objects.create(name="Hầm máy")
+        self.start = timezone.make_aware(datetime(2025, 11, 20, 8, 0))
+        self.devices = []
+        for index in range(6):
+            device = Device.objects.create(name=f"Máy số {index}", department=dept)
+            DeviceUnit.objects.create(device=device, name="Khối 1", qr_code=f"DEVICE{index:03}", location=location)
+            self.devices.append(device)
+        self.admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'matkhau123')
+        self.client.force_login(self.admin_user)
+    
+    def _add_logs(self, count):
+        OperationLog.objects.bulk_create([
+            OperationLog(
+                device=self.devices[index % len(self.devices)], operator_name='Thủy thủ A',
+                start_time=self.start + timedelta(days=index), end_time=self.start + timedelta(days=index, hours=1),
+                duration=1.0,
+            )
+            for index in range(OperationLog.objects.count(), OperationLog.objects.count() + count)
+        ])
+    
+    def _queries(self, url):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in queries]
+    
+    def test_changelists_do_not_grow_with_rows(self):
+        """Test joined columns, a bounded count and a range-based date hierarchy"""
+        url = reverse('admin:qlthietbi_operationlog_changelist')
+        self._add_logs(5)
+        few = self._queries(url)
+        self._add_logs(40)
+        many = self._queries(url)
+        self.assertEqual(len(few), len(many))
+        # No table-wide COUNT(*) and no SELECT DISTINCT for the date hierarchy
+        self.assertFalse([sql for sql in many if 'COUNT(' in sql or 'DISTINCT' in sql])
+        filtered = self._queries(f'{url}?device__id__exact={self.devices[0].pk}')
+        counts = [sql for sql in filtered if 'COUNT(' in sql]
+        self.assertTrue(counts)
+        self.assertTrue(all('LIMIT' in sql for sql in counts), counts)
+        
+        url = reverse('admin:qlthietbi_deviceunit_changelist')
+        few = self._queries(url)
+        for index in range(6, 20):
+            DeviceUnit.objects.create(device=self.devices[0], name=f"Khối {index}", qr_code=f"EXTRA{index:03}")
+        many = self._queries(url)
+        self.assertEqual(len(many), len(few))
+        # Only the paginator's count of the filtered rows; no facet counts
+        self.assertEqual(len([sql for sql in many if 'COUNT(' in sql]), 1)
+        self.assertNotContains(self.client.get(url), '/ma-qr/')
+    
+    def test_date_hierarchy_spans_first_to_last_log(self):
+        """Test that the year and month choices come from the first and last log"""
+        self._add_logs(60)
+        response = self.client.get(reverse('admin:qlthietbi_operationlog_changelist'))
+        self.assertContains(response, 'start_time__year=2025')
+        self.assertContains(response, 'start_time__year=2026')
+        response = self.client.get(reverse('admin:qlthietbi_operationlog_changelist') + '?start_time__year=2025')
+        self.assertContains(response, 'start_time__month=11')
+        self.assertContains(response, 'start_time__month=12')
+        self.assertNotContains(response, 'start_time__month=10')
+    
+    def test_keyset_pages_match_offset_pages(self):
+        """Test that every page equals the plain OFFSET page of the same ordering"""
+        from .pagination import LogChangelistPaginator
+        
+        self._add_logs(25)
+        # Ties on start_time must be ordered by id
+        OperationLog.objects.filter(pk__in=list(OperationLog.objects.values_list('pk', flat=True)[:4])).update(
+            start_time=self.start
+        )
+        queryset = OperationLog.objects.order_by('-start_time', '-pk')
+        paginator = LogChangelistPaginator(queryset, 10)
+        self.assertEqual(paginator.count, 25)
+        for number in (1, 2, 3):
+            page = list(paginator.page(number).object_list)
+            self.assertEqual(page, list(queryset[(number - 1) * 10:number * 10]))
+    
+    def test_count_is_estimated_without_filters(self):
+        """Test the id-span estimate without filters and the capped count with filters"""
+        from unittest import mock
+        from . import pagination
+        from .pagination import LogChangelistPaginator
+        
+        self._add_logs(30)
+        # Deleted rows between the first and last id are still counted
+        OperationLog.objects.filter(pk__in=list(OperationLog.objects.order_by('pk').values_list('pk', flat=True)[5:8])).delete()
+        self.assertEqual(LogChangelistPaginator(OperationLog.objects.order_by('-start_time', '-pk'), 10).count, 30)
+        filtered = OperationLog.objects.filter(device=self.devices[0]).order_by('-start_time', '-pk')
+        self.assertEqual(LogChangelistPaginator(filtered, 10).count, filtered.count())
+        with mock.patch.object(pagination, 'COUNT_LIMIT', 3):
+            self.assertEqual(LogChangelistPaginator(filtered, 10).count, 3)
+    
+    def test_autocomplete_filter(self):
+        """Test that the device filter renders only the selected device and filters by it"""
+        self._add_logs(12)
+        device = self.devices[1]
+        response = self.client.get(
+            reverse('admin:qlthietbi_operationlog_changelist') + f'?device__id__exact={device.pk}'
+        )
+        self.assertContains(response, 'data-field-name="device"')
+        self.assertContains(response, f'<option value="{device.pk}" selected>{device.name}</option>', html=True)
+        self.assertEqual(
+            {log.device_id for log in response.context['cl'].result_list}, {device.pk}
+        )
+        self.assertNotContains(response, self.devices[2].name)
+        
+        response = self.client.get(
+            reverse('admin:autocomplete'),
+            {'app_label': 'qlthietbi', 'model_name': 'operationlog', 'field_name': 'device', 'term': 'số 3'},
+        )
+        self.assertEqual([item['text'] for item in response.json()['results']], ['Máy số 3'])
+
+
+class LogArchiveTest(TestCase):
+    """Test archiving old logs to monthly files and reading them back"""
+    
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+        
+        self.archive_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(QLTHIETBI_ARCHIVE_DIR=self.archive_dir)
+        self.settings_override.enable()
+        self.dept = Department.objects.create(name="Hệ thống chính")
+        other_dept = Department.objects.create(name="Vũ khí")
+        location = Location.objects.create(name="Khoang máy")
+        self.device = Device.objects.create(name="Động cơ chính", department=self.dept)
+        self.unit = DeviceUnit.objects.create(device=self.device, location=location, name="Khối 1", qr_code="DEVICE001")
+        self.other_device = Device.objects.create(name="Pháo 1", department=other_dept)
+        DeviceUnit.objects.create(device=self.other_device, name="Khối 1", qr_code="DEVICE002")
+        now = timezone.now().replace(microsecond=0)
+        # Two old months on the main device, one old log without a unit, three recent logs
+        self.old_starts = [now - timedelta(days=days) for days in (440, 439, 400)]
+        for start in self.old_starts:
+            self._log(self.device, start, unit=self.unit)
+        self._log(self.other_device, now - timedelta(days=420))
+        for days in (1, 2, 10):
+            self._log(self.device, now - timedelta(days=days), unit=self.unit)
+        self.staff = User.objects.create_user('kiemtoan', password='matkhau123', is_staff=True)
+    
+    def tearDown(self):
+        import shutil
+        self.settings_override.disable()
+        shutil.rmtree(self.archive_dir, ignore_errors=True)
+    
+    def _log(self, device, start, unit=None):
+        OperationLog(
+            device=device, device_unit=unit, operator_name='Thủy thủ A',
+            start_time=start, end_time=start + timedelta(hours=2), notes='Ghi chú',
+        ).save()
+    
+    def _archive(self, *args):
+        from io import StringIO
+        from django.core.management import call_command
+        
+        out = StringIO()
+        call_command('archive_logs', *args, stdout=out)
+        return out.getvalue()
+    
+    def _history(self, page_size):
+        from .archive import history_page
+        from .views import _log_list_queryset
+        
+        positions, cursor = [], None
+        while True:
+            logs, cursor = history_page(_log_list_queryset(), cursor, page_size)
+            positions.extend((log.start_time, log.pk) for log in logs)
+            if not cursor:
+                return positions
+    
+    def test_old_logs_move_to_monthly_files(self):
+        """Test that old logs leave the table while counters and rollups stay"""
+        import gzip
+        import os
+        from . import archive
+        
+        all_ids = list(OperationLog.objects.order_by('-start_time', '-id').values_list('pk', flat=True))
+        hours = Device.objects.get(pk=self.device.pk).total_system_hours
+        usage = sorted(DailyUsage.objects.values_list('device_id', 'day', 'hours', 'log_count'))
+        
+        self.assertIn('Sẽ chuyển 4 nhật ký', self._archive('--dry-run'))
+        self.assertEqual(OperationLog.objects.count(), 7)
+        self.assertIn('Đã chuyển 4 nhật ký', self._archive())
+        self.assertEqual(OperationLog.objects.count(), 3)
+        
+        months = sorted(archive.read_index())
+        self.assertEqual(months, sorted({archive.month_key(start) for start in self.old_starts + [timezone.now() - timedelta(days=420)]}))
+        self.assertTrue(all(name.endswith('.jsonl.gz') for name in os.listdir(self.archive_dir) if name != 'index.json'))
+        with gzip.open(archive.partition_path(archive.month_key(self.old_starts[0])), 'rt', encoding='utf-8') as f:
+            record = json.loads(f.readline())
+        self.assertEqual(record['operator_name'], 'Thủy thủ A')
+        self.assertEqual(sum(entry['count'] for entry in archive.read_index().values()), 4)
+        
+        self.assertEqual(Device.objects.get(pk=self.device.pk).total_system_hours, hours)
+        self.assertEqual(sorted(DailyUsage.objects.values_list('device_id', 'day', 'hours', 'log_count')), usage)
+        # Nothing left to move; every log is still listed once, in order
+        self.assertIn('Đã chuyển 0 nhật ký', self._archive())
+        self.assertEqual([pk for _, pk in self._history(2)], all_ids)
+    
+    def test_deletes_skip_per_log_invalidation(self):
+        """Test that archiving deletes through the ORM but invalidates the devices once per month"""
+        from unittest import mock
+        
+        with mock.patch('qlthietbi.signals.invalidate_devices') as per_log, \
+                mock.patch('qlthietbi.management.commands.archive_logs.invalidate_devices') as per_month:
+            self._archive()
+        self.assertFalse(per_log.called)
+        self.assertTrue(per_month.called)
+        self.assertEqual(OperationLog.objects.count(), 3)
+    
+    def test_months_are_read_in_blocks(self):
+        """Test that a month of several blocks reads the same forwards, backwards and from mid-month"""
+        from unittest import mock
+        from . import archive
+        
+        first = archive.month_start(self.old_starts[0])
+        for hours in range(1, 6):
+            self._log(self.device, self.old_starts[0] + timedelta(hours=hours * 3), unit=self.unit)
+        all_ids = list(OperationLog.objects.order_by('-start_time', '-id').values_list('pk', flat=True))
+        rows = list(
+            OperationLog.objects.filter(start_time__gte=first, start_time__lt=archive.next_month(first))
+            .order_by('start_time', 'id').values(*archive.FIELDS)
+        )
+        month = archive.month_key(first)
+        with mock.patch.object(archive, 'BLOCK_SIZE', 2):
+            self._archive('--batch-size', '2')
+            # Logs archived again replace their archived copies
+            archive.write_partition(month, rows[:3])
+        
+        entry = archive.read_index()[month]
+        self.assertEqual(entry['count'], len(rows))
+        self.assertEqual(len(entry['blocks']), (len(rows) + 1) // 2)
+        self.assertEqual([pk for _, pk in self._history(2)], all_ids)
+        start = rows[3]['start_time']
+        self.assertEqual(
+            [record['id'] for record in archive.records(start, archive.next_month(first))],
+            [row['id'] for row in rows[3:]],
+        )
+        
+        # An index out of step with the file falls back to reading the month whole
+        index = archive.read_index()
+        index[month]['size'] = 0
+        with open(archive.archive_dir() / archive.INDEX_FILE, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        self.assertEqual([pk for _, pk in self._history(2)], all_ids)
+    
+    def test_history_reads_archived_months(self):
+        """Test that the history page and its JSON feed continue into the archive"""
+        self._archive()
+        response = self.client.get(reverse('history'))
+        self.assertEqual(len(response.context['logs']), 7)
+        self.assertContains(response, 'Pháo 1')
+        # The unit-less log links to the first unit of its device
+        self.assertContains(response, reverse('device_detail', args=['DEVICE002']))
+        
+        data = self.client.get(reverse('api_history')).json()
+        self.assertEqual(len(data['logs']), 7)
+        self.assertEqual(data['logs'][-1]['device_unit'], 'Khối 1')
+        
+        # A log backdated into an archived month after the run is merged in order
+        self._log(self.device, self.old_starts[0] + timedelta(hours=12), unit=self.unit)
+        backdated = OperationLog.objects.latest('pk').pk
+        positions = self._history(3)
+        self.assertEqual(len({pk for _, pk in positions}), 8)
+        self.assertEqual(positions, sorted(positions, reverse=True))
+        self.assertEqual([pk for _, pk in positions][6], backdated)
+    
+    async def test_async_history_reads_archived_months(self):
+        """Test that the async history view continues into the archive too"""
+        from asgiref.sync import sync_to_async
+        from django.test import AsyncRequestFactory
+        from .async_views import history
+        
+        await sync_to_async(self._archive)()
+        response = await history(AsyncRequestFactory().get('/history/'))
+        self.assertContains(response, 'Pháo 1')
+        self.assertEqual(response.content.decode().count('Thủy thủ A'), 7)
+    
+    def test_export_includes_archived_months(self):
+        """Test that exports whose range reaches the archive include its logs"""
+        import csv
+        
+        self._archive()
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('export_logs'))
+        rows = list(csv.reader(b''.join(response.streaming_content).decode('utf-8-sig').splitlines()))
+        self.assertEqual(len(rows), 8)
+        self.assertEqual([row[1] for row in rows[1:]], sorted(row[1] for row in rows[1:]))
+        self.assertEqual(rows[1][4:9], ['Hệ thống chính', 'Động cơ chính', 'Khối 1', 'DEVICE001', 'Khoang máy'])
+        
+        day = timezone.localtime(self.old_starts[2]).date().isoformat()
+        response = self.client.get(reverse('export_logs'), {'from': day, 'to': day})
+        self.assertEqual(len(b''.join(response.streaming_content).decode('utf-8-sig').splitlines()), 2)
+        response = self.client.get(reverse('export_logs'), {'department': self.dept.pk})
+        self.assertEqual(len(b''.join(response.streaming_content).decode('utf-8-sig').splitlines()), 7)
+    
+    def test_reconcile_and_rebuild_count_archived_logs(self):
+        """Test that reconcile_hours and rebuild_usage_rollup see archived logs"""
+        from io import StringIO
+        from django.core.management import call_command
+        
+        usage = sorted(DailyUsage.objects.values_list('device_id', 'day', 'hours', 'log_count'))
+        self._archive()
+        out = StringIO()
+        call_command('reconcile_hours', '--units', stdout=out)
+        self.assertIn('0 thiết bị và 0 khối', out.getvalue())
+        
+        DailyUsage.objects.all().delete()
+        call_command('rebuild_usage_rollup', stdout=StringIO())
+        self.assertEqual(sorted(DailyUsage.objects.values_list('device_id', 'day', 'hours', 'log_count')), usage)
+    
+    def test_age_must_cover_forecast_window(self):
+        """Test that logs the maintenance forecast reads cannot be archived"""
+        from django.core.management.base import CommandError
+        
+        with self.assertRaises(CommandError):
+            self._archive('--days', '7')
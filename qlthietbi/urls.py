@@ -1,12 +1,33 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# Under ASGI, the scan and logging hot paths can use the async views
+hot_views = async_views if getattr(settings, 'QLTHIETBI_ASYNC_VIEWS', False) else views
 
 urlpatterns = [
-    path('', views.dashboard, name='dashboard'),
+    path('', hot_views.dashboard, name='dashboard'),
     path('quet-ma/', views.scan, name='scan'),
     path('offline/', views.offline, name='offline'),
-    path('thiet-bi/<str:qr_code>/', views.device_detail, name='device_detail'),
+    path('ngoai-tuyen/khoi/', views.offline_unit, name='offline_unit'),
+    path('serviceworker.js', views.serviceworker, name='serviceworker'),
+    path('thiet-bi/<str:qr_code>/', hot_views.device_detail, name='device_detail'),
+    path('api/thiet-bi/<int:device_id>/', views.api_device, name='api_device'),
+    path('api/thiet-bi/<int:device_id>/nhat-ky/', views.api_device_logs, name='api_device_logs'),
+    path('api/khoi/<str:qr_code>/', views.api_unit, name='api_unit'),
+    path('ma-qr/<str:qr_code>.png', views.unit_qr_image, {'fmt': 'png'}, name='unit_qr_png'),
+    path('ma-qr/<str:qr_code>.svg', views.unit_qr_image, {'fmt': 'svg'}, name='unit_qr_svg'),
     path('ghi-nhat-ky/<str:qr_code>/', views.log_entry, name='log_entry'),
-    path('api/ghi-nhat-ky/<str:qr_code>/', views.api_log_entry, name='api_log_entry'),
-    path('lich-su/', views.history, name='history'),
+    path('api/ghi-nhat-ky/<str:qr_code>/', hot_views.api_log_entry, name='api_log_entry'),
+    path('api/dong-bo-nhat-ky/', views.api_batch_log_entry, name='api_batch_log_entry'),
+    path('api/dong-bo/du-lieu/', views.api_fleet_snapshot, name='api_fleet_snapshot'),
+    path('api/dong-bo/thay-doi/', views.api_fleet_changes, name='api_fleet_changes'),
+    path('lich-su/', hot_views.history, name='history'),
+    path('api/lich-su/', views.api_history, name='api_history'),
+    path('xuat-nhat-ky/', views.export_logs, name='export_logs'),
+    path('bao-cao/', views.usage_report, name='usage_report'),
+    path('api/thong-ke-su-dung/', views.api_usage, name='api_usage'),
+    path('du-bao-bao-duong/', views.maintenance_forecast, name='maintenance_forecast'),
+    path('api/du-bao-bao-duong/', views.api_maintenance_forecast, name='api_maintenance_forecast'),
+    path('metrics', views.metrics, name='metrics'),
 ]
@@ -0,0 +1,68 @@
+"""Per-day usage rollup helpers.
+
+A log's running time is split at local midnights and accumulated per
+``(device, unit, day)``; ``DailyUsage`` stores those totals so reports sum a
+few rows per day instead of rescanning ``OperationLog``. Each log counts
+once (``log_count`` and its status count) on the day it started.
+"""
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+STATUS_COUNT_FIELDS = {
+    'NORMAL': 'normal_count',
+    'MAINTENANCE': 'maintenance_count',
+    'ERROR': 'error_count',
+}
+PERIODS = ('day', 'week', 'month')
+
+
+def _aware(moment):
+    # Naive datetimes are stored in the default time zone; read them the same way
+    return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
+
+def _next_midnight(moment):
+    day = timezone.localtime(moment).date() + timedelta(days=1)
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def split_by_day(start_time, end_time, hours):
+    """Yield ``(local date, hours)`` slices of a run; slices add up to ``hours``"""
+    start_time, end_time = _aware(start_time), _aware(end_time)
+    total = (end_time - start_time).total_seconds()
+    if total <= 0 or not hours:
+        return
+    cursor = start_time
+    while cursor < end_time:
+        boundary = min(_next_midnight(cursor), end_time)
+        yield timezone.localtime(cursor).date(), hours * (boundary - cursor).total_seconds() / total
+        cursor = boundary
+
+
+def empty_totals():
+    totals = {'hours': 0.0, 'log_count': 0}
+    totals.update((name, 0) for name in STATUS_COUNT_FIELDS.values())
+    return totals
+
+
+def accumulate(logs, rollup=None):
+    """Add logs to a ``{(device_id, unit_id, day): totals}`` dict and return it.
+
+    Logs only need ``device_id``, ``device_unit_id``, ``start_time``,
+    ``end_time``, ``duration`` and ``device_status``; logs without a
+    duration are skipped.
+    """
+    rollup = {} if rollup is None else rollup
+    for log in logs:
+        first = True
+        for day, hours in split_by_day(log.start_time, log.end_time, log.duration):
+            totals = rollup.setdefault((log.device_id, log.device_unit_id, day), empty_totals())
+            totals['hours'] += hours
+            if first:
+                totals['log_count'] += 1
+                status_field = STATUS_COUNT_FIELDS.get(log.device_status)
+                if status_field:
+                    totals[status_field] += 1
+                first = False
+    return rollup
@@ -1,27 +1,216 @@
-from django.shortcuts import render, get_object_or_404, redirect
+from django.conf import settings
+from django.shortcuts import render, redirect
 from django.contrib import messages
 from django.views.decorators.http import require_http_methods
-from django.http import JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.staticfiles import finders
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse, StreamingHttpResponse,
+)
+from django.urls import reverse
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DateField, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, Trunc
 import json
-from datetime import datetime
-from .models import Device, DeviceUnit, OperationLog, Location
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+from .archive import history_page
+from .cache import DASHBOARD_CACHE_KEY, DASHBOARD_CACHE_TIMEOUT, get_unit_payload, invalidate_dashboard, invalidate_devices
+from .forecast import HORIZON_DAYS, forecast
+from .metrics import registry as metrics_registry
+from .exporter import (
+    FORMATS as EXPORT_FORMATS, XLSX_VIEW_MAX_ROWS, ExportTooLargeError, check_export_size, export_rows, iter_csv,
+    parse_date, write_xlsx,
+)
+from .models import DailyUsage, Department, Device, DeviceUnit, OperationLog, Location
+from .overlaps import conflicts
+from .usage import PERIODS as USAGE_PERIODS
+from .sync import changes_since, current_version, snapshot
+from .qr import CONTENT_TYPES as QR_CONTENT_TYPES, qr_etag, render_qr
+
+# Addresses allowed to scrape /metrics without logging in as staff. None by
+# default: behind a reverse proxy on the same host every request comes from
+# 127.0.0.1, so loopback would open the endpoint to everyone
+METRICS_DEFAULT_IPS = ()
+
+# Upper bound on the number of logs accepted by one batch sync request
+BATCH_SYNC_MAX_LOGS = 500
+
+# A QR image URL always renders the same picture, so clients may keep it for a year
+QR_MAX_AGE = 365 * 24 * 3600
+
+# Usage reports cover the last 30 days unless a range is given
+USAGE_DEFAULT_DAYS = 30
+
+# Units shown in the dashboard's "due soon" card and the forecast API cap
+DASHBOARD_DUE_SOON = 5
+FORECAST_MAX_LIMIT = 1000
+
+# Logs returned by the per-device JSON API
+DEVICE_RECENT_LOGS = 20
+
+# Limits of submitted log fields
+DEVICE_STATUSES = {value for value, _ in OperationLog.DEVICE_STATUS_CHOICES}
+OPERATOR_NAME_MAX_LENGTH = OperationLog._meta.get_field('operator_name').max_length
+NOTES_MAX_LENGTH = 2000
+
+
+def _parse_log_data(data):
+    """Validate a submitted log payload.
+
+    Returns ``(fields, None)`` with the cleaned OperationLog fields, or
+    ``(None, message)`` with a Vietnamese error message.
+    """
+    if not isinstance(data, dict):
+        return None, 'Dữ liệu không hợp lệ'
+
+    text_fields = ('operator_name', 'start_time', 'end_time', 'device_status', 'notes')
+    if any(data.get(name) is not None and not isinstance(data.get(name), str) for name in text_fields):
+        return None, 'Dữ liệu không hợp lệ'
+
+    operator_name = (data.get('operator_name') or '').strip()
+    start_time_str = data.get('start_time') or ''
+    end_time_str = data.get('end_time') or ''
+    device_status = data.get('device_status') or 'NORMAL'
+    notes = (data.get('notes') or '').strip()
+
+    if not all([operator_name, start_time_str, end_time_str]):
+        return None, 'Vui lòng điền đầy đủ thông tin'
+    if len(operator_name) > OPERATOR_NAME_MAX_LENGTH:
+        return None, f'Tên người thực hiện tối đa {OPERATOR_NAME_MAX_LENGTH} ký tự'
+    if len(notes) > NOTES_MAX_LENGTH:
+        return None, f'Ghi chú tối đa {NOTES_MAX_LENGTH} ký tự'
+    if device_status not in DEVICE_STATUSES:
+        return None, 'Trạng thái thiết bị không hợp lệ'
+
+    client_id, error = _parse_client_id(data.get('client_id'))
+    if error:
+        return None, error
+
+    try:
+        start_time = datetime.fromisoformat(start_time_str.replace('Z', '+00:00'))
+        end_time = datetime.fromisoformat(end_time_str.replace('Z', '+00:00'))
+    except ValueError:
+        return None, 'Định dạng thời gian không hợp lệ'
+
+    # Times without an offset are local, as when Django stores them
+    if timezone.is_naive(start_time):
+        start_time = timezone.make_aware(start_time)
+    if timezone.is_naive(end_time):
+        end_time = timezone.make_aware(end_time)
+
+    if end_time <= start_time:
+        return None, 'Giờ tắt máy phải sau giờ nổ máy'
+
+    return {
+        'operator_name': operator_name,
+        'start_time': start_time,
+        'end_time': end_time,
+        'device_status': device_status,
+        'notes': notes,
+        'client_id': client_id,
+    }, None
+
+
+def _parse_client_id(value):
+    """Optional idempotency key of a submission: ``(UUID or None, error message)``"""
+    if not value:
+        return None, None
+    try:
+        return uuid.UUID(str(value)), None
+    except ValueError:
+        return None, 'Mã nhật ký (client_id) không hợp lệ'
+
+
+def _existing_log(client_id):
+    """Log already stored for an idempotency key, or None"""
+    if client_id is None:
+        return None
+    return OperationLog.objects.filter(client_id=client_id).first()
+
+
+def _save_new_log(log):
+    """Save a log; if a concurrent retry stored the same key first, return that one.
+
+    The losing insert rolls back with its hour updates (``OperationLog.save``
+    is atomic), so counters are only ever added once per key.
+    """
+    try:
+        log.save()
+    except IntegrityError:
+        existing = _existing_log(log.client_id)
+        if existing is None:
+            raise
+        return existing, False
+    return log, True
+
+
+def _save_unless_overlapping(log):
+    """Save a new log unless it overlaps a stored run: ``(log, created, overlap)``.
+
+    The check and the insert run in one transaction that first writes the
+    device row, which locks it (on SQLite, the whole database) until the
+    commit: a concurrent submission for the device waits and then sees this
+    log. A key stored meanwhile is answered with its log, ``created`` False.
+    """
+    with transaction.atomic():
+        Device.objects.filter(pk=log.device_id).update(version=F('version'))
+        existing = _existing_log(log.client_id)
+        if existing:
+            return existing, False, None
+        overlap = OperationLog.find_overlap(log.device_id, log.start_time, log.end_time)
+        if overlap:
+            return None, False, overlap
+        log, created = _save_new_log(log)
+    return log, created, None
+
+
+def _log_result(log, created=True):
+    return {
+        'success': True,
+        'message': 'Nhật ký vận hành đã được lưu thành công' if created else 'Nhật ký này đã được lưu trước đó',
+        'log_id': log.id,
+        'duration': log.duration,
+        'device_status': log.get_device_status_display(),
+        'duplicate': not created,
+    }
+
+
+def _log_list_queryset():
+    """Operation logs with device/unit joined and the QR code used for the detail link.
+
+    Logs created in the admin have no unit; they link to the first unit of
+    their device, resolved in the same query.
+    """
+    first_unit_qr = DeviceUnit.objects.filter(device=OuterRef('device')).order_by('pk').values('qr_code')[:1]
+    return OperationLog.objects.select_related('device', 'device_unit').annotate(
+        detail_qr_code=Coalesce('device_unit__qr_code', Subquery(first_unit_qr))
+    )
+
+
+def _build_dashboard_summary():
+    """Status breakdown (one grouped aggregate), units due for maintenance
+    soonest and the 10 most recent logs"""
+    status_counts = dict(
+        DeviceUnit.objects.values_list('status').annotate(count=Count('id')).order_by()
+    )
+    return {
+        'normal_count': status_counts.get('NORMAL', 0),
+        'maintenance_count': status_counts.get('MAINTENANCE', 0),
+        'error_count': status_counts.get('ERROR', 0),
+        'due_soon': forecast(limit=DASHBOARD_DUE_SOON),
+        'recent_logs': list(_log_list_queryset().order_by('-start_time')[:10]),
+    }
+
 
 @require_http_methods(["GET"])
 def dashboard(request):
     """Dashboard view - shows summary cards and recent logs"""
-    normal_count = DeviceUnit.objects.filter(status='NORMAL').count()
-    maintenance_count = DeviceUnit.objects.filter(status='MAINTENANCE').count()
-    error_count = DeviceUnit.objects.filter(status='ERROR').count()
-    
-    recent_logs = OperationLog.objects.all().order_by('-start_time')[:10]
-    
-    context = {
-        'normal_count': normal_count,
-        'maintenance_count': maintenance_count,
-        'error_count': error_count,
-        'recent_logs': recent_logs,
-    }
+    context = cache.get_or_set(DASHBOARD_CACHE_KEY, _build_dashboard_summary, DASHBOARD_CACHE_TIMEOUT)
     return render(request, 'qlthietbi/dashboard.html', context)
 
 @require_http_methods(["GET"])
@@ -34,62 +223,97 @@ def offline(request):
     """Offline fallback view - shown when network is unavailable"""
     return render(request, 'qlthietbi/offline.html')
 
+@require_http_methods(["GET"])
+def offline_unit(request):
+    """Shell page the service worker serves for scans of never-visited units.
+
+    It renders the unit from the fleet copy kept in IndexedDB, using the QR
+    code in the page URL.
+    """
+    return render(request, 'qlthietbi/offline_unit.html')
+
+@require_http_methods(["GET"])
+def serviceworker(request):
+    """The service worker, served from the root so its scope covers every page"""
+    path = finders.find('serviceworker.js')
+    if path is None:
+        raise Http404("Không tìm thấy service worker")
+    with open(path, 'rb') as script:
+        response = HttpResponse(script.read(), content_type='application/javascript')
+    # Browsers must notice a new worker on the next visit
+    patch_cache_control(response, no_cache=True)
+    return response
+
+def _scanned_unit(qr_code):
+    """Cached scan payload for a QR code; 404 if the code is unknown"""
+    payload = get_unit_payload(qr_code)
+    if payload is None:
+        raise Http404("Không tìm thấy thiết bị")
+    return payload
+
+
 @require_http_methods(["GET"])
 def device_detail(request, qr_code):
     """Device detail view - shows device and units after QR scan"""
-    device_unit = get_object_or_404(DeviceUnit, qr_code=qr_code)
-    device = device_unit.device
-    all_units = device.units.all()
+    payload = _scanned_unit(qr_code)
     
     context = {
-        'device': device,
-        'device_unit': device_unit,
-        'all_units': all_units,
+        'device': payload['device'],
+        'device_unit': payload['device_unit'],
+        'all_units': payload['all_units'],
     }
     return render(request, 'qlthietbi/device_detail.html', context)
 
+@require_http_methods(["GET", "HEAD"])
+def unit_qr_image(request, qr_code, fmt):
+    """Render a unit's QR code on the fly (PNG or SVG).
+
+    The image depends only on the code, so responses carry a strong ETag and
+    an immutable Cache-Control; revalidations are answered with 304 before
+    touching the database.
+    """
+    etag = qr_etag(qr_code, fmt)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        if not DeviceUnit.objects.filter(qr_code=qr_code).exists():
+            raise Http404("Không tìm thấy thiết bị")
+        response = HttpResponse(render_qr(qr_code, fmt), content_type=QR_CONTENT_TYPES[fmt])
+    response.headers['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=QR_MAX_AGE, immutable=True)
+    return response
+
 @require_http_methods(["GET", "POST"])
 def log_entry(request, qr_code):
     """Log entry form view - for recording operation logs"""
-    device_unit = get_object_or_404(DeviceUnit, qr_code=qr_code)
-    device = device_unit.device
+    payload = _scanned_unit(qr_code)
+    device_unit = payload['device_unit']
+    device = payload['device']
     
     if request.method == 'POST':
-        operator_name = request.POST.get('operator_name', '').strip()
-        start_time_str = request.POST.get('start_time', '')
-        end_time_str = request.POST.get('end_time', '')
-        device_status = request.POST.get('device_status', 'NORMAL')
-        notes = request.POST.get('notes', '').strip()
-        
-        if not operator_name or not start_time_str or not end_time_str:
-            messages.error(request, 'Vui lòng điền đầy đủ thông tin')
+        # datetime-local inputs post times without an offset: they are read as local times
+        fields, error = _parse_log_data(request.POST.dict())
+        if error:
+            messages.error(request, error)
             return redirect('log_entry', qr_code=qr_code)
         
+        # The form carries a key generated on page load: a second tap or a resent POST is a no-op
+        if _existing_log(fields['client_id']):
+            messages.info(request, 'Nhật ký này đã được lưu trước đó')
+            return redirect('device_detail', qr_code=qr_code)
+        
         try:
-            # Parse datetime strings to datetime objects
-            try:
-                start_time = datetime.fromisoformat(start_time_str.replace('Z', '+00:00'))
-                end_time = datetime.fromisoformat(end_time_str.replace('Z', '+00:00'))
-            except (ValueError, AttributeError):
-                messages.error(request, 'Định dạng thời gian không hợp lệ')
-                return redirect('log_entry', qr_code=qr_code)
-            
-            # Validate time order
-            if end_time <= start_time:
-                messages.error(request, 'Giờ tắt máy phải sau giờ nổ máy')
+            # Reject double submissions and runs overlapping an existing log
+            _, created, overlap = _save_unless_overlapping(
+                OperationLog(device=device, device_unit=device_unit, **fields)
+            )
+            if overlap:
+                messages.error(request, overlap.overlap_message())
                 return redirect('log_entry', qr_code=qr_code)
             
-            log = OperationLog(
-                device=device,
-                device_unit=device_unit,
-                operator_name=operator_name,
-                start_time=start_time,
-                end_time=end_time,
-                device_status=device_status,
-                notes=notes,
-            )
-            log.save()
-            messages.success(request, 'Nhật ký vận hành đã được lưu thành công')
+            if created:
+                messages.success(request, 'Nhật ký vận hành đã được lưu thành công')
+            else:
+                messages.info(request, 'Nhật ký này đã được lưu trước đó')
             return redirect('device_detail', qr_code=qr_code)
         except Exception as e:
             messages.error(request, f'Lỗi: {str(e)}')
@@ -101,22 +325,362 @@ def log_entry(request, qr_code):
     }
     return render(request, 'qlthietbi/log_entry.html', context)
 
+def _serialize_log(log):
+    return {
+        'id': log.id,
+        'device': log.device.name,
+        'device_unit': log.device_unit.name if log.device_unit else None,
+        'qr_code': log.detail_qr_code,
+        'operator_name': log.operator_name,
+        'start_time': log.start_time.isoformat(),
+        'end_time': log.end_time.isoformat(),
+        # Formatted in the server's zone, like the rows the history template renders
+        'start_time_display': timezone.localtime(log.start_time).strftime('%d/%m %H:%M'),
+        'end_time_display': timezone.localtime(log.end_time).strftime('%d/%m %H:%M'),
+        'duration': log.duration,
+        'device_status': log.device_status,
+        'device_status_display': log.get_device_status_display(),
+    }
+
+
+def _serialize_unit(unit):
+    return {
+        'id': unit.id,
+        'name': unit.name,
+        'qr_code': unit.qr_code,
+        'qr_svg': reverse('unit_qr_svg', args=[unit.qr_code]),
+        'location': unit.location.name if unit.location else None,
+        'current_hours': unit.current_hours,
+        'maintenance_threshold': unit.maintenance_threshold,
+        'status': unit.status,
+        'status_display': unit.get_status_display(),
+    }
+
+
+def _serialize_device(device, units):
+    return {
+        'id': device.id,
+        'name': device.name,
+        'department': device.department.name,
+        'description': device.description,
+        'total_system_hours': device.total_system_hours,
+        'version': device.version,
+        'units': [_serialize_unit(unit) for unit in units],
+    }
+
+
+def _with_etag(response, etag):
+    # Clients may store the data but must revalidate it on every use
+    response.headers['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _device_version(device_id):
+    return Device.objects.filter(pk=device_id).values_list('version', flat=True).first()
+
+
+@require_http_methods(["GET", "HEAD"])
+def api_device(request, device_id):
+    """Device with its units as JSON; ETag from the device version, 304 when unchanged"""
+    version = _device_version(device_id)
+    if version is None:
+        return JsonResponse({'success': False, 'message': 'Không tìm thấy thiết bị'}, status=404)
+    response = get_conditional_response(request, etag=f'"device-{device_id}-v{version}"')
+    if response is None:
+        device = Device.objects.select_related('department').get(pk=device_id)
+        units = device.units.select_related('location').order_by('pk')
+        response = JsonResponse({'success': True, 'device': _serialize_device(device, units)})
+        version = device.version
+    return _with_etag(response, f'"device-{device_id}-v{version}"')
+
+
+@require_http_methods(["GET", "HEAD"])
+def api_unit(request, qr_code):
+    """Scanned unit with its device and siblings as JSON.
+
+    Served from the scan payload cache, so a revalidation usually costs no
+    query at all.
+    """
+    payload = get_unit_payload(qr_code)
+    if payload is None:
+        return JsonResponse({'success': False, 'message': 'Không tìm thấy thiết bị'}, status=404)
+    device, unit = payload['device'], payload['device_unit']
+    etag = f'"unit-{unit.id}-v{device.version}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse({
+            'success': True,
+            'unit': _serialize_unit(unit),
+            'device': _serialize_device(device, payload['all_units']),
+        })
+    return _with_etag(response, etag)
+
+
+@require_http_methods(["GET", "HEAD"])
+def api_device_logs(request, device_id):
+    """Most recent logs of a device as JSON; ETag from the device version"""
+    version = _device_version(device_id)
+    if version is None:
+        return JsonResponse({'success': False, 'message': 'Không tìm thấy thiết bị'}, status=404)
+    etag = f'"device-logs-{device_id}-v{version}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        logs = _log_list_queryset().filter(device_id=device_id).order_by('-start_time', '-id')[:DEVICE_RECENT_LOGS]
+        response = JsonResponse({'success': True, 'logs': [_serialize_log(log) for log in logs]})
+    return _with_etag(response, etag)
+
+
+@require_http_methods(["GET", "HEAD"])
+def api_fleet_snapshot(request):
+    """All departments, locations, devices and units for the offline copy.
+
+    The ETag is the sync version, so an up-to-date client gets a 304.
+    """
+    version = current_version()
+    etag = f'"fleet-{version}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse({'success': True, **snapshot(version)})
+    return _with_etag(response, etag)
+
+
+@require_http_methods(["GET"])
+def api_fleet_changes(request):
+    """Rows changed and ids deleted since version ``since``.
+
+    ``full`` is true when the client is too far behind and the payload is a
+    snapshot to replace its copy with.
+    """
+    try:
+        since = int(request.GET.get('since', 0))
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'Phiên bản không hợp lệ'}, status=400)
+    response = JsonResponse({'success': True, **changes_since(since)})
+    patch_cache_control(response, private=True, no_store=True)
+    return response
+
+
 @require_http_methods(["GET"])
 def history(request):
-    """History view - displays all operation logs"""
-    logs = OperationLog.objects.all().order_by('-start_time')
+    """History view - displays operation logs, one keyset page at a time"""
+    logs, next_cursor = history_page(_log_list_queryset(), request.GET.get('cursor'))
     
     context = {
         'logs': logs,
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('cursor'),
     }
     return render(request, 'qlthietbi/history.html', context)
 
+
+@require_http_methods(["GET"])
+def api_history(request):
+    """JSON variant of history for infinite scroll"""
+    logs, next_cursor = history_page(_log_list_queryset(), request.GET.get('cursor'))
+    return JsonResponse({
+        'success': True,
+        'logs': [_serialize_log(log) for log in logs],
+        'next_cursor': next_cursor,
+    })
+
+@staff_member_required
+@require_http_methods(["GET"])
+def export_logs(request):
+    """Stream the operation log as CSV or XLSX.
+
+    Query parameters: ``from``/``to`` (YYYY-MM-DD, inclusive, on start time),
+    ``department`` (id) and ``format`` (csv or xlsx).
+    """
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return HttpResponseBadRequest('Định dạng không hỗ trợ')
+    try:
+        date_from = parse_date(request.GET.get('from'))
+        date_to = parse_date(request.GET.get('to'))
+        department_id = int(request.GET['department']) if request.GET.get('department') else None
+    except ValueError:
+        return HttpResponseBadRequest('Bộ lọc không hợp lệ (ngày theo dạng YYYY-MM-DD)')
+
+    rows = export_rows(date_from, date_to, department_id)
+    if fmt == 'csv':
+        response = StreamingHttpResponse(iter_csv(rows), content_type='text/csv; charset=utf-8')
+    else:
+        # XLSX is a zip archive and cannot be streamed; openpyxl's write-only
+        # mode spools rows to disk, so memory stays flat. It is built before
+        # the response, so large exports are sent to CSV or the command.
+        try:
+            check_export_size(
+                getattr(settings, 'QLTHIETBI_XLSX_EXPORT_MAX_ROWS', XLSX_VIEW_MAX_ROWS),
+                date_from, date_to, department_id,
+            )
+        except ExportTooLargeError as e:
+            return HttpResponseBadRequest(str(e))
+        spool = tempfile.TemporaryFile()
+        write_xlsx(rows, spool)
+        spool.seek(0)
+        response = FileResponse(
+            spool,
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        )
+    response['Content-Disposition'] = f'attachment; filename="nhat-ky-van-hanh.{fmt}"'
+    return response
+
+def _forecast_params(params):
+    """Parse ``days`` (horizon, or ``all``) and ``limit``; raises ValueError"""
+    days = params.get('days') or str(HORIZON_DAYS)
+    horizon_days = None if days == 'all' else int(days)
+    limit = min(int(params.get('limit') or FORECAST_MAX_LIMIT), FORECAST_MAX_LIMIT)
+    if (horizon_days is not None and horizon_days < 0) or limit < 1:
+        raise ValueError(days)
+    return horizon_days, limit
+
+
+@require_http_methods(["GET"])
+def maintenance_forecast(request):
+    """Due soon view - units sorted by projected maintenance date"""
+    try:
+        horizon_days, limit = _forecast_params(request.GET)
+    except ValueError:
+        messages.error(request, 'Khoảng dự báo không hợp lệ')
+        horizon_days, limit = HORIZON_DAYS, FORECAST_MAX_LIMIT
+
+    context = {
+        'forecasts': forecast(horizon_days=horizon_days, limit=limit),
+        'horizon_days': horizon_days,
+    }
+    return render(request, 'qlthietbi/maintenance_forecast.html', context)
+
+
+@require_http_methods(["GET"])
+def api_maintenance_forecast(request):
+    """JSON variant of maintenance_forecast"""
+    try:
+        horizon_days, limit = _forecast_params(request.GET)
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'Khoảng dự báo không hợp lệ'}, status=400)
+
+    return JsonResponse({
+        'success': True,
+        'horizon_days': horizon_days,
+        'units': [item.as_dict() for item in forecast(horizon_days=horizon_days, limit=limit)],
+    })
+
+
+def _usage_filters(params):
+    """Parse report filters: ``period``, ``from``/``to`` (inclusive days),
+    ``department`` and ``device`` ids. Returns ``(filters, None)`` or
+    ``(None, message)``.
+    """
+    period = params.get('period') or 'day'
+    if period not in USAGE_PERIODS:
+        return None, 'Chu kỳ không hợp lệ (day, week, month)'
+    try:
+        date_to = parse_date(params.get('to')) or timezone.localdate()
+        date_from = parse_date(params.get('from')) or date_to - timedelta(days=USAGE_DEFAULT_DAYS - 1)
+        department_id = int(params['department']) if params.get('department') else None
+        device_id = int(params['device']) if params.get('device') else None
+    except ValueError:
+        return None, 'Bộ lọc không hợp lệ (ngày theo dạng YYYY-MM-DD)'
+    if date_from > date_to:
+        return None, 'Ngày bắt đầu phải trước ngày kết thúc'
+    return {
+        'period': period,
+        'date_from': date_from,
+        'date_to': date_to,
+        'department_id': department_id,
+        'device_id': device_id,
+    }, None
+
+
+def _usage_queryset(filters):
+    usage = DailyUsage.objects.filter(day__gte=filters['date_from'], day__lte=filters['date_to'])
+    if filters['department_id']:
+        usage = usage.filter(device__department_id=filters['department_id'])
+    if filters['device_id']:
+        usage = usage.filter(device_id=filters['device_id'])
+    return usage
+
+
+def _usage_totals(usage, *group_by):
+    """Sum the rollup rows grouped by ``group_by``, largest totals first"""
+    return [
+        dict(row, hours=round(row['hours'], 2))
+        for row in usage.values(*group_by).annotate(
+            hours=Sum('hours'),
+            log_count=Sum('log_count'),
+            maintenance_count=Sum('maintenance_count'),
+            error_count=Sum('error_count'),
+        ).order_by(*group_by)
+    ]
+
+
+def _usage_series(filters):
+    """Per-period, per-department totals read from the DailyUsage rollup"""
+    usage = _usage_queryset(filters).annotate(
+        period=Trunc('day', filters['period'], output_field=DateField())
+    )
+    return _usage_totals(usage, 'period', 'device__department_id', 'device__department__name')
+
+
+@require_http_methods(["GET"])
+def usage_report(request):
+    """Usage report - running hours per department and device over a date range"""
+    filters, error = _usage_filters(request.GET)
+    if error:
+        messages.error(request, error)
+        filters, _ = _usage_filters({})
+
+    device_totals = sorted(
+        _usage_totals(_usage_queryset(filters), 'device_id', 'device__name', 'device__department__name'),
+        key=lambda row: row['hours'],
+        reverse=True,
+    )
+    context = {
+        'filters': filters,
+        'periods': USAGE_PERIODS,
+        'series': _usage_series(filters),
+        'device_totals': device_totals,
+        'total_hours': round(sum(row['hours'] for row in device_totals), 2),
+        'departments': Department.objects.order_by('name'),
+    }
+    return render(request, 'qlthietbi/usage_report.html', context)
+
+
+@require_http_methods(["GET"])
+def api_usage(request):
+    """JSON usage series for charts; same filters as usage_report"""
+    filters, error = _usage_filters(request.GET)
+    if error:
+        return JsonResponse({'success': False, 'message': error}, status=400)
+    return JsonResponse({
+        'success': True,
+        'period': filters['period'],
+        'from': filters['date_from'].isoformat(),
+        'to': filters['date_to'].isoformat(),
+        'series': [
+            {
+                'period': row['period'].isoformat(),
+                'department_id': row['device__department_id'],
+                'department': row['device__department__name'],
+                'hours': row['hours'],
+                'log_count': row['log_count'],
+                'maintenance_count': row['maintenance_count'],
+                'error_count': row['error_count'],
+            }
+            for row in _usage_series(filters)
+        ],
+    })
+
 @require_http_methods(["POST"])
 def api_log_entry(request, qr_code):
     """API endpoint for submitting operation logs (AJAX support for offline sync)"""
     try:
-        device_unit = get_object_or_404(DeviceUnit, qr_code=qr_code)
-        device = device_unit.device
+        payload = get_unit_payload(qr_code)
+        if payload is None:
+            return JsonResponse({'success': False, 'message': 'Không tìm thấy thiết bị'}, status=404)
+        device_unit = payload['device_unit']
+        device = payload['device']
         
         # Parse JSON body
         try:
@@ -127,55 +691,24 @@ def api_log_entry(request, qr_code):
                 status=400
             )
         
-        operator_name = data.get('operator_name', '').strip()
-        start_time_str = data.get('start_time', '')
-        end_time_str = data.get('end_time', '')
-        device_status = data.get('device_status', 'NORMAL')
-        notes = data.get('notes', '').strip()
-        
-        # Validation
-        if not all([operator_name, start_time_str, end_time_str]):
-            return JsonResponse(
-                {'success': False, 'message': 'Vui lòng điền đầy đủ thông tin'},
-                status=400
-            )
+        fields, error = _parse_log_data(data)
+        if error:
+            return JsonResponse({'success': False, 'message': error}, status=400)
         
-        # Parse datetime strings
-        try:
-            start_time = datetime.fromisoformat(start_time_str.replace('Z', '+00:00'))
-            end_time = datetime.fromisoformat(end_time_str.replace('Z', '+00:00'))
-        except (ValueError, AttributeError):
-            return JsonResponse(
-                {'success': False, 'message': 'Định dạng thời gian không hợp lệ'},
-                status=400
-            )
+        # A retry of a stored submission gets the original result; counters stay as they are
+        existing = _existing_log(fields['client_id'])
+        if existing:
+            return JsonResponse(_log_result(existing, created=False))
         
-        # Validate time order
-        if end_time <= start_time:
+        log, created, overlap = _save_unless_overlapping(
+            OperationLog(device=device, device_unit=device_unit, **fields)
+        )
+        if overlap:
             return JsonResponse(
-                {'success': False, 'message': 'Giờ tắt máy phải sau giờ nổ máy'},
-                status=400
+                {'success': False, 'message': overlap.overlap_message(), 'conflict_log_id': overlap.id},
+                status=409
             )
-        
-        # Create log
-        log = OperationLog(
-            device=device,
-            device_unit=device_unit,
-            operator_name=operator_name,
-            start_time=start_time,
-            end_time=end_time,
-            device_status=device_status,
-            notes=notes,
-        )
-        log.save()
-        
-        return JsonResponse({
-            'success': True,
-            'message': 'Nhật ký vận hành đã được lưu thành công',
-            'log_id': log.id,
-            'duration': log.duration,
-            'device_status': log.get_device_status_display(),
-        })
+        return JsonResponse(_log_result(log, created))
     
     except Exception as e:
         return JsonResponse(
@@ -183,3 +716,178 @@ def api_log_entry(request, qr_code):
             status=500
         )
 
+
+def _overlap_candidates(logs):
+    """Stored logs that may overlap any of ``logs``, fetched in one query.
+
+    Per device: the logs starting inside the batch's time span, plus the
+    last log starting before it (see OperationLog.find_overlap).
+    """
+    spans = {}
+    for log in logs:
+        low, high = spans.get(log.device_id, (log.start_time, log.end_time))
+        spans[log.device_id] = (min(low, log.start_time), max(high, log.end_time))
+    if not spans:
+        return []
+
+    query = Q()
+    for device_id, (low, high) in spans.items():
+        last_before = OperationLog.objects.filter(
+            device_id=device_id, start_time__lt=low
+        ).order_by('-start_time').values('pk')[:1]
+        query |= Q(device_id=device_id, start_time__gte=low, start_time__lt=high) | Q(pk=Subquery(last_before))
+    return list(OperationLog.objects.filter(query).only('device_id', 'operator_name', 'start_time', 'end_time'))
+
+
+@require_http_methods(["POST"])
+def api_batch_log_entry(request):
+    """Batch API for replaying many offline logs in one request.
+
+    Body: ``{"logs": [{"qr_code": ..., "operator_name": ..., "start_time": ...,
+    "end_time": ..., "device_status": ..., "notes": ..., "client_id": ...}, ...]}``.
+    Units are resolved with one query. Inside a single transaction that
+    locks the batch's devices, overlaps are checked against the stored logs
+    fetched with one more, valid logs are written with a bulk insert and the
+    hour counters are updated once per device. Returns one result per submitted item, in order.
+
+    Items whose ``client_id`` is already stored succeed with the original
+    log and ``duplicate: true`` and add no hours. If a concurrent request
+    stores one of the keys first, the whole batch fails with 500 and its
+    retry then resolves as duplicates.
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse(
+            {'success': False, 'message': 'Invalid JSON'},
+            status=400
+        )
+
+    items = data.get('logs') if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return JsonResponse(
+            {'success': False, 'message': 'Thiếu danh sách nhật ký'},
+            status=400
+        )
+    if len(items) > BATCH_SYNC_MAX_LOGS:
+        return JsonResponse(
+            {'success': False, 'message': f'Tối đa {BATCH_SYNC_MAX_LOGS} nhật ký mỗi lần đồng bộ'},
+            status=400
+        )
+
+    def _qr_code(item):
+        qr_code = item.get('qr_code') if isinstance(item, dict) else None
+        return qr_code if isinstance(qr_code, str) else None
+
+    qr_codes = {_qr_code(item) for item in items} - {None}
+    units = {
+        unit.qr_code: unit
+        for unit in DeviceUnit.objects.select_related('device').filter(qr_code__in=qr_codes)
+    }
+
+    # Items already stored under their idempotency key, found with one query
+    client_ids = set()
+    for item in items:
+        client_id, _ = _parse_client_id(item.get('client_id') if isinstance(item, dict) else None)
+        if client_id:
+            client_ids.add(client_id)
+    stored = {log.client_id: log for log in OperationLog.objects.filter(client_id__in=client_ids)} if client_ids else {}
+
+    results = []
+    pending = []  # (result index, OperationLog)
+    first_with_key = {}  # client_id -> index of the first item carrying it
+    repeats = []  # (result index, index of the first item with the same key)
+    for index, item in enumerate(items):
+        qr_code = _qr_code(item)
+        result = {'index': index, 'qr_code': qr_code, 'success': False}
+        results.append(result)
+
+        device_unit = units.get(qr_code)
+        if device_unit is None:
+            result['message'] = 'Không tìm thấy thiết bị'
+            continue
+
+        fields, error = _parse_log_data(item)
+        if error:
+            result['message'] = error
+            continue
+
+        client_id = fields['client_id']
+        if client_id in stored:
+            result.update(_log_result(stored[client_id], created=False))
+            continue
+        if client_id in first_with_key:
+            repeats.append((index, first_with_key[client_id]))
+            continue
+        if client_id:
+            first_with_key[client_id] = index
+
+        log = OperationLog(device=device_unit.device, device_unit=device_unit, **fields)
+        log.duration = OperationLog.calculate_duration(log.start_time, log.end_time)
+        pending.append((index, log))
+
+    try:
+        with transaction.atomic():
+            # Lock the devices (see _save_unless_overlapping), then drop logs
+            # overlapping a stored log or an earlier log of the same batch
+            Device.objects.filter(pk__in={log.device_id for _, log in pending}).update(version=F('version'))
+            rejected = {
+                id(log): other
+                for log, other in conflicts(_overlap_candidates([log for _, log in pending]), [log for _, log in pending])
+            }
+            for index, log in pending:
+                other = rejected.get(id(log))
+                if other is None:
+                    continue
+                if other.pk:
+                    results[index].update({'message': other.overlap_message(), 'conflict_log_id': other.pk})
+                else:
+                    results[index]['message'] = 'Trùng thời gian với nhật ký khác trong cùng lần đồng bộ'
+            pending = [(index, log) for index, log in pending if id(log) not in rejected]
+
+            # Per device: hours to add and the status reported by its last log
+            device_updates = {}
+            for _, log in pending:
+                hours, _ = device_updates.get(log.device_id, (0.0, None))
+                device_updates[log.device_id] = (hours + log.duration, log.device_status)
+
+            OperationLog.objects.bulk_create([log for _, log in pending])
+            for device_id, (hours, device_status) in device_updates.items():
+                OperationLog.add_hours(device_id, hours, device_status)
+            DailyUsage.record([log for _, log in pending])
+            # bulk_create and update() bypass the model signals
+            invalidate_dashboard()
+            invalidate_devices(list(device_updates))
+    except Exception as e:
+        return JsonResponse(
+            {'success': False, 'message': f'Lỗi: {str(e)}'},
+            status=500
+        )
+
+    for index, log in pending:
+        results[index].update(_log_result(log))
+    # A key sent twice in one batch gets the outcome of its first item
+    for index, first in repeats:
+        results[index].update({key: value for key, value in results[first].items() if key != 'index'})
+        if results[index]['success']:
+            results[index].update({'duplicate': True, 'message': 'Nhật ký này đã được lưu trước đó'})
+
+    saved = len(pending)
+    duplicates = sum(1 for result in results if result.get('duplicate'))
+    return JsonResponse({
+        'success': True,
+        'message': f'Đã đồng bộ {saved}/{len(items)} nhật ký',
+        'saved': saved,
+        'duplicates': duplicates,
+        'failed': len(items) - saved - duplicates,
+        'results': results,
+    })
+
+
+@require_http_methods(["GET"])
+def metrics(request):
+    """Per-view request metrics in the Prometheus text format"""
+    allowed_ips = getattr(settings, 'QLTHIETBI_METRICS_IPS', METRICS_DEFAULT_IPS)
+    if request.META.get('REMOTE_ADDR') not in allowed_ips and not request.user.is_staff:
+        return HttpResponseForbidden('Không có quyền xem số liệu')
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')